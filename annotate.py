@@ -0,0 +1,199 @@
+"""Aho-Corasick glossary annotation of whole documents against the termbase.
+
+The automaton is compiled from every Chinese name, English term and English
+alias.  Documents are scanned in one pass, character by character; the hits
+are then resolved leftmost-longest without overlaps.  English patterns only
+match on word boundaries so that 'qi' does not fire inside 'qigong'.  Text can
+be fed as a sequence of chunks, which keeps memory bounded for long files.
+"""
+from collections import deque
+
+from caching import StaleWhileRebuild
+from change_events import on_terms_changed
+from models import Term
+
+# Aliases shorter than this are too ambiguous to annotate with
+MIN_LATIN_PATTERN = 2
+
+
+def _fold(char):
+    lowered = char.lower()
+    return lowered if len(lowered) == 1 else char
+
+
+def _is_word_char(char):
+    return char.isascii() and char.isalnum()
+
+
+class Annotator:
+    """Compiled automaton plus the term metadata returned with each hit"""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [-1]      # pattern ending exactly at the node
+        self.output_link = [0]  # nearest suffix node that has an output
+        self.patterns = []      # (length, word_bounded, [(term_id, field)])
+        self.pattern_ids = {}
+        self.terms = {}
+        self.max_length = 0
+
+    @classmethod
+    def build(cls, rows):
+        annotator = cls()
+        for row in rows:
+            get = row.get if isinstance(row, dict) else lambda name: getattr(row, name)
+            term_id = get('id')
+            annotator.terms[term_id] = {
+                'id': term_id,
+                'chinese_simplified': get('chinese_simplified'),
+                'english_term': get('english_term'),
+                'rank': (not get('who_standard'), -(get('reliability_score') or 0), term_id),
+            }
+            aliases = (get('english_aliases') or '').split(',')
+            sources = [('chinese_simplified', get('chinese_simplified')),
+                       ('chinese_traditional', get('chinese_traditional')),
+                       ('english_term', get('english_term'))]
+            sources.extend(('english_aliases', alias) for alias in aliases)
+            for field, text in sources:
+                annotator.add_pattern((text or '').strip(), term_id, field)
+        annotator._link()
+        return annotator
+
+    @classmethod
+    def from_database(cls):
+        columns = [Term.id, Term.chinese_simplified, Term.chinese_traditional, Term.english_term,
+                   Term.english_aliases, Term.who_standard, Term.reliability_score]
+        rows = Term.query.with_entities(*columns).yield_per(1000)
+        return cls.build(row._asdict() for row in rows)
+
+    def add_pattern(self, text, term_id, field):
+        key = ''.join(_fold(char) for char in text)
+        word_bounded = any(_is_word_char(char) for char in key)
+        if not key or (word_bounded and len(key) < MIN_LATIN_PATTERN):
+            return
+        pattern = self.pattern_ids.get(key)
+        if pattern is None:
+            node = 0
+            for char in key:
+                child = self.goto[node].get(char)
+                if child is None:
+                    child = len(self.goto)
+                    self.goto[node][char] = child
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(-1)
+                    self.output_link.append(0)
+                node = child
+            pattern = self.pattern_ids[key] = len(self.patterns)
+            self.patterns.append((len(key), word_bounded, []))
+            self.output[node] = pattern
+            self.max_length = max(self.max_length, len(key))
+        targets = self.patterns[pattern][2]
+        if (term_id, field) not in targets:
+            targets.append((term_id, field))
+
+    def _link(self):
+        """Compute failure and output links breadth-first"""
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and char not in self.goto[state]:
+                    state = self.fail[state]
+                fallback = self.goto[state].get(char, 0)
+                self.fail[child] = fallback if fallback != child else 0
+                link = self.fail[child]
+                self.output_link[child] = link if self.output[link] >= 0 else self.output_link[link]
+
+    def _step(self, node, char):
+        while node and char not in self.goto[node]:
+            node = self.fail[node]
+        return self.goto[node].get(char, 0)
+
+    def _hit(self, start, end, text, pattern):
+        targets = self.patterns[pattern][2]
+        term_ids = sorted({term_id for term_id, _ in targets}, key=lambda t: self.terms[t]['rank'])
+        best = self.terms[term_ids[0]]
+        hit = {
+            'start': start,
+            'end': end,
+            'text': text,
+            'term_id': best['id'],
+            'chinese_simplified': best['chinese_simplified'],
+            'english_term': best['english_term'],
+            'matched_field': next(field for term_id, field in targets if term_id == best['id']),
+        }
+        if len(term_ids) > 1:
+            hit['candidates'] = term_ids
+        return hit
+
+    def iter_annotations(self, chunks):
+        """Yield non-overlapping, longest-match hits for text fed as ``chunks``"""
+        node = 0
+        pending = []      # (start, -length, pattern, text) awaiting resolution
+        awaiting = []     # word-bounded hits whose next character is not seen yet
+        last_end = 0
+        offset = 0        # absolute offset of the current chunk
+        tail = ''         # last max_length characters before the chunk
+        max_length = self.max_length
+
+        def resolve(limit):
+            nonlocal last_end, pending
+            pending.sort()
+            ready = [m for m in pending if limit is None or m[0] < limit]
+            pending = [m for m in pending if not (limit is None or m[0] < limit)]
+            for start, negative_length, pattern, text in ready:
+                if start >= last_end:
+                    last_end = start - negative_length
+                    yield self._hit(start, last_end, text, pattern)
+
+        for chunk in chunks:
+            if not chunk:
+                continue
+            text = tail + chunk
+            base = offset - len(tail)
+            for i in range(len(tail), len(text)):
+                char = text[i]
+                if awaiting:
+                    if not _is_word_char(char):
+                        pending.extend(awaiting)
+                    awaiting = []
+                node = self._step(node, _fold(char))
+                state = node if self.output[node] >= 0 else self.output_link[node]
+                while state:
+                    pattern = self.output[state]
+                    length, word_bounded, _ = self.patterns[pattern]
+                    start = i + 1 - length
+                    match = (base + start, -length, pattern, text[start:i + 1])
+                    if not word_bounded:
+                        pending.append(match)
+                    elif start == 0 or not _is_word_char(text[start - 1]):
+                        awaiting.append(match)
+                    state = self.output_link[state]
+            offset += len(chunk)
+            tail = text[-max_length:] if max_length else ''
+            # Every hit starting before offset - max_length has been seen
+            yield from resolve(offset - max_length)
+
+        pending.extend(awaiting)
+        yield from resolve(None)
+
+    def annotate(self, text):
+        return list(self.iter_annotations([text]))
+
+
+_annotator = StaleWhileRebuild('annotation automaton')
+
+
+def get_annotator():
+    """Return the process-wide automaton, compiling it on first use"""
+    return _annotator.get(Annotator.from_database)
+
+
+@on_terms_changed
+def reset_annotator(term_ids=None):
+    """Recompile the automaton in the background; requests use the old one meanwhile"""
+    _annotator.invalidate()
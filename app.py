@@ -1,6 +1,35 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
-from models import db, Term, Category, Suggestion
-from sqlalchemy import or_
+from flask import Flask, render_template, request, jsonify, redirect, url_for, Response, stream_with_context
+from models import db, add_missing_columns, Term, Category, Suggestion
+from search_backends import get_search_backend
+from autocomplete import get_autocomplete_index
+from http_cache import cached_term_response, response_cache
+from serializers import parse_fields, term_query_options, term_to_dict
+from annotate import get_annotator
+from category_cache import get_categories, get_category, total_term_count
+from fragment_cache import fragment
+from facets import cached_facets, facet_cache, facets_to_dict
+from sqlalchemy import and_, func, literal_column, or_
+from sqlalchemy.orm import joinedload
+from werkzeug.middleware.proxy_fix import ProxyFix
+from pagination import KeysetPagination
+from importer import guess_format, import_terms, MalformedFile, FORMATS
+from warmup import warm_up
+from related import build_related, build_related_incremental, fallback_related_query, related_terms_for
+from spelling import get_spelling_index
+from metrics import init_metrics
+from compression import init_compression
+from assets import build_assets, init_assets
+from suggestion_queue import get_suggestion_queue, rate_limiter, validate_suggestion, QueueFull, SUGGESTIONS_REJECTED
+from db_routing import configure_engines, copy_sqlite_database, replica_engines, replica_reads
+from change_log import init_change_log, prune_term_changes
+import metrics
+from search_index import load_terms
+from snapshot import compile_snapshot
+from exporter import export_terms, FORMATS as EXPORT_FORMATS, MIMETYPES as EXPORT_MIMETYPES
+from datetime import datetime
+import click
+import codecs
+import hmac
 import os
 
 app = Flask(__name__)
@@ -9,19 +38,197 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///tcm_termbase.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Connection pool, see db_routing.engine_options; sizes are ignored for SQLite
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+app.config['DB_POOL_PRE_PING'] = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+# Per-statement timeout on PostgreSQL and MySQL; 0 disables
+app.config['DB_STATEMENT_TIMEOUT_MS'] = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+# Comma-separated read replicas serving the read-only routes
+app.config['DATABASE_REPLICA_URLS'] = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+# 'database' (ilike scans), 'ngram' (in-memory index), 'snapshot' (mmap file) or 'fts' (FTS5 / pg_trgm), see search_backends.py
+app.config['SEARCH_ENGINE'] = os.environ.get('SEARCH_ENGINE', 'database')
+# Compiled termbase file of 'flask compile-snapshot', and how often workers check for a new one
+app.config['SNAPSHOT_PATH'] = os.environ.get('SNAPSHOT_PATH', os.path.join(app.instance_path, 'termbase.snapshot'))
+app.config['SNAPSHOT_CHECK_INTERVAL'] = float(os.environ.get('SNAPSHOT_CHECK_INTERVAL', 5))
+# Serve /api/search from the in-memory prefix index in autocomplete.py
+app.config['AUTOCOMPLETE_INDEX'] = os.environ.get('AUTOCOMPLETE_INDEX', '1') == '1'
+app.config['AUTOCOMPLETE_TOP_K'] = int(os.environ.get('AUTOCOMPLETE_TOP_K', 10))
+# Conditional GET and rendered-body cache for /term/<id> and /api/term/<id>
+app.config['TERM_CACHE_MAX_AGE'] = int(os.environ.get('TERM_CACHE_MAX_AGE', 300))
+app.config['RESPONSE_CACHE_SIZE'] = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))
+response_cache.maxsize = app.config['RESPONSE_CACHE_SIZE']
+# Batch retrieval limits for /api/terms
+app.config['BATCH_MAX_IDS'] = int(os.environ.get('BATCH_MAX_IDS', 5000))
+app.config['BATCH_CHUNK_SIZE'] = int(os.environ.get('BATCH_CHUNK_SIZE', 500))
+# Largest document accepted by /api/annotate without ?stream=1
+app.config['ANNOTATE_MAX_CHARS'] = int(os.environ.get('ANNOTATE_MAX_CHARS', 5 * 1024 * 1024))
+# Seconds before the cached category list and counts are reloaded
+app.config['CATEGORY_CACHE_TTL'] = int(os.environ.get('CATEGORY_CACHE_TTL', 300))
+# Rendered homepage blocks: 'memory' (per worker) or 'sqlite' (shared file), see fragment_cache.py
+app.config['FRAGMENT_CACHE'] = os.environ.get('FRAGMENT_CACHE', 'memory')
+app.config['FRAGMENT_CACHE_PATH'] = os.environ.get('FRAGMENT_CACHE_PATH', os.path.join(app.instance_path, 'fragments.sqlite'))
+app.config['FRAGMENT_CACHE_TTL'] = int(os.environ.get('FRAGMENT_CACHE_TTL', 300))
+app.config['FRAGMENT_CACHE_SIZE'] = int(os.environ.get('FRAGMENT_CACHE_SIZE', 256))
+# Steps run by warmup.warm_up() before gunicorn forks workers
+app.config['WARMUP_ANNOTATOR'] = os.environ.get('WARMUP_ANNOTATOR', '0') == '1'
+# Per-category, WHO, reliability and subcategory hit counts on /search, cached per query
+app.config['SEARCH_FACETS'] = os.environ.get('SEARCH_FACETS', '1') == '1'
+app.config['FACET_CACHE_SIZE'] = int(os.environ.get('FACET_CACHE_SIZE', 1024))
+app.config['FACET_CACHE_TTL'] = int(os.environ.get('FACET_CACHE_TTL', 300))
+# Order search results by relevance tier (exact headword, prefix, alias, ...), see ranking.py
+app.config['SEARCH_RANKING'] = os.environ.get('SEARCH_RANKING', '1') == '1'
+# Score bonus, in tiers, for WHO-standard terms and per reliability point
+app.config['RANK_WHO_BOOST'] = float(os.environ.get('RANK_WHO_BOOST', 0.5))
+app.config['RANK_RELIABILITY_BOOST'] = float(os.environ.get('RANK_RELIABILITY_BOOST', 0.05))
+facet_cache.maxsize = app.config['FACET_CACHE_SIZE']
+# Offer "did you mean" spelling corrections when a search finds nothing
+app.config['DID_YOU_MEAN'] = os.environ.get('DID_YOU_MEAN', '1') == '1'
+# Log (and count) SQL statements slower than this many milliseconds; 0 disables
+app.config['SLOW_QUERY_MS'] = int(os.environ.get('SLOW_QUERY_MS', 0))
+# Sample all thread stacks in the background, served on /debug/profile
+app.config['PROFILER'] = os.environ.get('PROFILER', '0') == '1'
+app.config['PROFILER_INTERVAL_MS'] = int(os.environ.get('PROFILER_INTERVAL_MS', 10))
+# Directory the workers share their metrics through, so /metrics answers for all of them
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR')
+app.config['METRICS_WRITE_INTERVAL'] = float(os.environ.get('METRICS_WRITE_INTERVAL', 5))
+# Bearer token for /metrics; without one it only answers loopback requests
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+# Acknowledge /contribute posts at once and write them in batches, see suggestion_queue.py
+app.config['SUGGESTION_QUEUE'] = os.environ.get('SUGGESTION_QUEUE', '0') == '1'
+app.config['SUGGESTION_SPOOL_DIR'] = os.environ.get('SUGGESTION_SPOOL_DIR', os.path.join(app.instance_path, 'suggestion-spool'))
+app.config['SUGGESTION_SPOOL_FSYNC'] = os.environ.get('SUGGESTION_SPOOL_FSYNC', '0') == '1'
+app.config['SUGGESTION_BATCH_SIZE'] = int(os.environ.get('SUGGESTION_BATCH_SIZE', 100))
+app.config['SUGGESTION_FLUSH_INTERVAL'] = float(os.environ.get('SUGGESTION_FLUSH_INTERVAL', 2.0))
+app.config['SUGGESTION_QUEUE_MAX'] = int(os.environ.get('SUGGESTION_QUEUE_MAX', 10000))
+# Suggestions accepted per client and window (seconds); 0 (the default) disables the limit.
+# Clients are told apart by address, so set PROXY_HOPS when running behind a proxy or router
+app.config['SUGGESTION_RATE_LIMIT'] = int(os.environ.get('SUGGESTION_RATE_LIMIT', 0))
+app.config['SUGGESTION_RATE_WINDOW'] = int(os.environ.get('SUGGESTION_RATE_WINDOW', 60))
+rate_limiter.limit = app.config['SUGGESTION_RATE_LIMIT']
+rate_limiter.window = app.config['SUGGESTION_RATE_WINDOW']
+# Gzip/brotli-compress dynamic responses of at least this many bytes; 0 disables
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+app.config['COMPRESS_BROTLI_QUALITY'] = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))
+# Compressed bodies of term pages kept per worker, keyed on ETag and encoding
+app.config['COMPRESS_CACHE_SIZE'] = int(os.environ.get('COMPRESS_CACHE_SIZE', 256))
+# Fingerprinted, precompressed standalone pages, written at startup by warm_up (or 'flask build-assets')
+app.config['ASSETS_DIR'] = os.environ.get('ASSETS_DIR', os.path.join(app.instance_path, 'assets'))
+# Bearer token for the /admin endpoints; they are disabled when unset
+app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN')
+app.config['IMPORT_BATCH_SIZE'] = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+# How often (seconds) each worker reads other processes' term edits from the change log; 0 disables
+app.config['TERM_CHANGES_POLL_INTERVAL'] = float(os.environ.get('TERM_CHANGES_POLL_INTERVAL', 2.0))
+# Sequence numbers rescanned per poll for transactions that committed out of order
+app.config['TERM_CHANGES_LOOKBACK'] = int(os.environ.get('TERM_CHANGES_LOOKBACK', 100))
+# Age (days) after which 'flask prune-term-changes' deletes change log rows
+app.config['TERM_CHANGES_RETENTION_DAYS'] = int(os.environ.get('TERM_CHANGES_RETENTION_DAYS', 7))
+
+# Number of trusted proxies (load balancer, platform router) in front of the app; their
+# X-Forwarded-For/-Proto headers then give the client address. 0 trusts no headers
+app.config['PROXY_HOPS'] = int(os.environ.get('PROXY_HOPS', 0))
+if app.config['PROXY_HOPS']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_HOPS'], x_proto=app.config['PROXY_HOPS'])
 
 # Initialize database
+configure_engines(app)
 db.init_app(app)
+init_metrics(app)
+init_compression(app)
+init_assets(app)
+init_change_log(app)
 
-# Create tables on first request
-@app.before_request
-def create_tables():
-    app.before_request_funcs[None].remove(create_tables)
+def init_database(refold=False):
+    """Create tables and search indexes, seeding the database if it is empty"""
     db.create_all()
+    add_missing_columns()
+    backfill_search_keys(refold)
+    get_search_backend().setup()
     # Check if we need to seed data
     if Term.query.count() == 0:
         seed_database()
 
+def backfill_search_keys(refold=False, batch_size=1000):
+    """Fill the search keys of terms written before they existed (or of every term)"""
+    last_id = 0
+    while True:
+        terms_query = Term.query.filter(Term.id > last_id)
+        if not refold:
+            terms_query = terms_query.filter(or_(
+                and_(func.trim(Term.pinyin) != '', Term.pinyin_plain.is_(None)),
+                Term.chinese_folded.is_(None)
+            ))
+        terms = terms_query.order_by(Term.id).limit(batch_size).all()
+        if not terms:
+            break
+        for term in terms:
+            term.update_search_text()
+        last_id = terms[-1].id
+        db.session.commit()
+
+@app.cli.command('init-db')
+@click.option('--refold', is_flag=True, help='Recompute search_text and the search keys of every term.')
+def init_db_command(refold):
+    """Create the schema and seed the initial terms (run once per deploy)"""
+    init_database(refold)
+    click.echo(f'Database ready with {Term.query.count()} terms')
+
+@app.cli.command('build-related')
+@click.option('--incremental', is_flag=True, help='Only recompute terms affected by edits since the last run.')
+def build_related_command(incremental):
+    """Precompute the related terms shown on term pages"""
+    db.create_all()
+    count = build_related_incremental() if incremental else build_related()
+    click.echo(f'Computed related terms for {count} terms')
+
+@app.cli.command('warmup')
+def warmup_command():
+    """Run the startup warmup once and print how long each step took"""
+    for step, seconds in warm_up(app).items():
+        click.echo(f'{step}: {seconds * 1000:.1f} ms')
+
+@app.cli.command('compile-snapshot')
+@click.option('--output', type=click.Path(dir_okay=False), help='Defaults to SNAPSHOT_PATH.')
+def compile_snapshot_command(output):
+    """Write the termbase and its search index to the memory-mapped snapshot file"""
+    path = output or app.config['SNAPSHOT_PATH']
+    count = compile_snapshot(path)
+    click.echo(f'Wrote {count} terms to {path} ({os.path.getsize(path) / 1e6:.1f} MB)')
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress the standalone pages into ASSETS_DIR"""
+    manifest = build_assets(app.root_path, app.config['ASSETS_DIR'])
+    for name, built in manifest.items():
+        click.echo(f'{name} -> /pages/{built}')
+
+@app.cli.command('flush-suggestions')
+def flush_suggestions_command():
+    """Write suggestions left in the spools of stopped workers to the database"""
+    queue = get_suggestion_queue(app)
+    click.echo(f'Wrote {queue.flush()} queued suggestions')
+
+@app.cli.command('sync-replicas')
+def sync_replicas_command():
+    """Copy the primary SQLite database over every SQLite replica (local testing)"""
+    if db.engine.dialect.name != 'sqlite':
+        raise click.UsageError('Only SQLite primaries can be copied; use database replication instead')
+    for key, engine in replica_engines(db).items():
+        if engine.dialect.name != 'sqlite':
+            click.echo(f'{key}: skipped, not SQLite')
+            continue
+        copy_sqlite_database(db.engine, engine)
+        click.echo(f'{key}: copied from the primary')
+
+@app.cli.command('prune-term-changes')
+@click.option('--days', type=int, help='Defaults to TERM_CHANGES_RETENTION_DAYS.')
+def prune_term_changes_command(days):
+    """Delete old rows of the cross-worker term change log"""
+    deleted = prune_term_changes(days if days is not None else app.config['TERM_CHANGES_RETENTION_DAYS'])
+    click.echo(f'Deleted {deleted} change log rows')
+
 def seed_database():
     """Seed the database with initial TCM terms"""
     
@@ -481,108 +688,179 @@ def seed_database():
         category = categories.get(category_name)
         
         term = Term(**term_data, category_id=category.id if category else None)
-        term.update_search_text()
         db.session.add(term)
     
     db.session.commit()
 
 @app.route('/')
+@replica_reads
 def index():
-    """Homepage with search and statistics"""
-    total_terms = Term.query.count()
-    categories = Category.query.all()
-    recent_terms = Term.query.order_by(Term.created_at.desc()).limit(10).all()
-    return render_template('index.html', 
-                         total_terms=total_terms, 
-                         categories=categories,
-                         recent_terms=recent_terms)
+    """Homepage with search and statistics; the data blocks are cached fragments"""
+    def recent():
+        recent_terms = Term.query.options(joinedload(Term.category)).order_by(Term.created_at.desc()).limit(10).all()
+        return render_template('_home_recent.html', recent_terms=recent_terms)
+    
+    return render_template('index.html',
+                         stats=fragment('home:stats', lambda: render_template(
+                             '_home_stats.html', total_terms=total_term_count(), categories=get_categories())),
+                         category_grid=fragment('home:categories', lambda: render_template(
+                             '_home_categories.html', categories=get_categories())),
+                         recent=fragment('home:recent', recent))
+
+def search_page(query, category_id):
+    """One page of search results; ?after=/?before= cursors take precedence over ?page="""
+    return get_search_backend().search(
+        query,
+        category_id=category_id,
+        page=request.args.get('page', 1, type=int),
+        per_page=20,
+        after=request.args.get('after'),
+        before=request.args.get('before')
+    )
+
+def did_you_mean(query):
+    """Spelling correction for a query whose exact search found nothing, or None"""
+    if not app.config['DID_YOU_MEAN']:
+        return None
+    return get_spelling_index().correct(query)
 
 @app.route('/search')
+@replica_reads
 def search():
     """Full-text search across all fields"""
     query = request.args.get('q', '').strip()
     category_id = request.args.get('category', type=int)
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
     
     if not query:
-        return render_template('search.html', terms=[], query='', categories=Category.query.all())
-    
-    # Build search query
-    search_term = f'%{query.lower()}%'
-    
-    terms_query = Term.query.filter(
-        or_(
-            Term.search_text.ilike(search_term),
-            Term.chinese_simplified.ilike(search_term),
-            Term.chinese_traditional.ilike(search_term),
-            Term.pinyin.ilike(search_term),
-            Term.english_term.ilike(search_term),
-            Term.english_aliases.ilike(search_term)
-        )
-    )
-    
-    if category_id:
-        terms_query = terms_query.filter(Term.category_id == category_id)
+        return render_template('search.html', terms=[], query='', categories=get_categories())
     
-    pagination = terms_query.paginate(page=page, per_page=per_page, error_out=False)
+    pagination = search_page(query, category_id)
+    correction = did_you_mean(query) if pagination.total == 0 else None
+    facets = cached_facets(get_search_backend(), query) if app.config['SEARCH_FACETS'] else None
     
     return render_template('search.html', 
                          terms=pagination.items, 
                          pagination=pagination,
                          query=query,
                          category_id=category_id,
-                         categories=Category.query.all())
+                         facets=facets,
+                         correction=correction,
+                         corrected_terms=load_terms(correction.term_ids[:10]) if correction else [],
+                         categories=get_categories())
 
 @app.route('/term/<int:term_id>')
+@replica_reads
 def term_detail(term_id):
     """Display detailed information for a single term"""
-    term = Term.query.get_or_404(term_id)
-    related_terms = Term.query.filter(
-        Term.category_id == term.category_id,
-        Term.id != term.id
-    ).limit(5).all()
-    return render_template('term_detail.html', term=term, related_terms=related_terms)
-
-@app.route('/browse')
-def browse():
-    """Browse terms by category"""
-    category_id = request.args.get('category', type=int)
-    page = request.args.get('page', 1, type=int)
-    per_page = 25
-    
-    categories = Category.query.all()
+    def render():
+        term = Term.query.options(joinedload(Term.category)).get_or_404(term_id)
+        related_terms = related_terms_for(term.id)
+        if not related_terms:
+            # Not computed yet (see 'flask build-related'): same-category terms
+            related_terms = fallback_related_query(term.id, term.category_id).all()
+        return render_template('term_detail.html', term=term, related_terms=related_terms)
     
+    return cached_term_response(term_id, 'html', render)
+
+# Sort key for /browse; matches the ix_terms_*browse_order expression indexes
+BROWSE_ORDER = (func.coalesce(Term.pinyin, literal_column("''")), Term.id)
+
+def browse_page(category_id):
+    """One page of terms ordered by pinyin, paginated with keyset cursors"""
     if category_id:
         terms_query = Term.query.filter_by(category_id=category_id)
-        current_category = Category.query.get(category_id)
+        current_category = get_category(category_id)
+        total = current_category.term_count if current_category else 0
     else:
         terms_query = Term.query
-        current_category = None
+        total = total_term_count()
     
-    terms_query = terms_query.order_by(Term.pinyin)
-    pagination = terms_query.paginate(page=page, per_page=per_page, error_out=False)
+    return KeysetPagination(
+        terms_query, BROWSE_ORDER, ('browse', category_id),
+        page=request.args.get('page', 1, type=int),
+        per_page=25,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        total=total
+    )
+
+@app.route('/browse')
+@replica_reads
+def browse():
+    """Browse terms by category"""
+    category_id = request.args.get('category', type=int)
+    pagination = browse_page(category_id)
     
     return render_template('browse.html',
                          terms=pagination.items,
                          pagination=pagination,
-                         categories=categories,
-                         current_category=current_category,
+                         categories=get_categories(),
+                         current_category=get_category(category_id) if category_id else None,
                          category_id=category_id)
 
+def page_to_json(pagination, fields):
+    """JSON body shared by the paginated API endpoints"""
+    return {
+        'items': [term_to_dict(term, fields) for term in pagination.items],
+        'page': pagination.page,
+        'total': pagination.total,
+        'next': getattr(pagination, 'next_cursor', None),
+        'prev': getattr(pagination, 'prev_cursor', None)
+    }
+
+@app.route('/api/browse')
+@replica_reads
+def api_browse():
+    """JSON variant of /browse; follow 'next' with ?after=<cursor>"""
+    fields = ('id', 'chinese_simplified', 'pinyin', 'english_term', 'who_standard')
+    return jsonify(page_to_json(browse_page(request.args.get('category', type=int)), fields))
+
+@app.route('/api/search/results')
+@replica_reads
+def api_search_results():
+    """JSON variant of /search; follow 'next' with ?after=<cursor>, ?facets=1 adds facet counts"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    fields = ('id', 'chinese_simplified', 'pinyin', 'english_term', 'category', 'who_standard')
+    pagination = search_page(query, request.args.get('category', type=int))
+    body = page_to_json(pagination, fields)
+    if request.args.get('facets') == '1':
+        body['facets'] = facets_to_dict(cached_facets(get_search_backend(), query))
+    correction = did_you_mean(query) if pagination.total == 0 else None
+    if correction:
+        body['did_you_mean'] = correction.query
+    return jsonify(body)
+
 @app.route('/contribute', methods=['GET', 'POST'])
 def contribute():
     """Allow users to suggest new terms or corrections"""
     if request.method == 'POST':
-        suggestion = Suggestion(
+        if not rate_limiter.allow(request.remote_addr):
+            SUGGESTIONS_REJECTED.inc('rate_limited')
+            error = 'You have sent a lot of suggestions in a short time. Please wait a minute and try again.'
+            return render_template('contribute.html', success=False, error=error), 429
+        values = dict(
             term_id=request.form.get('term_id', type=int),
             suggestion_type=request.form.get('suggestion_type'),
             content=request.form.get('content'),
             submitter_email=request.form.get('email'),
             submitter_name=request.form.get('name')
         )
-        db.session.add(suggestion)
-        db.session.commit()
+        error = validate_suggestion(values)
+        if error:
+            SUGGESTIONS_REJECTED.inc('invalid')
+            return render_template('contribute.html', success=False, error=error), 400
+        if app.config['SUGGESTION_QUEUE']:
+            try:
+                get_suggestion_queue(app).put(values)
+            except QueueFull:
+                SUGGESTIONS_REJECTED.inc('queue_full')
+                error = 'We are receiving too many suggestions right now. Please try again shortly.'
+                return render_template('contribute.html', success=False, error=error), 503
+        else:
+            db.session.add(Suggestion(**values))
+            db.session.commit()
         return render_template('contribute.html', success=True)
     
     return render_template('contribute.html', success=False)
@@ -592,7 +870,17 @@ def about():
     """About page with information about the termbase"""
     return render_template('about.html')
 
+def suggestion_to_dict(t):
+    """Autocomplete result for a Term, same shape as the prefix index results"""
+    return {
+        'id': t.id,
+        'chinese_simplified': t.chinese_simplified,
+        'pinyin': t.pinyin,
+        'english_term': t.english_term
+    }
+
 @app.route('/api/search')
+@replica_reads
 def api_search():
     """API endpoint for search (for AJAX requests)"""
     query = request.args.get('q', '').strip()
@@ -601,45 +889,220 @@ def api_search():
     if not query or len(query) < 2:
         return jsonify([])
     
-    search_term = f'%{query.lower()}%'
+    if app.config['AUTOCOMPLETE_INDEX']:
+        index = get_autocomplete_index(top_k=app.config['AUTOCOMPLETE_TOP_K'])
+        results = index.lookup(query, limit=limit)
+    else:
+        results = [suggestion_to_dict(t) for t in get_search_backend().suggest(query, limit=limit)]
     
-    terms = Term.query.filter(
-        or_(
-            Term.chinese_simplified.ilike(search_term),
-            Term.chinese_traditional.ilike(search_term),
-            Term.pinyin.ilike(search_term),
-            Term.english_term.ilike(search_term)
-        )
-    ).limit(limit).all()
+    correction = did_you_mean(query) if not results else None
+    if correction:
+        results = [suggestion_to_dict(t) for t in load_terms(correction.term_ids[:limit])]
     
-    results = [{
-        'id': t.id,
-        'chinese_simplified': t.chinese_simplified,
-        'pinyin': t.pinyin,
-        'english_term': t.english_term
-    } for t in terms]
-    
-    return jsonify(results)
+    response = jsonify(results)
+    if correction:
+        response.headers['X-Did-You-Mean'] = correction.query
+    return response
 
 @app.route('/api/term/<int:term_id>')
+@replica_reads
 def api_term(term_id):
     """API endpoint for single term data"""
-    term = Term.query.get_or_404(term_id)
-    return jsonify({
-        'id': term.id,
-        'chinese_simplified': term.chinese_simplified,
-        'chinese_traditional': term.chinese_traditional,
-        'pinyin': term.pinyin,
-        'english_term': term.english_term,
-        'english_aliases': term.english_aliases,
-        'definition_en': term.definition_en,
-        'definition_zh': term.definition_zh,
-        'etymology': term.etymology,
-        'clinical_notes': term.clinical_notes,
-        'category': term.category.name_en if term.category else None,
-        'source': term.source,
-        'who_standard': term.who_standard
-    })
+    def render():
+        term = Term.query.get_or_404(term_id)
+        return jsonify(term_to_dict(term))
+    
+    return cached_term_response(term_id, 'json', render)
+
+@app.route('/api/terms', methods=['GET', 'POST'])
+@replica_reads
+def api_terms():
+    """API endpoint for many terms at once, e.g. /api/terms?ids=1,2,3&fields=id,english_term"""
+    if request.method == 'POST':
+        payload = request.get_json(silent=True)
+        if payload is None:
+            payload = {}
+        if not isinstance(payload, dict):
+            return jsonify({'error': 'Body must be a JSON object'}), 400
+        raw_ids = payload.get('ids', [])
+        if not isinstance(raw_ids, list) or not all(type(value) is int for value in raw_ids):
+            return jsonify({'error': 'ids must be a list of integers'}), 400
+        raw_fields = payload.get('fields')
+    else:
+        raw_ids = [value for arg in request.args.getlist('ids') for value in arg.split(',')]
+        raw_fields = request.args.get('fields')
+    
+    try:
+        fields = parse_fields(raw_fields)
+        # Keep the requested order, dropping duplicates
+        term_ids = list(dict.fromkeys(int(value) for value in raw_ids if str(value).strip()))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if len(term_ids) > app.config['BATCH_MAX_IDS']:
+        return jsonify({'error': f"At most {app.config['BATCH_MAX_IDS']} ids per request"}), 400
+    
+    chunk_size = app.config['BATCH_CHUNK_SIZE']
+    options = term_query_options(fields)
+    
+    def load_chunk(chunk):
+        terms = {t.id: t for t in Term.query.options(*options).filter(Term.id.in_(chunk))}
+        return [term_to_dict(terms[term_id], fields) for term_id in chunk if term_id in terms]
+    
+    if len(term_ids) <= chunk_size:
+        return jsonify(load_chunk(term_ids))
+    
+    def generate():
+        # Stream large batches one IN query at a time
+        first = True
+        yield '['
+        for start in range(0, len(term_ids), chunk_size):
+            for item in load_chunk(term_ids[start:start + chunk_size]):
+                yield ('' if first else ',') + app.json.dumps(item)
+                first = False
+        yield ']'
+    
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+@app.route('/api/annotate', methods=['POST'])
+def api_annotate():
+    """Tag every termbase hit in a posted document (JSON {"text": ...} or plain text)
+    
+    With ?stream=1 the raw request body is read in chunks and hits are
+    streamed back as newline-delimited JSON, so documents of any length can
+    be annotated in constant memory.
+    """
+    annotator = get_annotator()
+    
+    if request.args.get('stream') == '1':
+        def read_chunks(size=64 * 1024):
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            while True:
+                data = request.stream.read(size)
+                yield decoder.decode(data, final=not data)
+                if not data:
+                    break
+        
+        def generate():
+            for hit in annotator.iter_annotations(read_chunks()):
+                yield app.json.dumps(hit) + '\n'
+        
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        if payload is None:
+            payload = {}
+        if not isinstance(payload, dict):
+            return jsonify({'error': 'Body must be a JSON object'}), 400
+        text = payload.get('text') or ''
+        if not isinstance(text, str):
+            return jsonify({'error': 'text must be a string'}), 400
+    else:
+        text = request.get_data(as_text=True)
+    
+    if len(text) > app.config['ANNOTATE_MAX_CHARS']:
+        return jsonify({'error': 'Document too large, use ?stream=1'}), 413
+    
+    matches = annotator.annotate(text)
+    return jsonify({'count': len(matches), 'matches': matches})
+
+def admin_authorized():
+    """Check the request's bearer token against ADMIN_TOKEN"""
+    token = app.config.get('ADMIN_TOKEN')
+    if not token:
+        return False
+    header = request.headers.get('Authorization', '')
+    return header.startswith('Bearer ') and hmac.compare_digest(header[7:], token)
+
+@app.route('/admin/import', methods=['POST'])
+def admin_import():
+    """Bulk import a CSV, JSONL or TBX file (multipart 'file' field or raw body)"""
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    upload = request.files.get('file')
+    fileobj = upload.stream if upload else request.stream
+    fmt = request.args.get('format') or (guess_format(upload.filename) if upload else None)
+    if fmt not in FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(FORMATS)}"}), 400
+    
+    try:
+        report = import_terms(
+            fileobj, fmt,
+            batch_size=request.args.get('batch_size', app.config['IMPORT_BATCH_SIZE'], type=int),
+            upsert=request.args.get('upsert', '1') == '1',
+            create_categories=request.args.get('create_categories') == '1'
+        )
+    except MalformedFile as e:
+        # Rows before the damage are already committed; report them too
+        return jsonify(dict(e.report.to_dict(), error=str(e))), 400
+    return jsonify(report.to_dict())
+
+@app.cli.command('import-terms')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to the file extension.')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows per INSERT/UPDATE batch.')
+@click.option('--no-upsert', is_flag=True, help='Always insert, even if the term already exists.')
+@click.option('--create-categories', is_flag=True, help='Create categories that do not exist yet.')
+def import_terms_command(path, fmt, batch_size, no_upsert, create_categories):
+    """Bulk import terms from a CSV, JSONL or TBX file"""
+    fmt = fmt or guess_format(path)
+    if fmt is None:
+        raise click.UsageError('Cannot guess the format from the file name, pass --format')
+    db.create_all()
+    with open(path, 'rb') as fileobj:
+        try:
+            report = import_terms(fileobj, fmt, batch_size=batch_size,
+                                  upsert=not no_upsert, create_categories=create_categories)
+        except MalformedFile as e:
+            raise click.ClickException(f'{e} ({e.report.inserted} inserted, {e.report.updated} updated before it)')
+    click.echo(f'Read {report.read} rows in {report.elapsed:.1f}s '
+               f'({report.rows_per_second:.0f} rows/s): '
+               f'{report.inserted} inserted, {report.updated} updated, {len(report.rejected)} rejected')
+    for row_number, reason in report.rejected[:50]:
+        click.echo(f'  row {row_number}: {reason}', err=True)
+
+@app.route('/admin/export')
+def admin_export():
+    """Stream the whole termbase, e.g. /admin/export?format=tbx&gzip=1"""
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+    compress = request.args.get('gzip') == '1'
+    
+    filename = f"tcm-termbase-{datetime.utcnow():%Y%m%d}.{fmt}" + ('.gz' if compress else '')
+    response = Response(
+        stream_with_context(export_terms(fmt, compress=compress)),
+        mimetype='application/gzip' if compress else EXPORT_MIMETYPES[fmt]
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@app.cli.command('export-terms')
+@click.argument('output', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--format', 'fmt', type=click.Choice(EXPORT_FORMATS), default='jsonl', show_default=True)
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip-compress the output.')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows fetched per round trip.')
+def export_terms_command(output, fmt, compress, batch_size):
+    """Export every term to OUTPUT ('-' for stdout)"""
+    with click.open_file(output, 'wb') as fileobj:
+        for chunk in export_terms(fmt, compress=compress, batch_size=batch_size):
+            fileobj.write(chunk)
+
+@app.route('/debug/profile')
+def debug_profile():
+    """Folded stacks from the sampling profiler (PROFILER=1); ?reset=1 starts over"""
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    if metrics.profiler is None:
+        return jsonify({'error': 'Profiler disabled, set PROFILER=1'}), 404
+    return Response(metrics.profiler.folded(reset=request.args.get('reset') == '1'), mimetype='text/plain')
 
 if __name__ == '__main__':
+    with app.app_context():
+        init_database()
     app.run(debug=True)
@@ -0,0 +1,170 @@
+"""Precompressed, fingerprinted copies of the standalone pages.
+
+``flask build-assets`` copies each of ``PAGES`` (the self-contained
+index.html and tcm.html in the project root) into ``ASSETS_DIR`` as
+``<name>.<hash>.html`` together with ``.gz`` (gzip level 9) and ``.br``
+(brotli quality 11, when the ``brotli`` package is installed) variants,
+and records the mapping in ``manifest.json``.
+
+``/pages/<name>`` redirects to the current fingerprinted URL, which is
+served with a year-long ``immutable`` Cache-Control: a changed page gets a
+new hash, so the URL of a given body never changes meaning.  The variant is
+chosen from ``Accept-Encoding`` (brotli, then gzip, then identity) and the
+response carries ``Vary: Accept-Encoding``.  Files of earlier builds are
+left in place and read from disk on first request, so clients holding an
+old URL (or sent to another version during a rolling deploy) still get
+their page.
+
+The release phase runs on a one-off dyno whose filesystem the web dynos
+never see, so the pages are built by ``warm_up`` in the gunicorn master
+before it forks, from the files of the slug being started.  A manifest
+whose identity or gzip file is missing fails the load instead of a request.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+
+from flask import abort, current_app, redirect, request, Response, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+PAGES = ('index.html', 'tcm.html')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# Suffix and Content-Encoding of each precompressed variant, in order of preference
+ENCODINGS = (('.br', 'br'), ('.gz', 'gzip'))
+
+
+def fingerprint(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def build_assets(source_dir, output_dir, pages=PAGES):
+    """Write the fingerprinted and compressed pages; returns the manifest"""
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = {}
+    for name in pages:
+        with open(os.path.join(source_dir, name), 'rb') as f:
+            data = f.read()
+        stem, extension = os.path.splitext(name)
+        built = f'{stem}.{fingerprint(data)}{extension}'
+        variants = {'': data, '.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants['.br'] = brotli.compress(data, quality=11)
+        for suffix, body in variants.items():
+            _write_atomic(os.path.join(output_dir, built + suffix), body)
+        manifest[name] = built
+    _write_atomic(os.path.join(output_dir, 'manifest.json'), json.dumps(manifest, indent=2).encode('utf-8'))
+    return manifest
+
+
+def _write_atomic(path, data):
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+def _built_name_pattern(pages):
+    names = '|'.join(f'{re.escape(stem)}\\.[0-9a-f]{{12}}{re.escape(extension)}'
+                     for stem, extension in map(os.path.splitext, pages))
+    return re.compile(f'^(?:{names})$')
+
+
+class Assets:
+    """The built pages of one manifest, loaded into memory, plus earlier builds on demand"""
+
+    def __init__(self, directory, pages=PAGES):
+        self.directory = directory
+        self.pattern = _built_name_pattern(pages)
+        with open(os.path.join(directory, 'manifest.json'), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.files = {}
+        self.lock = threading.Lock()
+        for built in self.manifest.values():
+            variants = self._read(built)
+            if variants is None:
+                raise FileNotFoundError(f'{built} listed in the manifest is missing; run flask build-assets')
+            self.files[built] = variants
+
+    def _read(self, built):
+        """The variants of ``built`` on disk, or None if its identity or gzip file is missing"""
+        variants = {}
+        for suffix, encoding in (('', None),) + ENCODINGS:
+            path = os.path.join(self.directory, built + suffix)
+            if not os.path.exists(path):
+                # brotli is optional; the other variants are always built
+                if encoding == 'br':
+                    continue
+                return None
+            with open(path, 'rb') as f:
+                variants[encoding] = f.read()
+        return variants
+
+    def load(self, built):
+        """The variants of a fingerprinted name from any build, or None if there is no such file"""
+        variants = self.files.get(built)
+        if variants is None and self.pattern.match(built):
+            variants = self._read(built)
+            if variants is not None:
+                with self.lock:
+                    self.files[built] = variants
+        return variants
+
+    def variant(self, built, accept_encodings):
+        """Return ``(encoding, body)`` of the best variant the client accepts"""
+        variants = self.load(built)
+        for _, encoding in ENCODINGS:
+            if encoding in variants and accept_encodings[encoding]:
+                return encoding, variants[encoding]
+        return None, variants[None]
+
+
+_assets = None
+_assets_lock = threading.Lock()
+
+
+def get_assets(app=None, build=False):
+    """Return the built pages, building them first if ``build`` or if there is no manifest yet"""
+    global _assets
+    app = app or current_app
+    assets = _assets
+    if assets is None or build:
+        with _assets_lock:
+            if _assets is None or build:
+                directory = app.config['ASSETS_DIR']
+                if build or not os.path.exists(os.path.join(directory, 'manifest.json')):
+                    build_assets(app.root_path, directory)
+                _assets = Assets(directory)
+            assets = _assets
+    return assets
+
+
+def init_assets(app):
+    """Register the /pages/<name> route on ``app``"""
+
+    @app.route('/pages/<name>')
+    def page(name):
+        """A standalone page: a redirect for its plain name, the body for its fingerprinted name"""
+        assets = get_assets()
+        if name in assets.manifest:
+            response = redirect(url_for('page', name=assets.manifest[name]))
+            response.cache_control.no_cache = True
+            return response
+        if assets.load(name) is None:
+            abort(404)
+        encoding, body = assets.variant(name, request.accept_encodings)
+        response = Response(body, mimetype='text/html')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.set_etag(f'{name}-{encoding or "identity"}')
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+        return response.make_conditional(request)
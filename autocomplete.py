@@ -0,0 +1,141 @@
+"""Prefix index serving the homepage autocomplete without touching the database.
+
+Every term contributes several lowercase keys: its Chinese names folded to
+Simplified (and their suffixes, so '血' finds '气血'), its tone-stripped pinyin
+with and without spaces, its pinyin initials ('zsl'), and its English term,
+each starting at every word boundary.  The keys live in one sorted array, so
+the terms matching a prefix are a contiguous slice found by binary search.
+Prefixes matching more than ``top_k`` terms have their best ``top_k``
+results precomputed, so a lookup never has to rank more than ``top_k``
+candidates.
+"""
+import bisect
+import heapq
+
+from caching import StaleWhileRebuild
+from change_events import on_terms_changed
+from models import Term
+from hanzi import fold
+from pinyin import normalize_query, pinyin_keys
+
+RESULT_FIELDS = ('id', 'chinese_simplified', 'pinyin', 'english_term')
+
+# Sorts after every character a key can contain, closing a prefix range
+_PREFIX_END = '\uffff'
+
+
+def term_keys(chinese_simplified, chinese_traditional, pinyin, english_term):
+    """Return the set of normalised lookup keys for one term"""
+    keys = set()
+    for chinese in (chinese_simplified, chinese_traditional):
+        chinese = fold(chinese).strip()
+        keys.update(chinese[i:] for i in range(len(chinese)))
+    for text in (normalize_query(pinyin), normalize_query(english_term)):
+        words = text.split(' ')
+        keys.update(' '.join(words[i:]) for i in range(len(words)))
+    plain_pinyin = normalize_query(pinyin).replace(' ', '')
+    keys.add(plain_pinyin)
+    keys.add(pinyin_keys(pinyin)['pinyin_initials'] or '')
+    keys.discard('')
+    return keys
+
+
+class PrefixIndex:
+    """Sorted-array prefix index with precomputed top-k results"""
+
+    def __init__(self, top_k=10):
+        self.top_k = top_k
+        self.keys = []
+        self.key_terms = []
+        self.ranks = {}
+        self.results = {}
+        self.top = {}
+
+    @classmethod
+    def build(cls, rows, top_k=10):
+        """Build from ``Term`` objects or mappings with the columns used here"""
+        index = cls(top_k=top_k)
+        entries = []
+        for row in rows:
+            get = row.get if isinstance(row, dict) else lambda name: getattr(row, name)
+            term_id = get('id')
+            index.results[term_id] = {name: get(name) for name in RESULT_FIELDS}
+            keys = term_keys(get('chinese_simplified'), get('chinese_traditional'),
+                             get('pinyin'), get('english_term'))
+            for key in keys:
+                entries.append((key, term_id))
+            # WHO standard and reliable terms first, then shorter headwords
+            index.ranks[term_id] = (
+                not get('who_standard'),
+                -(get('reliability_score') or 0),
+                len(get('english_term') or ''),
+                term_id
+            )
+        entries.sort()
+        index.keys = [key for key, _ in entries]
+        index.key_terms = [term_id for _, term_id in entries]
+        index._precompute()
+        return index
+
+    @classmethod
+    def from_database(cls, top_k=10):
+        columns = [Term.id, Term.chinese_simplified, Term.chinese_traditional, Term.pinyin,
+                   Term.english_term, Term.who_standard, Term.reliability_score]
+        rows = Term.query.with_entities(*columns).yield_per(1000)
+        return cls.build((row._asdict() for row in rows), top_k=top_k)
+
+    def _best(self, term_ids, limit):
+        return heapq.nsmallest(limit, set(term_ids), key=self.ranks.__getitem__)
+
+    def _precompute(self):
+        """Store top-k for every prefix whose key range is larger than top_k"""
+        keys, key_terms = self.keys, self.key_terms
+        # Ranges still too large to rank on the fly, refined one character at a time
+        ranges = [(0, len(keys))] if len(keys) > self.top_k else []
+        length = 1
+        while ranges:
+            next_ranges = []
+            for lo, hi in ranges:
+                i = lo
+                while i < hi:
+                    if len(keys[i]) < length:
+                        i += 1
+                        continue
+                    prefix = keys[i][:length]
+                    j = bisect.bisect_left(keys, prefix + _PREFIX_END, i, hi)
+                    if j - i > self.top_k:
+                        self.top[prefix] = tuple(self._best(key_terms[i:j], self.top_k))
+                        next_ranges.append((i, j))
+                    i = j
+            ranges = next_ranges
+            length += 1
+
+    def lookup(self, prefix, limit=None):
+        """Return result dicts for the best terms with a key starting with ``prefix``"""
+        limit = limit or self.top_k
+        prefix = fold(normalize_query(prefix))
+        if not prefix:
+            return []
+        top = self.top.get(prefix)
+        if top is not None and limit <= self.top_k:
+            term_ids = top[:limit]
+        else:
+            lo = bisect.bisect_left(self.keys, prefix)
+            hi = bisect.bisect_left(self.keys, prefix + _PREFIX_END, lo)
+            term_ids = self._best(self.key_terms[lo:hi], limit)
+        return [self.results[term_id] for term_id in term_ids]
+
+
+_index = StaleWhileRebuild('autocomplete index')
+
+
+def get_autocomplete_index(top_k=10):
+    """Return the process-wide prefix index, building it on first use"""
+    return _index.get(lambda: PrefixIndex.from_database(top_k=top_k))
+
+
+@on_terms_changed
+def reset_autocomplete_index(term_ids=None):
+    """Rebuild the prefix index in the background; lookups use the old one meanwhile"""
+    _index.invalidate()
+
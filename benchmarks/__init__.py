@@ -0,0 +1,13 @@
+"""Benchmarks for the termbase at realistic sizes.
+
+Generate a synthetic corpus into a SQLite file, run the route benchmarks
+against it and compare two result files::
+
+    python -m benchmarks.generate --terms 100000 --database /tmp/bench-100k.db
+    python -m benchmarks.run --database /tmp/bench-100k.db --output before.json
+    python -m benchmarks.run --database /tmp/bench-100k.db --output after.json
+    python -m benchmarks.compare before.json after.json
+
+Every run records the git commit, corpus size and settings next to the
+per-route latency percentiles, throughput and SQL statement counts.
+"""
@@ -0,0 +1,62 @@
+"""Compare two reports written by ``benchmarks.run``.
+
+    python -m benchmarks.compare before.json after.json [--threshold 0.1]
+
+Prints p50/p95/p99, throughput and SQL statements per route side by side and
+exits with status 1 when any p95 latency got worse by more than the
+threshold (a fraction; 0.1 means 10%), so it can gate a CI job.
+"""
+import argparse
+import json
+import sys
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'requests_per_second', 'sql_per_request')
+
+
+def change(before, after):
+    if before in (None, 0) or after is None:
+        return None
+    return (after - before) / before
+
+
+def compare(before, after, threshold):
+    """Return ``(lines, regressions)``"""
+    lines = [f"before {before['meta'].get('commit')} ({before['meta'].get('terms')} terms)  "
+             f"after {after['meta'].get('commit')} ({after['meta'].get('terms')} terms)"]
+    regressions = []
+    for mode in ('sequential', 'concurrent'):
+        for route, old in before.get(mode, {}).items():
+            new = after.get(mode, {}).get(route)
+            if new is None:
+                continue
+            for metric in METRICS:
+                if metric not in old or metric not in new:
+                    continue
+                delta = change(old[metric], new[metric])
+                delta_text = f'{delta:+.1%}' if delta is not None else 'n/a'
+                lines.append(f'{mode:<10} {route:<10} {metric:<20} {old[metric]!s:>10} -> {new[metric]!s:>10}  {delta_text}')
+                if metric == 'p95_ms' and delta is not None and delta > threshold:
+                    regressions.append(f'{mode} {route} p95 {delta:+.1%}')
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args(argv)
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    lines, regressions = compare(before, after, args.threshold)
+    print('\n'.join(lines))
+    if regressions:
+        print('\nRegressions: ' + '; '.join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
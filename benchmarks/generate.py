@@ -0,0 +1,195 @@
+"""Generate a synthetic termbase of a given size into a SQLite file.
+
+Names are built from a pool of common TCM characters with their pinyin,
+picked with a Zipf-like skew so that some characters (气, 血, 虚 ...) are
+far more frequent than others, as in the real vocabulary.  English terms
+follow per-category templates ('Liver Qi Stagnation', 'Astragalus Root',
+'Minor Bupleurum Decoction', 'Zusanli (ST36)'), with zero to three aliases
+and definitions of realistic length.  Traditional forms come from the
+reverse of the folding table in ``hanzi.py``.
+
+    python -m benchmarks.generate --terms 100000 --database /tmp/bench-100k.db
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+# Character, pinyin; roughly in order of frequency in TCM terminology
+CHARACTERS = '''
+气qì 血xuè 虚xū 阴yīn 阳yáng 热rè 寒hán 湿shī 脾pí 肾shèn 肝gān 心xīn 肺fèi 汤tāng 经jīng 风fēng
+痰tán 瘀yū 火huǒ 胃wèi 补bǔ 清qīng 温wēn 散sǎn 丸wán 子zǐ 草cǎo 根gēn 实shí 燥zào 津jīn 液yè
+精jīng 神shén 胆dǎn 肠cháng 三sān 焦jiāo 络luò 穴xué 脉mài 舌shé 苔tāi 诊zhěn 证zhèng 治zhì 法fǎ
+泻xiè 汗hàn 下xià 和hé 消xiāo 理lǐ 调tiáo 养yǎng 生shēng 元yuán 宗zōng 营yíng 卫wèi 表biǎo 里lǐ
+上shàng 中zhōng 外wài 内nèi 头tóu 目mù 耳ěr 鼻bí 口kǒu 喉hóu 咳ké 喘chuǎn 痛tòng 胀zhàng 满mǎn
+闷mèn 悸jì 眩xuàn 晕yūn 膏gāo 丹dān 饮yǐn 叶yè 花huā 皮pí 仁rén 参shēn 归guī 芪qí 芍sháo 芎xiōng
+地dì 黄huáng 白bái 赤chì 青qīng 黑hēi 红hóng 金jīn 木mù 水shuǐ 土tǔ 石shí 甘gān 苦kǔ 辛xīn 酸suān
+咸xián 大dà 小xiǎo 四sì 六liù 八bā 君jūn 物wù 逍xiāo 遥yáo 柴chái 胡hú 桂guì 枝zhī 麻má 杏xìng
+半bàn 夏xià 陈chén 茯fú 苓líng 术zhú 附fù 干gān 姜jiāng 枣zǎo 当dāng 龙lóng 骨gǔ 牡mǔ 蛎lì 足zú
+合hé 谷gǔ 关guān 冲chōng 门mén 海hǎi 泉quán 池chí 井jǐng 俞shù 会huì 交jiāo 命mìng 百bǎi 太tài
+少shào 厥jué 明míng 肿zhǒng 郁yù 结jié 滞zhì 逆nì 陷xiàn 脱tuō 亢kàng 衰shuāi 损sǔn 劳láo 伤shāng
+病bìng 候hòu 膀páng 胱guāng 滑huá 涩sè 浮fú 沉chén 迟chí 数shuò 弦xián 细xì 洪hóng 紧jǐn 缓huǎn
+'''
+
+ORGANS = ['Liver', 'Heart', 'Spleen', 'Lung', 'Kidney', 'Stomach', 'Gallbladder', 'Large Intestine',
+          'Small Intestine', 'Bladder', 'Triple Burner', 'Pericardium']
+SUBSTANCES = ['Qi', 'Blood', 'Yin', 'Yang', 'Essence', 'Fluids']
+PATHOGENS = ['Cold', 'Heat', 'Damp', 'Wind', 'Dryness', 'Phlegm', 'Fire', 'Toxin', 'Summer-Heat']
+CONDITIONS = ['Deficiency', 'Excess', 'Stagnation', 'Collapse', 'Rebellion', 'Sinking', 'Stasis',
+              'Obstruction', 'Exhaustion', 'Accumulation']
+PLANTS = ['Astragalus', 'Angelica', 'Ginseng', 'Licorice', 'Peony', 'Rehmannia', 'Bupleurum', 'Cinnamon',
+          'Ephedra', 'Ginger', 'Jujube', 'Poria', 'Atractylodes', 'Pinellia', 'Citrus', 'Coptis',
+          'Scutellaria', 'Phellodendron', 'Gardenia', 'Forsythia', 'Lonicera', 'Mint', 'Schisandra',
+          'Ophiopogon', 'Lycium', 'Cornus', 'Dioscorea', 'Eucommia', 'Achyranthes', 'Salvia',
+          'Carthamus', 'Persica', 'Ligusticum', 'Magnolia', 'Aucklandia', 'Cyperus', 'Corydalis',
+          'Notoginseng', 'Artemisia', 'Codonopsis', 'Alisma', 'Polygonum', 'Chrysanthemum', 'Mulberry']
+PARTS = ['Root', 'Rhizome', 'Bark', 'Seed', 'Flower', 'Leaf', 'Fruit', 'Twig', 'Peel', 'Tuber', 'Herb']
+FORMS = ['Decoction', 'Powder', 'Pill', 'Paste', 'Elixir', 'Granules', 'Wine']
+SIZES = ['Major', 'Minor', 'Modified', 'Great', 'Supplemented']
+ACTIONS = ['Tonify', 'Nourish', 'Clear', 'Drain', 'Warm', 'Cool', 'Move', 'Disperse', 'Calm',
+           'Strengthen', 'Harmonize', 'Resolve', 'Expel', 'Astringe', 'Moisten']
+CHANNELS = ['LU', 'LI', 'ST', 'SP', 'HT', 'SI', 'BL', 'KI', 'PC', 'SJ', 'GB', 'LR', 'DU', 'REN']
+DEFINITION_WORDS = '''
+a pattern in which the of and with due to leading to characterised by symptoms such as fatigue pale
+tongue weak pulse thin coating red dizziness palpitations insomnia poor appetite loose stools cold
+limbs night sweats thirst irritability distension pain chest hypochondrium lower back knees used to
+treat commonly combined indicated for chronic acute conditions function organ channel point located
+between on the medial lateral aspect of the leg arm hand foot traditionally described in classical
+texts herb formula clinical practice dosage preparation warm cool neutral sweet bitter pungent sour
+'''.split()
+
+
+def _weighted(items, skew=1.1):
+    """Zipf-like cumulative weights for ``random.choices``"""
+    weights = [1.0 / (rank + 1) ** skew for rank in range(len(items))]
+    total = 0.0
+    cumulative = []
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    return items, cumulative
+
+
+class Corpus:
+    """Deterministic generator of term rows"""
+
+    def __init__(self, seed=0):
+        from hanzi import FOLD_TABLE
+        self.random = random.Random(seed)
+        pairs = [(entry[0], entry[1:]) for entry in CHARACTERS.split()]
+        self.characters, self.character_weights = _weighted(pairs)
+        # Simplified -> one Traditional form, the reverse of the folding table
+        self.traditional = {}
+        for source, target in FOLD_TABLE.items():
+            self.traditional.setdefault(chr(target), chr(source))
+        self.plants, self.plant_weights = _weighted(PLANTS, skew=0.8)
+
+    def _name(self):
+        length = self.random.choices([1, 2, 3, 4, 5, 6], weights=[2, 30, 28, 25, 10, 5])[0]
+        chosen = self.random.choices(self.characters, cum_weights=self.character_weights, k=length)
+        simplified = ''.join(char for char, _ in chosen)
+        traditional = ''.join(self.traditional.get(char, char) for char in simplified)
+        pinyin = ' '.join(syllable for _, syllable in chosen)
+        return simplified, traditional, pinyin
+
+    def _english(self, category, pinyin):
+        r = self.random
+        if category == 'Herbal Medicine':
+            return f'{r.choices(self.plants, cum_weights=self.plant_weights)[0]} {r.choice(PARTS)}'
+        if category == 'Formulas':
+            plant = r.choices(self.plants, cum_weights=self.plant_weights)[0]
+            size = r.choice(SIZES) + ' ' if r.random() < 0.4 else ''
+            return f'{size}{plant} {r.choice(FORMS)}'
+        if category == 'Meridians & Acupoints':
+            name = pinyin.replace(' ', '').title()
+            return f'{name} ({r.choice(CHANNELS)}{r.randint(1, 67)})'
+        if category == 'Treatment Methods':
+            return f'{r.choice(ACTIONS)} {r.choice(SUBSTANCES)} and {r.choice(ACTIONS)} {r.choice(ORGANS)}'
+        if r.random() < 0.5:
+            return f'{r.choice(ORGANS)} {r.choice(SUBSTANCES)} {r.choice(CONDITIONS)}'
+        return f'{r.choice(PATHOGENS)} {r.choice(["Invading", "Obstructing", "Accumulating in"])} {r.choice(ORGANS)}'
+
+    def _definition(self, low, high):
+        words = self.random.choices(DEFINITION_WORDS, k=self.random.randint(low, high))
+        return ' '.join(words).capitalize() + '.'
+
+    def _definition_zh(self, low, high):
+        chosen = self.random.choices(self.characters, cum_weights=self.character_weights,
+                                     k=self.random.randint(low, high))
+        return ''.join(char for char, _ in chosen) + '。'
+
+    def term(self, categories):
+        """One term mapping; ``categories`` maps category names to ids"""
+        r = self.random
+        category = r.choice(list(categories))
+        simplified, traditional, pinyin = self._name()
+        english = self._english(category, pinyin)
+        alias_count = r.choices([0, 1, 2, 3], weights=[35, 35, 20, 10])[0]
+        aliases = ', '.join(self._english(category, pinyin) for _ in range(alias_count))
+        return {
+            'chinese_simplified': simplified,
+            'chinese_traditional': traditional,
+            'pinyin': pinyin,
+            'english_term': english,
+            'english_aliases': aliases or None,
+            'definition_en': self._definition(12, 45),
+            'definition_zh': self._definition_zh(15, 60),
+            'clinical_notes': self._definition(5, 25) if r.random() < 0.3 else None,
+            'category_id': categories[category],
+            'source': 'Synthetic benchmark corpus',
+            'who_standard': r.random() < 0.15,
+            'reliability_score': r.choices([1, 2, 3, 4, 5], weights=[5, 10, 40, 30, 15])[0],
+        }
+
+
+def generate(database, terms, seed=0, batch_size=5000, log=print):
+    """Create ``database`` with the seed data plus ``terms`` synthetic terms"""
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(database)
+    from sqlalchemy import insert, text
+    from app import app, init_database
+    from models import db, build_search_keys, build_search_text, Category, Term
+
+    started = time.perf_counter()
+    with app.app_context():
+        init_database()
+        categories = {category.name_en: category.id for category in Category.query}
+        corpus = Corpus(seed)
+        now = datetime.utcnow()
+        written = 0
+        while written < terms:
+            rows = []
+            for _ in range(min(batch_size, terms - written)):
+                values = corpus.term(categories)
+                values['search_text'] = build_search_text(values)
+                values.update(build_search_keys(values))
+                values['created_at'] = values['updated_at'] = now
+                rows.append(values)
+            db.session.execute(insert(Term), rows)
+            db.session.commit()
+            written += len(rows)
+            log(f'{written}/{terms} terms written')
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+        total = Term.query.count()
+    log(f'{database}: {total} terms in {time.perf_counter() - started:.1f}s')
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--terms', type=int, default=10000, help='synthetic terms to add (e.g. 10000, 100000, 1000000)')
+    parser.add_argument('--database', required=True, help='SQLite file to create')
+    parser.add_argument('--seed', type=int, default=0, help='random seed, for reproducible corpora')
+    parser.add_argument('--force', action='store_true', help='overwrite an existing file')
+    args = parser.parse_args(argv)
+    if os.path.exists(args.database):
+        if not args.force:
+            parser.error(f'{args.database} exists; use --force to overwrite it')
+        os.remove(args.database)
+    generate(args.database, args.terms, seed=args.seed)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,256 @@
+"""Per-route latency, throughput and SQL statement benchmarks.
+
+Each route is driven twice against the same database:
+
+* ``sequential`` - through the Flask test client in this process, counting
+  the SQL statements every request executes
+* ``concurrent`` - over HTTP against a threaded local server, with
+  ``--concurrency`` client threads issuing requests for ``--duration``
+  seconds, which measures throughput under contention
+
+Request URLs are drawn from the corpus itself (real ids, Chinese names,
+pinyin and English words) with a fixed seed, so two runs against the same
+database issue the same requests.  The report is written as JSON:
+
+    python -m benchmarks.run --database /tmp/bench-100k.db --output results.json
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from pinyin import strip_tones
+
+ROUTES = ('search', 'api_search', 'browse', 'term', 'api_term')
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize(latencies, elapsed=None, statements=None):
+    """Latency percentiles in milliseconds plus throughput and SQL counts"""
+    summary = {
+        'requests': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        'max_ms': round(max(latencies) * 1000, 3) if latencies else None,
+    }
+    if elapsed:
+        summary['requests_per_second'] = round(len(latencies) / elapsed, 1)
+    if statements:
+        summary['sql_per_request'] = round(sum(statements) / len(statements), 2)
+        summary['sql_max'] = max(statements)
+    return summary
+
+
+def request_urls(database, count, seed=0):
+    """``{route: [url, ...]}`` built from rows sampled from the corpus"""
+    connection = sqlite3.connect(database)
+    (max_id,) = connection.execute('SELECT max(id) FROM terms').fetchone()
+    rng = random.Random(seed)
+    ids = [rng.randint(1, max_id) for _ in range(count)]
+    placeholders = ','.join('?' * len(ids))
+    rows = connection.execute(
+        f'SELECT id, chinese_simplified, pinyin, english_term FROM terms WHERE id IN ({placeholders})', ids
+    ).fetchall()
+    (category_count,) = connection.execute('SELECT count(*) FROM categories').fetchone()
+    connection.close()
+
+    def query(row):
+        # Mix of query kinds: Chinese prefix, pinyin, an English word
+        _, chinese, pinyin, english = row
+        kind = rng.randrange(3)
+        if kind == 0:
+            return chinese[:2]
+        if kind == 1 and pinyin:
+            syllables = pinyin.split(' ')
+            return ' '.join(syllables[:2]) if rng.random() < 0.5 else strip_tones(''.join(syllables))
+        return rng.choice(english.split()).strip('()').lower()
+
+    urls = {route: [] for route in ROUTES}
+    for i in range(count):
+        row = rows[i % len(rows)]
+        term_id = row[0]
+        urls['search'].append(f'/search?q={quote(query(row))}')
+        urls['api_search'].append(f'/api/search?q={quote(query(row))}')
+        page = rng.choice([1, 1, 1, 2, 3, rng.randint(4, 50)])
+        category = rng.choice([None, rng.randint(1, category_count)])
+        browse = f'/browse?page={page}' + (f'&category={category}' if category else '')
+        urls['browse'].append(browse)
+        urls['term'].append(f'/term/{term_id}')
+        urls['api_term'].append(f'/api/term/{term_id}')
+    return urls
+
+
+class StatementCounter:
+    """Counts the statements executed on an engine"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def run_sequential(app, urls, log):
+    from models import db
+    results = {}
+    with app.app_context():
+        counter = StatementCounter(db.engine)
+    client = app.test_client()
+    for route, route_urls in urls.items():
+        # Warm caches and compiled statements the way a running server would be
+        for url in route_urls[:5]:
+            client.get(url)
+        latencies, statements = [], []
+        started = time.perf_counter()
+        for url in route_urls:
+            before = counter.count
+            begin = time.perf_counter()
+            response = client.get(url)
+            latencies.append(time.perf_counter() - begin)
+            statements.append(counter.count - before)
+            if response.status_code >= 500:
+                raise RuntimeError(f'{url} returned {response.status_code}')
+        results[route] = summarize(latencies, time.perf_counter() - started, statements)
+        log(f'sequential {route}: {results[route]}')
+    return results
+
+
+def run_concurrent(app, urls, concurrency, duration, log):
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    port = server.server_port
+    results = {}
+    try:
+        for route, route_urls in urls.items():
+            deadline = time.perf_counter() + duration
+
+            def worker(offset):
+                latencies, errors = [], 0
+                i = offset
+                while time.perf_counter() < deadline:
+                    url = route_urls[i % len(route_urls)]
+                    i += concurrency
+                    begin = time.perf_counter()
+                    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                    try:
+                        connection.request('GET', url)
+                        response = connection.getresponse()
+                        response.read()
+                        if response.status >= 500:
+                            errors += 1
+                    except OSError:
+                        errors += 1
+                    finally:
+                        connection.close()
+                    latencies.append(time.perf_counter() - begin)
+                return latencies, errors
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                outcomes = list(pool.map(worker, range(concurrency)))
+            elapsed = time.perf_counter() - started
+            latencies = [latency for worker_latencies, _ in outcomes for latency in worker_latencies]
+            results[route] = summarize(latencies, elapsed)
+            results[route]['errors'] = sum(errors for _, errors in outcomes)
+            log(f'concurrent {route}: {results[route]}')
+    finally:
+        server.shutdown()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(database, requests=200, concurrency=8, duration=5.0, seed=0, routes=ROUTES, log=print):
+    """Run the benchmarks and return the report as a dict"""
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(database)
+    from app import app
+    from models import Term
+
+    urls = request_urls(database, requests, seed)
+    urls = {route: urls[route] for route in routes}
+    with app.app_context():
+        term_count = Term.query.count()
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'database': os.path.abspath(database),
+            'terms': term_count,
+            'search_engine': app.config['SEARCH_ENGINE'],
+            'requests_per_route': requests,
+            'concurrency': concurrency,
+            'duration_s': duration,
+            'seed': seed,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+        },
+        'sequential': run_sequential(app, urls, log),
+    }
+    if concurrency:
+        report['concurrent'] = run_concurrent(app, urls, concurrency, duration, log)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', required=True, help='SQLite file made by benchmarks.generate')
+    parser.add_argument('--requests', type=int, default=200, help='sequential requests per route')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads (0 skips the concurrent run)')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per route in the concurrent run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--routes', default=','.join(ROUTES), help='comma-separated subset of ' + ', '.join(ROUTES))
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    routes = [route for route in args.routes.split(',') if route]
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        parser.error(f'unknown routes: {", ".join(sorted(unknown))}')
+    log = (lambda message: print(message, file=sys.stderr)) if not args.output else print
+    report = run(args.database, args.requests, args.concurrency, args.duration, args.seed, routes, log)
+    body = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(body + '\n')
+    else:
+        print(body)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""Small thread-safe in-process caches"""
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+
+
+class LRUCache:
+    """Bounded mapping that evicts the least recently used entry"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard_where(self, predicate):
+        """Remove every entry whose key satisfies ``predicate``"""
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class StaleWhileRebuild:
+    """A process-wide structure built on first use and rebuilt in the background.
+
+    ``get(build)`` builds the value inline only the first time.  After
+    ``invalidate()`` it keeps returning the current copy and starts one
+    background thread that calls ``build()`` in an app context and swaps the
+    result in, so an edit never makes a request wait for a rebuild.
+    Invalidations during a rebuild start another one once it is done.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.value = None
+        self.generation = 0
+        self.built_generation = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def get(self, build):
+        value = self.value
+        if value is None:
+            with self.lock:
+                if self.value is None:
+                    self.built_generation = self.generation
+                    self.value = build()
+                value = self.value
+        elif self.built_generation != self.generation:
+            self._rebuild(build)
+        return value
+
+    def invalidate(self):
+        self.generation += 1
+
+    def _rebuild(self, build):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            app = current_app._get_current_object()
+            self.thread = threading.Thread(target=self._run, args=(app, build, self.generation),
+                                           name=f'rebuild-{self.name}', daemon=True)
+            self.thread.start()
+
+    def _run(self, app, build, generation):
+        try:
+            with app.app_context():
+                value = build()
+            self.value = value
+            self.built_generation = generation
+            app.logger.info('Rebuilt the %s', self.name)
+        except Exception:
+            app.logger.exception('Rebuilding the %s failed; serving the previous copy', self.name)
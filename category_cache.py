@@ -0,0 +1,80 @@
+"""Process-wide cache of the category list and per-category term counts.
+
+Categories change rarely but are rendered on nearly every page.  The list
+and the counts (one grouped query) are cached together and dropped when a
+category or term is committed in this process, or after
+``CATEGORY_CACHE_TTL`` seconds so other workers' edits show up too.
+"""
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import func
+
+from change_events import on_categories_changed, on_terms_changed
+from models import db, Category, Term
+
+
+class CachedCategory:
+    """Detached, read-only copy of a ``Category`` row with its term count"""
+
+    __slots__ = ('id', 'name_en', 'name_zh', 'description', 'term_count')
+
+    def __init__(self, id, name_en, name_zh, description, term_count):
+        self.id = id
+        self.name_en = name_en
+        self.name_zh = name_zh
+        self.description = description
+        self.term_count = term_count
+
+    def __repr__(self):
+        return f'<CachedCategory {self.name_en}>'
+
+
+_cache = None
+_loaded_at = 0.0
+_lock = threading.Lock()
+
+
+def _load():
+    counts = dict(
+        db.session.query(Term.category_id, func.count(Term.id)).group_by(Term.category_id)
+    )
+    rows = db.session.query(Category.id, Category.name_en, Category.name_zh, Category.description)
+    categories = [CachedCategory(*row, term_count=counts.get(row.id, 0)) for row in rows.order_by(Category.id)]
+    return categories, {category.id: category for category in categories}, sum(counts.values())
+
+
+def _get():
+    global _cache, _loaded_at
+    ttl = current_app.config.get('CATEGORY_CACHE_TTL', 300)
+    cache = _cache
+    if cache is None or time.monotonic() - _loaded_at > ttl:
+        with _lock:
+            if _cache is cache:
+                _cache = _load()
+                _loaded_at = time.monotonic()
+            cache = _cache
+    return cache
+
+
+def get_categories():
+    """All categories in id order, with ``term_count`` filled in"""
+    return _get()[0]
+
+
+def get_category(category_id):
+    """One cached category, or None"""
+    return _get()[1].get(category_id)
+
+
+def total_term_count():
+    """Number of terms, including those without a category"""
+    return _get()[2]
+
+
+@on_categories_changed
+@on_terms_changed
+def invalidate_categories(ids=None):
+    global _cache
+    _cache = None
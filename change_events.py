@@ -0,0 +1,64 @@
+"""In-process notifications for committed changes to terms and categories.
+
+Caches and indexes register a callback with ``on_terms_changed`` or
+``on_categories_changed``.  The session listeners below collect the ids of
+``Term`` and ``Category`` rows touched by each flush and call the callbacks
+with them once the transaction commits.  Writes that bypass the ORM unit of
+work (bulk Core inserts) must call ``terms_changed`` themselves.  Other
+processes hear of the same commits through the change log, see change_log.py.
+"""
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import Term, Category
+
+_term_listeners = []
+_category_listeners = []
+
+
+def on_terms_changed(func):
+    """Register ``func(term_ids)``; ``term_ids`` is None when everything changed"""
+    _term_listeners.append(func)
+    return func
+
+
+def on_categories_changed(func):
+    """Register ``func(category_ids)``; ``category_ids`` is None when everything changed"""
+    _category_listeners.append(func)
+    return func
+
+
+def terms_changed(term_ids=None):
+    for func in _term_listeners:
+        func(term_ids)
+
+
+def categories_changed(category_ids=None):
+    for func in _category_listeners:
+        func(category_ids)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    pending = session.info.setdefault('changed_rows', {'terms': set(), 'categories': set()})
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Term):
+            pending['terms'].add(obj.id)
+        elif isinstance(obj, Category):
+            pending['categories'].add(obj.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify_changes(session):
+    pending = session.info.pop('changed_rows', None)
+    if not pending:
+        return
+    if pending['categories']:
+        categories_changed(pending['categories'])
+    if pending['terms']:
+        terms_changed(pending['terms'])
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('changed_rows', None)
@@ -0,0 +1,147 @@
+"""Cross-worker term change log.
+
+change_events.py only tells the process that committed a write.  Every
+flush that writes terms also appends one ``term_changes`` row per term
+(sequence number, term id, op, origin) in the same transaction, and bulk
+imports append a single ``bulk`` row.  Each worker polls the table at most
+every ``TERM_CHANGES_POLL_INTERVAL`` seconds, from a ``before_request``
+hook, with one primary-key range query.  It passes the ids written by
+other processes to ``terms_changed``, so their indexes and caches apply the
+same deltas as for local commits.
+
+A transaction can take a sequence number and commit after a later one (on
+PostgreSQL; SQLite writers are serialised).  So each poll rescans the last
+``TERM_CHANGES_LOOKBACK`` sequence numbers and skips the rows it has already
+delivered.  ``flask prune-term-changes`` drops rows older than
+``TERM_CHANGES_RETENTION_DAYS``.
+
+A poller applies only the changes logged after its starting point, so that
+point must come before the indexes it keeps current are built: ``warm_up``
+calls ``change_poller.start()`` in the master before building them, and
+the forked workers inherit it.  Without a warmup (development server) the
+first poll starts at the latest change.
+"""
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func, insert, select
+from sqlalchemy.orm import Session
+
+from change_events import terms_changed
+from models import db, Term, TermChange
+
+# More new rows than this in one poll resets every cache instead
+POLL_LIMIT = 1000
+
+
+def origin():
+    """``host:pid`` of this process, stored with the rows it writes"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def log_term_changes(session, changes):
+    """Append ``(term_id, op)`` pairs to the log in ``session``'s transaction"""
+    if changes:
+        writer = origin()
+        session.execute(insert(TermChange), [
+            {'term_id': term_id, 'op': op, 'origin': writer, 'created_at': datetime.utcnow()}
+            for term_id, op in changes
+        ])
+
+
+@event.listens_for(Session, 'after_flush')
+def _log_flushed_terms(session, flush_context):
+    changes = [(obj.id, 'insert') for obj in session.new if isinstance(obj, Term)]
+    changes += [(obj.id, 'update') for obj in session.dirty
+                if isinstance(obj, Term) and session.is_modified(obj, include_collections=False)]
+    changes += [(obj.id, 'delete') for obj in session.deleted if isinstance(obj, Term)]
+    log_term_changes(session, changes)
+
+
+class ChangePoller:
+    """Reads the log past the last sequence number this process has seen"""
+
+    def __init__(self, lookback=100):
+        self.lookback = lookback
+        self.last_id = None
+        self.floor = 0
+        self.seen = set()
+        self.checked = 0.0
+        self.lock = threading.Lock()
+
+    def _start(self, connection):
+        # Caches built from now on already include everything logged so far
+        self.last_id = connection.execute(select(func.max(TermChange.id))).scalar() or 0
+        self.floor = self.last_id
+        self.seen.clear()
+
+    def start(self):
+        """Apply every change logged from now on; call before building the indexes"""
+        with db.engine.connect() as connection:
+            self._start(connection)
+
+    def poll(self):
+        """Deliver the changes other processes logged since the last poll; returns their count"""
+        with db.engine.connect() as connection:
+            if self.last_id is None:
+                self._start(connection)
+                return 0
+            rows = connection.execute(
+                select(TermChange.id, TermChange.term_id, TermChange.origin)
+                .where(TermChange.id > max(self.last_id - self.lookback, self.floor))
+                .order_by(TermChange.id)
+                .limit(self.lookback + POLL_LIMIT)
+            ).all()
+            if len(rows) == self.lookback + POLL_LIMIT:
+                self._start(connection)
+                terms_changed(None)
+                return len(rows)
+        new = [row for row in rows if row.id not in self.seen]
+        if rows:
+            self.last_id = max(self.last_id, rows[-1].id)
+        self.seen.update(row.id for row in new)
+        self.seen = {change_id for change_id in self.seen if change_id > self.last_id - self.lookback}
+        writer = origin()
+        # This process was told about its own writes when they committed
+        foreign = [row for row in new if row.origin != writer]
+        if any(row.term_id is None for row in foreign):
+            terms_changed(None)
+        elif foreign:
+            terms_changed({row.term_id for row in foreign})
+        return len(foreign)
+
+    def poll_if_due(self, interval):
+        now = time.monotonic()
+        if now - self.checked < interval or not self.lock.acquire(blocking=False):
+            return
+        try:
+            self.checked = now
+            self.poll()
+        finally:
+            self.lock.release()
+
+
+change_poller = ChangePoller()
+
+
+def prune_term_changes(days):
+    """Delete log rows older than ``days`` days; returns how many"""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    deleted = TermChange.query.filter(TermChange.created_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def init_change_log(app):
+    """Poll the log before requests, every ``TERM_CHANGES_POLL_INTERVAL`` seconds"""
+    interval = app.config.get('TERM_CHANGES_POLL_INTERVAL', 2.0)
+    change_poller.lookback = app.config.get('TERM_CHANGES_LOOKBACK', 100)
+    if not interval:
+        return
+
+    @app.before_request
+    def poll_term_changes():
+        change_poller.poll_if_due(interval)
@@ -0,0 +1,85 @@
+"""On-the-fly compression of dynamic HTML, JSON and text responses.
+
+``init_compression(app)`` installs an ``after_request`` hook that compresses
+buffered responses of at least ``COMPRESS_MIN_SIZE`` bytes with brotli (when
+installed and preferred by the client) or gzip, and adds
+``Vary: Accept-Encoding``.  Streamed responses (exports, streamed
+annotations) and responses that already have a Content-Encoding are left
+alone.
+
+Bodies are compressed with the one-shot C functions (``zlib.compress``,
+``brotli.compress``), which allocate and free their state inside C; Python's
+compressor objects cannot be reset between responses, so keeping one around
+saves nothing.  Responses with a strong ETag (the term pages, see
+http_cache.py) keep their compressed bodies in an LRU keyed on the ETag and
+encoding, so a popular page is compressed once per edit, not once per
+request.  Their ETag becomes weak, as the body is no longer byte-identical
+to the one it was computed for; If-None-Match is compared weakly.
+"""
+import zlib
+
+from flask import request
+
+from caching import LRUCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = {'text/html', 'text/plain', 'text/css', 'text/csv', 'application/json',
+                'application/javascript', 'application/xml', 'application/x-tbx+xml'}
+# Brotli first: 15-25% smaller than gzip for HTML at comparable speed
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+compressed_cache = LRUCache()
+
+
+def compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=level['br'])
+    return zlib.compress(data, level['gzip'], wbits=16 + zlib.MAX_WBITS)
+
+
+def _choose(accept_encodings):
+    for encoding in ENCODINGS:
+        if accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def init_compression(app):
+    """Install the compression hook on ``app``"""
+    min_size = app.config.get('COMPRESS_MIN_SIZE', 1024)
+    level = {'gzip': app.config.get('COMPRESS_LEVEL', 6), 'br': app.config.get('COMPRESS_BROTLI_QUALITY', 5)}
+    compressed_cache.maxsize = app.config.get('COMPRESS_CACHE_SIZE', 256)
+    if not min_size:
+        return
+
+    @app.after_request
+    def compress_response(response):
+        if (response.mimetype not in COMPRESSIBLE or response.is_streamed or response.direct_passthrough
+                or 'Content-Encoding' in response.headers or response.cache_control.no_transform):
+            return response
+        response.vary.add('Accept-Encoding')
+        if response.status_code != 200 or request.method == 'HEAD':
+            return response
+        data = response.get_data()
+        encoding = _choose(request.accept_encodings)
+        if encoding is None or len(data) < min_size:
+            return response
+
+        etag, weak = response.get_etag()
+        key = (etag, encoding) if etag and not weak else None
+        body = compressed_cache.get(key) if key else None
+        if body is None:
+            body = compress(data, encoding, level)
+            if key:
+                compressed_cache.set(key, body)
+        if len(body) >= len(data):
+            return response
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        if etag:
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,115 @@
+"""Engine options and read/write routing between a primary and read replicas.
+
+``configure_engines(app)`` turns the ``DB_*`` settings into
+``SQLALCHEMY_ENGINE_OPTIONS`` and registers every URL in
+``DATABASE_REPLICA_URLS`` as a bind named ``replica_<n>``.  Replica binds
+have no models of their own, so ``db.create_all()`` never touches them.
+
+``RoutingSession`` is the session class of ``db``.  Views decorated with
+``@replica_reads`` send their SELECTs to one replica, picked per session so
+a request sees a single snapshot; everything else, and any statement issued
+once the session has flushed or written, goes to the primary.  CLI commands,
+warmup and undecorated routes (``contribute``, the admin endpoints) always
+use the primary.
+"""
+import functools
+import random
+
+import sqlalchemy as sa
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+
+REPLICA_PREFIX = 'replica_'
+
+
+def engine_options(url, pool_size=None, max_overflow=None, pool_recycle=None, pre_ping=True,
+                   statement_timeout_ms=0):
+    """``create_engine`` keyword arguments for ``url`` from the DB_* settings"""
+    backend = sa.engine.make_url(url).get_backend_name()
+    options = {'pool_pre_ping': pre_ping}
+    if pool_recycle:
+        options['pool_recycle'] = pool_recycle
+    if backend == 'sqlite':
+        # SQLite pools are per file (or static for :memory:); sizes do not apply
+        return options
+    if pool_size is not None:
+        options['pool_size'] = pool_size
+    if max_overflow is not None:
+        options['max_overflow'] = max_overflow
+    if statement_timeout_ms:
+        if backend == 'postgresql':
+            options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout_ms}'}
+        elif backend == 'mysql':
+            options['connect_args'] = {'init_command': f'SET SESSION max_execution_time={statement_timeout_ms}'}
+    return options
+
+
+def configure_engines(app):
+    """Fill SQLALCHEMY_ENGINE_OPTIONS and the replica binds; call before ``db.init_app``"""
+    config = app.config
+
+    def options(url):
+        return engine_options(
+            url,
+            pool_size=config.get('DB_POOL_SIZE'),
+            max_overflow=config.get('DB_MAX_OVERFLOW'),
+            pool_recycle=config.get('DB_POOL_RECYCLE'),
+            pre_ping=config.get('DB_POOL_PRE_PING', True),
+            statement_timeout_ms=config.get('DB_STATEMENT_TIMEOUT_MS', 0)
+        )
+
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = options(config['SQLALCHEMY_DATABASE_URI'])
+    binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+    for number, url in enumerate(config.get('DATABASE_REPLICA_URLS') or ()):
+        binds[f'{REPLICA_PREFIX}{number}'] = {'url': url, **options(url)}
+    config['SQLALCHEMY_BINDS'] = binds
+
+
+def replica_reads(view):
+    """Route the SELECTs of a read-only view to a read replica, if any are configured"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.replica_reads = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session sending reads of ``@replica_reads`` views to a replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._use_replica(clause):
+            replica = self.info.get('replica')
+            if replica is None:
+                replicas = [key for key in self._db.engines if key and key.startswith(REPLICA_PREFIX)]
+                if replicas:
+                    replica = self.info['replica'] = random.choice(replicas)
+            if replica is not None:
+                return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _use_replica(self, clause):
+        if self._flushing or isinstance(clause, sa.sql.dml.UpdateBase):
+            # Read your own writes for the rest of the session
+            self.info['primary'] = True
+        if self.info.get('primary'):
+            return False
+        return has_request_context() and g.get('replica_reads', False)
+
+
+def replica_engines(db):
+    """``{bind key: engine}`` of the configured replicas"""
+    return {key: engine for key, engine in db.engines.items() if key and key.startswith(REPLICA_PREFIX)}
+
+
+def copy_sqlite_database(source, target):
+    """Overwrite the SQLite database of engine ``target`` with that of ``source``"""
+    source_connection = source.raw_connection()
+    target_connection = target.raw_connection()
+    try:
+        source_connection.driver_connection.backup(target_connection.driver_connection)
+    finally:
+        target_connection.close()
+        source_connection.close()
+    # Pooled connections may hold the old schema
+    target.dispose()
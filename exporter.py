@@ -0,0 +1,103 @@
+"""Streaming export of the whole termbase as JSONL, CSV or TBX.
+
+Rows are fetched in batches with ``yield_per`` (a server-side cursor on
+PostgreSQL) and written one at a time through generators, optionally
+gzip-compressed on the fly, so memory use does not grow with the size of the
+``terms`` table.  Records use the same field names as ``importer.py``, so an
+export can be re-imported as is.
+"""
+import csv
+import io
+import json
+import zlib
+
+from sqlalchemy import select
+
+from importer import IMPORT_FIELDS
+from models import db, Category, Term
+from tbx import tbx_entry, TBX_FOOTER, TBX_HEADER
+
+EXPORT_FIELDS = ('id',) + IMPORT_FIELDS + ('category',)
+
+FORMATS = ('jsonl', 'csv', 'tbx')
+
+MIMETYPES = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'tbx': 'application/x-tbx+xml',
+}
+
+# Flush compressed output in pieces of roughly this size
+GZIP_CHUNK_SIZE = 64 * 1024
+
+
+def iter_term_records(batch_size=1000):
+    """Yield every term as a dict of ``EXPORT_FIELDS``, ordered by id"""
+    # Resolve the category join once instead of per row
+    categories = dict(db.session.query(Category.id, Category.name_en))
+    columns = [getattr(Term, name) for name in ('id', 'category_id') + IMPORT_FIELDS]
+    statement = (
+        select(*columns)
+        .order_by(Term.id)
+        .execution_options(yield_per=batch_size, stream_results=True)
+    )
+    for row in db.session.execute(statement):
+        record = row._asdict()
+        record['category'] = categories.get(record.pop('category_id'))
+        yield record
+
+
+def iter_jsonl(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def iter_csv(records):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for record in records:
+        writer.writerow(record)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_tbx(records):
+    yield TBX_HEADER
+    for record in records:
+        yield tbx_entry(record)
+    yield TBX_FOOTER
+
+
+WRITERS = {
+    'jsonl': iter_jsonl,
+    'csv': iter_csv,
+    'tbx': iter_tbx,
+}
+
+
+def gzip_stream(chunks, level=6):
+    """Gzip-compress an iterable of strings, yielding bytes"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    pending = 0
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        pending += len(chunk)
+        if data:
+            yield data
+        if pending >= GZIP_CHUNK_SIZE:
+            pending = 0
+            yield compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def export_terms(fmt, compress=False, batch_size=1000):
+    """Return a generator producing the full export in ``fmt``"""
+    if fmt not in WRITERS:
+        raise ValueError(f'Unsupported export format {fmt!r}')
+    chunks = WRITERS[fmt](iter_term_records(batch_size=batch_size))
+    if compress:
+        return gzip_stream(chunks)
+    return (chunk.encode('utf-8') for chunk in chunks)
@@ -0,0 +1,59 @@
+"""Facet counts (category, WHO standard, reliability, subcategory) for searches.
+
+Backends compute the counts of all terms matching a query in one pass: the
+SQL backends with a single GROUP BY over the four columns, the in-memory
+backends by counting over the matching ids.  ``cached_facets`` keeps the
+result per normalised query (case, script and whitespace folded) in an LRU;
+entries are dropped when terms change in this process and expire after
+``FACET_CACHE_TTL`` seconds so other workers' edits show up too.
+"""
+import time
+
+from flask import current_app
+
+from caching import LRUCache
+from change_events import on_terms_changed
+from hanzi import fold
+
+FACETS = ('category', 'who_standard', 'reliability_score', 'subcategory')
+
+facet_cache = LRUCache()
+
+
+def facet_counts(rows):
+    """``{facet: {value: count}}`` from (category_id, who_standard, reliability_score, subcategory, count) rows"""
+    counts = {name: {} for name in FACETS}
+    for category_id, who_standard, reliability_score, subcategory, count in rows:
+        values = (category_id, bool(who_standard), reliability_score, subcategory or None)
+        for name, value in zip(FACETS, values):
+            counts[name][value] = counts[name].get(value, 0) + count
+    return counts
+
+
+def normalize_query(query):
+    return fold(' '.join(query.lower().split()))
+
+
+def cached_facets(backend, query):
+    """Facet counts of ``query`` from ``backend``, cached per normalised query"""
+    key = (backend.name, normalize_query(query))
+    entry = facet_cache.get(key)
+    if entry is not None and time.monotonic() - entry[0] < current_app.config.get('FACET_CACHE_TTL', 300):
+        return entry[1]
+    counts = backend.facets(query)
+    facet_cache.set(key, (time.monotonic(), counts))
+    return counts
+
+
+def facets_to_dict(counts):
+    """JSON form: per facet a list of ``{'value', 'count'}``, most frequent first"""
+    return {
+        name: [{'value': value, 'count': count}
+               for value, count in sorted(values.items(), key=lambda item: (-item[1], str(item[0])))]
+        for name, values in counts.items()
+    }
+
+
+@on_terms_changed
+def invalidate_facets(term_ids=None):
+    facet_cache.clear()
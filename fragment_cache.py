@@ -0,0 +1,150 @@
+"""Cache of rendered HTML fragments with time- and event-based invalidation.
+
+``fragment(name, render)`` returns the cached HTML of a fragment, calling
+``render()`` (which runs its own queries) only on a miss.  Every fragment
+depends on one or more tags ('terms', 'categories'); the cache keeps a
+generation number per tag, and the key of a fragment includes the current
+generations of its tags.  Committing a term or category bumps the tag's
+generation, so every fragment built from the old data stops being found
+and ages out.  ``FRAGMENT_CACHE_TTL`` bounds the age of an entry either way.
+
+``FRAGMENT_CACHE`` selects where entries and generations live:
+
+* ``memory`` - an LRU in each worker; other workers' edits show up after
+  the TTL
+* ``sqlite`` - a local SQLite file (``FRAGMENT_CACHE_PATH``) shared by all
+  workers on the host, so a fragment is rendered once per host and an edit
+  in any process, including the CLI, invalidates it everywhere at once
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from flask import current_app, has_app_context
+from markupsafe import Markup
+
+from caching import LRUCache
+from change_events import on_categories_changed, on_terms_changed
+
+
+class MemoryBackend:
+    """Per-process LRU of ``(expires, html)``"""
+
+    def __init__(self, maxsize=256):
+        self.entries = LRUCache(maxsize)
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def generation(self, tag):
+        return self.generations.get(tag, 0)
+
+    def bump(self, tag):
+        with self.lock:
+            self.generations[tag] = self.generations.get(tag, 0) + 1
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.time():
+            return None
+        return entry[1]
+
+    def set(self, key, html, ttl):
+        self.entries.set(key, (time.time() + ttl, html))
+
+
+class SQLiteBackend:
+    """Entries and generations in a SQLite file shared by the processes of one host"""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS fragments '
+                               '(key TEXT PRIMARY KEY, html TEXT NOT NULL, expires REAL NOT NULL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS generations '
+                               '(tag TEXT PRIMARY KEY, generation INTEGER NOT NULL)')
+
+    def _connect(self):
+        # One connection per thread and process; connections must not cross a fork
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def generation(self, tag):
+        row = self._connect().execute('SELECT generation FROM generations WHERE tag = ?', (tag,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, tag):
+        connection = self._connect()
+        connection.execute('INSERT INTO generations (tag, generation) VALUES (?, 1) '
+                           'ON CONFLICT (tag) DO UPDATE SET generation = generation + 1', (tag,))
+        # Entries of older generations are unreachable now; drop what has expired
+        connection.execute('DELETE FROM fragments WHERE expires < ?', (time.time(),))
+
+    def get(self, key):
+        row = self._connect().execute('SELECT html FROM fragments WHERE key = ? AND expires >= ?',
+                                      (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, html, ttl):
+        self._connect().execute('INSERT OR REPLACE INTO fragments (key, html, expires) VALUES (?, ?, ?)',
+                                (key, html, time.time() + ttl))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_fragment_cache(app=None):
+    """Return the process-wide backend selected by ``FRAGMENT_CACHE``"""
+    global _cache
+    cache = _cache
+    if cache is None:
+        app = app or current_app
+        with _cache_lock:
+            if _cache is None:
+                name = app.config.get('FRAGMENT_CACHE', 'memory')
+                if name == 'sqlite':
+                    _cache = SQLiteBackend(app.config['FRAGMENT_CACHE_PATH'])
+                elif name == 'memory':
+                    _cache = MemoryBackend(app.config.get('FRAGMENT_CACHE_SIZE', 256))
+                else:
+                    raise ValueError(f'Unknown FRAGMENT_CACHE {name!r}')
+            cache = _cache
+    return cache
+
+
+def fragment(name, render, depends_on=('terms', 'categories')):
+    """Return the HTML of fragment ``name``, calling ``render()`` only on a miss"""
+    cache = get_fragment_cache()
+    generations = ':'.join(str(cache.generation(tag)) for tag in depends_on)
+    key = f'{name}:{generations}'
+    html = cache.get(key)
+    if html is None:
+        html = str(render())
+        cache.set(key, html, current_app.config.get('FRAGMENT_CACHE_TTL', 300))
+    return Markup(html)
+
+
+def _bump(tag):
+    if has_app_context():
+        get_fragment_cache().bump(tag)
+    elif _cache is not None:
+        _cache.bump(tag)
+
+
+@on_terms_changed
+def invalidate_term_fragments(term_ids=None):
+    _bump('terms')
+
+
+@on_categories_changed
+def invalidate_category_fragments(category_ids=None):
+    _bump('categories')
@@ -0,0 +1,56 @@
+"""Gunicorn settings: load and warm the app once in the master, then fork"""
+import os
+import tempfile
+import time
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+# Where the workers share their metrics, so /metrics reports all of them (see metrics.py)
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), f"tcm-metrics-{os.environ.get('PORT', '8000')}"))
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+preload_app = True
+
+_started = time.perf_counter()
+
+
+def when_ready(server):
+    from app import app
+    from warmup import warm_up
+    import metrics
+    # Counters start over with the master; drop the files of the previous one
+    if metrics.shared is not None:
+        metrics.shared.clear()
+    timings = warm_up(app)
+    server.log.info('App loaded and warmed in %.1f ms (warmup %.1f ms)',
+                    (time.perf_counter() - _started) * 1000, timings['total'] * 1000)
+
+
+def post_fork(server, worker):
+    from app import app
+    from models import db
+    import metrics
+    # Drop pooled connections inherited from the master without closing them
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    # Adopt spools of crashed workers now rather than on the first post
+    if app.config['SUGGESTION_QUEUE']:
+        from suggestion_queue import get_suggestion_queue
+        get_suggestion_queue(app)
+    # Threads do not survive fork; restart the sampler in every worker
+    if metrics.profiler is not None:
+        metrics.profiler.start()
+    if metrics.shared is not None:
+        metrics.shared.start()
+
+
+def worker_exit(server, worker):
+    import metrics
+    if metrics.shared is not None:
+        metrics.shared.write()
+
+
+def child_exit(server, worker):
+    import metrics
+    # Keep the exited worker's counts in the totals /metrics reports
+    if metrics.shared is not None:
+        metrics.shared.archive(worker.pid)
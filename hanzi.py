@@ -0,0 +1,77 @@
+"""Folding of Traditional (and variant) Chinese characters to Simplified.
+
+Queries and stored Chinese text are folded to one canonical script before
+they are compared, so '氣虛', '气虚' and the mixed '氣虚' all find the same
+term.  The table below maps single characters only (the conversion is
+character-for-character, which is what matching needs); it covers the
+common vocabulary and the characters of TCM terminology.  It is turned into
+a ``str.translate`` table once at import time.
+
+Stored rows keep a folded copy in ``Term.chinese_folded`` (indexed) and in
+``search_text``; after extending the table run ``flask init-db --refold``.
+"""
+
+# Traditional or variant character followed by its Simplified form
+_PAIRS = '''
+丟丢 並并 乾干 亂乱 於于 亞亚 來来 侖仑 係系 倉仓 個个 們们 倫伦 偉伟 側侧 偵侦 傑杰 傘伞 備备 傳传
+傷伤 傾倾 僅仅 僑侨 價价 儀仪 億亿 儉俭 儘尽 優优 儲储 兇凶 兒儿 內内 兩两 冊册 凍冻 凱凯 刪删 別别
+剛刚 剝剥 剎刹 劃划 劇剧 劉刘 劍剑 劑剂 勁劲 動动 務务 勝胜 勞劳 勢势 勳勋 勵励 勸劝 匯汇 區区 協协
+卻却 厭厌 厲厉 參参 叢丛 吳吴 呂吕 員员 問问 啓启 啟启 喚唤 喪丧 喬乔 單单 嗎吗 嗆呛 嗇啬 嘔呕 嘗尝
+嘯啸 噁恶 噦哕 噯嗳 噴喷 嚥咽 嚨咙 嚴严 囈呓 囑嘱 圍围 園园 圓圆 圖图 團团 堅坚 報报 場场 塊块 塗涂
+塵尘 墊垫 墜坠 墮堕 墳坟 壓压 壞坏 壯壮 壺壶 壽寿 夠够 夢梦 夥伙 奪夺 奮奋 奧奥 婦妇 媽妈 嫵妩 嬰婴
+孫孙 學学 寧宁 實实 審审 寫写 寬宽 寶宝 將将 專专 尋寻 對对 導导 屆届 屍尸 屬属 岡冈 島岛 峽峡 崗岗
+嶺岭 嶽岳 巖岩 巔巅 帥帅 師师 帳帐 帶带 幣币 幫帮 幹干 幾几 庫库 廁厕 廠厂 廣广 廢废 廳厅 弳弪 張张
+強强 彈弹 彎弯 彙汇 彥彦 後后 徑径 從从 復复 徵征 徹彻 恆恒 惡恶 惱恼 惻恻 愛爱 愜惬 愨悫 態态 慘惨
+慚惭 慣惯 慮虑 慶庆 憂忧 憊惫 憐怜 憑凭 憤愤 憶忆 應应 懇恳 懶懒 懷怀 懸悬 懼惧 戀恋 戰战 戲戏 戶户
+拋抛 捨舍 掃扫 掙挣 揀拣 揚扬 換换 揮挥 損损 搖摇 搶抢 摻掺 撈捞 撐撑 撥拨 撫抚 擁拥 擇择 擊击 擋挡
+擔担 據据 擠挤 擬拟 擴扩 擾扰 攝摄 攣挛 攤摊 敗败 敘叙 敵敌 數数 斂敛 斃毙 斷断 昇升 時时 晉晋 晝昼
+暈晕 暉晖 暢畅 暫暂 曆历 曉晓 曬晒 書书 會会 朮术 東东 條条 極极 柵栅 桿杆 棗枣 楊杨 業业 榮荣 構构
+槍枪 樁桩 樂乐 樓楼 標标 樞枢 樣样 樸朴 橋桥 機机 檔档 檢检 檳槟 櫃柜 櫻樱 權权 欄栏 歐欧 歡欢 歲岁
+歷历 歸归 殘残 殺杀 殼壳 毀毁 氣气 汙污 沒没 決决 況况 淚泪 淨净 淺浅 溫温 測测 減减 湯汤 湧涌 溝沟
+溼湿 準准 滅灭 滯滞 滲渗 滿满 漁渔 漢汉 漲涨 潔洁 潛潜 潤润 澀涩 澤泽 濁浊 濃浓 濕湿 濟济 濱滨 濾滤
+瀉泻 瀕濒 瀝沥 灣湾 災灾 為为 烏乌 煉炼 煙烟 煩烦 熱热 燈灯 燒烧 營营 燦灿 爐炉 爭争 爲为 爺爷 牆墙
+牽牵 犧牺 狀状 猶犹 獎奖 獨独 獲获 獸兽 獻献 現现 琺珐 環环 瓊琼 產产 産产 畢毕 畫画 異异 當当 疊叠
+痙痉 痠酸 痺痹 瘉愈 瘋疯 瘍疡 瘓痪 瘡疮 瘧疟 瘻瘘 療疗 癆痨 癇痫 癒愈 癟瘪 癢痒 癤疖 癥症 癧疬 癩癞
+癬癣 癮瘾 癰痈 癱瘫 癲癫 發发 皺皱 盜盗 盡尽 監监 盤盘 盧卢 眾众 衆众 睏困 瞭了 礎础 確确 碼码 磚砖
+礙碍 礦矿 礬矾 祿禄 禍祸 禪禅 禮礼 禦御 稅税 種种 稱称 穀谷 穌稣 積积 穩稳 窩窝 窮穷 竅窍 竊窃 競竞
+筆笔 筍笋 築筑 範范 節节 簡简 簽签 籃篮 籠笼 糧粮 糾纠 紀纪 約约 紅红 紋纹 純纯 紙纸 級级 紛纷 紮扎
+細细 終终 組组 結结 絞绞 給给 絡络 絨绒 統统 絲丝 絕绝 綁绑 經经 綜综 綠绿 維维 綱纲 網网 綿绵 緊紧
+緒绪 線线 緣缘 編编 緩缓 緯纬 練练 縣县 縫缝 縮缩 縱纵 總总 績绩 繩绳 繪绘 繞绕 繳缴 續续 罰罚 罷罢
+羅罗 習习 翹翘 聖圣 聞闻 聯联 聰聪 聲声 聽听 職职 肅肃 脅胁 脈脉 脛胫 脫脱 脹胀 腎肾 腫肿 腦脑 腳脚
+腸肠 膕腘 膚肤 膠胶 膩腻 膽胆 膾脍 膿脓 臉脸 臍脐 臏膑 臘腊 臚胪 臟脏 臥卧 臨临 與与 興兴 舉举 舊旧
+艙舱 艱艰 莊庄 莖茎 莧苋 華华 萊莱 萬万 葉叶 葯药 蒐搜 蒼苍 蓋盖 蓮莲 蓽荜 蔔卜 蔘参 蔞蒌 蔥葱 蔣蒋
+蕎荞 薈荟 薊蓟 薑姜 薟莶 薦荐 薩萨 薺荠 藍蓝 藝艺 藥药 藶苈 蘆芦 蘇苏 蘭兰 蘿萝 處处 號号 虛虚 虧亏
+蛻蜕 蝕蚀 蝦虾 蝨虱 螢萤 蟬蝉 蟲虫 蠍蝎 蠟蜡 蠣蛎 蠱蛊 蠶蚕 術术 衝冲 衛卫 補补 裝装 裏里 裡里 製制
+複复 褲裤 襪袜 覺觉 規规 視视 親亲 覽览 觀观 見见 觸触 計计 訂订 討讨 訓训 託托 記记 訪访 設设 許许
+訶诃 診诊 註注 詞词 詢询 試试 詳详 誇夸 誌志 認认 誕诞 誠诚 誤误 說说 説说 課课 調调 談谈 請请 論论
+諸诸 謀谋 謊谎 謝谢 講讲 證证 譜谱 識识 譯译 議议 護护 讀读 變变 讓让 讚赞 豐丰 豬猪 貓猫 貝贝 貞贞
+負负 貢贡 財财 貨货 販贩 貪贪 貫贯 責责 貴贵 貸贷 費费 貼贴 貿贸 賀贺 資资 賓宾 賞赏 賠赔 賢贤 賣卖
+賤贱 質质 賴赖 賺赚 購购 贈赠 贊赞 趕赶 趙赵 趨趋 跡迹 踐践 蹤踪 蹺跷 躍跃 車车 軍军 軌轨 軟软 較较
+載载 輔辅 輕轻 輛辆 輩辈 輪轮 輸输 轉转 辦办 辭辞 農农 這这 連连 進进 運运 過过 達达 遙遥 遞递 遜逊
+遠远 適适 遲迟 遺遗 選选 還还 邊边 鄉乡 鄰邻 醜丑 醫医 醬酱 釋释 針针 鈍钝 鉀钾 鉛铅 鉤钩 銀银 銅铜
+鋁铝 鋒锋 錄录 錠锭 錢钱 錫锡 錯错 鍊炼 鍛锻 鍼针 鎮镇 鏡镜 鐘钟 鐵铁 鑰钥 鑽钻 長长 門门 閃闪 閉闭
+開开 閒闲 間间 閣阁 閱阅 闊阔 關关 陣阵 陰阴 陳陈 陸陆 陽阳 隊队 階阶 際际 隨随 險险 隱隐 隸隶 雖虽
+雙双 雜杂 雞鸡 離离 難难 雲云 電电 霧雾 靈灵 靜静 韌韧 韋韦 響响 頁页 頂顶 項项 順顺 須须 頑顽 頒颁
+預预 頓顿 頰颊 頭头 頷颔 頸颈 頻频 顆颗 題题 額额 顏颜 願愿 類类 顛颠 顧顾 顫颤 顯显 風风 颱台 飄飘
+飛飞 飢饥 飯饭 飲饮 飼饲 飽饱 飾饰 餅饼 餓饿 餘余 餵喂 館馆 饒饶 馬马 駐驻 騎骑 騙骗 驅驱 驗验 驚惊
+驟骤 體体 髒脏 髖髋 髮发 鬆松 鬚须 鬥斗 鬧闹 鬱郁 魚鱼 魯鲁 鮮鲜 鳥鸟 鳳凤 鳴鸣 鴨鸭 鵝鹅 鶴鹤 鹵卤
+鹹咸 鹽盐 麗丽 麥麦 麩麸 麯曲 麵面 麼么 黃黄 黨党 黴霉 點点 齊齐 齋斋 齒齿 齡龄 龍龙 龐庞 龜龟 鱉鳖
+鼈鳖 滷卤 疿痱 閨闺 眞真 擧举 併并 檯台 臺台 鬍胡 硃朱 呉吴 歳岁
+'''
+
+
+def _build_table():
+    table = {}
+    for pair in _PAIRS.split():
+        source, target = pair
+        if source != target:
+            table[ord(source)] = ord(target)
+    return table
+
+
+FOLD_TABLE = _build_table()
+
+
+def fold(text):
+    """Fold Traditional and variant characters to Simplified: '氣虛' -> '气虚'"""
+    return (text or '').translate(FOLD_TABLE)
@@ -0,0 +1,107 @@
+"""Conditional GET handling and rendered-body caching for single-term pages.
+
+The validator of a term page is derived from everything the page shows: the
+term's ``updated_at``, its category's ``updated_at``, the time its related
+terms were last computed (``flask build-related``) and the ids and latest
+``updated_at`` of the terms listed as related, read with two small queries
+before anything else.  A matching ``If-None-Match`` / ``If-Modified-Since``
+is answered with 304 straight away; otherwise the rendered body is served from an LRU keyed on the ETag,
+so a stale entry can never be returned even if another worker made the edit.
+"""
+import hashlib
+from datetime import timezone
+
+from flask import abort, current_app, request, Response
+
+from sqlalchemy import func, select
+
+from caching import LRUCache
+from change_events import on_terms_changed
+from models import db, Category, RelatedTerm, Term
+from related import fallback_related_query, TOP_K
+
+response_cache = LRUCache()
+
+
+def term_etag(term_id, variant, *stamps):
+    """Strong ETag for one representation (``variant``) of a term as of ``stamps``"""
+    stamp = ':'.join(value.isoformat() if hasattr(value, 'isoformat') else str(value or 0) for value in stamps)
+    return hashlib.sha1(f'{variant}:{term_id}:{stamp}'.encode()).hexdigest()[:20]
+
+
+def _listed_terms(term_id, category_id):
+    """``(id, updated_at)`` of the terms the page lists as related, as term_detail picks them"""
+    rows = (db.session.query(Term.id, Term.updated_at)
+            .join(RelatedTerm, RelatedTerm.related_term_id == Term.id)
+            .filter(RelatedTerm.term_id == term_id)
+            .order_by(RelatedTerm.rank).limit(TOP_K).all())
+    return rows or fallback_related_query(term_id, category_id).with_entities(Term.id, Term.updated_at).all()
+
+
+def _term_stamps(term_id):
+    """Modification times and listed ids the page depends on, or None if there is no such term"""
+    related_at = (select(func.max(RelatedTerm.computed_at))
+                  .where(RelatedTerm.term_id == Term.id).scalar_subquery())
+    row = (db.session.query(Term.updated_at, Category.updated_at, related_at, Term.category_id)
+           .outerjoin(Category, Term.category_id == Category.id)
+           .filter(Term.id == term_id).first())
+    if row is None:
+        return None
+    listed = _listed_terms(term_id, row.category_id)
+    listed_at = max((updated_at for _, updated_at in listed if updated_at), default=None)
+    return (*row[:3], listed_at, ','.join(str(related_id) for related_id, _ in listed))
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        # Weak comparison: compression.py weakens the ETag of compressed bodies
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def cached_term_response(term_id, variant, render):
+    """Return a 304, a cached body or a freshly rendered one for ``term_id``.
+
+    ``render`` is only called on a cache miss and may return a string or a
+    ``Response``.
+    """
+    stamps = _term_stamps(term_id)
+    if stamps is None:
+        abort(404)
+    etag = term_etag(term_id, variant, *stamps)
+    last_modified = None
+    times = [value for value in stamps if hasattr(value, 'isoformat')]
+    if times:
+        last_modified = max(times).replace(tzinfo=timezone.utc, microsecond=0)
+
+    if _not_modified(etag, last_modified):
+        response = Response(status=304)
+    else:
+        key = (variant, term_id, etag)
+        cached = response_cache.get(key)
+        if cached is None:
+            rendered = render()
+            if isinstance(rendered, Response):
+                cached = (rendered.get_data(), rendered.mimetype)
+            else:
+                cached = (rendered.encode('utf-8'), 'text/html')
+            response_cache.set(key, cached)
+        body, mimetype = cached
+        response = Response(body, mimetype=mimetype)
+
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config.get('TERM_CACHE_MAX_AGE', 300)
+    return response
+
+
+@on_terms_changed
+def _invalidate(term_ids):
+    if term_ids is None:
+        response_cache.clear()
+    else:
+        response_cache.discard_where(lambda key: key[1] in term_ids)
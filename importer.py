@@ -0,0 +1,262 @@
+"""Streaming bulk import of terms from CSV, JSONL or TBX files.
+
+Rows are read lazily, validated, and written in batches with executemany
+INSERT/UPDATE statements instead of one ORM object per row.  Terms are
+matched on (chinese_simplified, english_term): re-importing a glossary
+replaces the columns the file contains in the existing rows instead of
+duplicating them, and leaves the others alone, so a partial file (say, only
+keys and definitions) does not clear the rest.
+"""
+import csv
+import io
+import json
+import time
+from datetime import datetime
+from xml.etree.ElementTree import ParseError
+
+from sqlalchemy import insert, tuple_, update
+
+from change_events import terms_changed
+from change_log import log_term_changes
+from models import db, build_search_keys, build_search_text, Category, Term, SEARCH_TEXT_FIELDS
+from pinyin import PINYIN_KEY_FIELDS
+from tbx import iter_tbx_records
+
+# Columns that may be set from an import file
+IMPORT_FIELDS = (
+    'chinese_simplified', 'chinese_traditional', 'pinyin', 'english_term', 'english_aliases',
+    'definition_en', 'definition_zh', 'etymology', 'clinical_notes', 'subcategory', 'source',
+    'who_standard', 'reliability_score'
+)
+
+# Values of the columns a new term's record does not contain
+INSERT_DEFAULTS = dict(dict.fromkeys(IMPORT_FIELDS), who_standard=False, reliability_score=3, category_id=None)
+
+# Columns derived by build_search_keys
+SEARCH_KEY_FIELDS = PINYIN_KEY_FIELDS + ('chinese_folded',)
+
+# Import fields stored as text; the others are converted by clean_record
+TEXT_FIELDS = tuple(name for name in IMPORT_FIELDS if name not in ('who_standard', 'reliability_score'))
+
+FORMATS = ('csv', 'jsonl', 'tbx')
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+
+
+class MalformedFile(ValueError):
+    """Raised by ``import_terms`` when the file cannot be parsed past some row.
+
+    ``report`` counts the rows committed before that point.
+    """
+
+    def __init__(self, message, report):
+        super().__init__(message)
+        self.report = report
+
+
+class ImportReport:
+    """Counters and rejected rows for one import run"""
+
+    def __init__(self):
+        self.read = 0
+        self.inserted = 0
+        self.updated = 0
+        self.rejected = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self, max_rejected=100):
+        return {
+            'read': self.read,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'rejected': len(self.rejected),
+            'rejected_rows': [{'row': row, 'reason': reason} for row, reason in self.rejected[:max_rejected]],
+            'elapsed_seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+        }
+
+
+def guess_format(filename):
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension in ('json', 'ndjson'):
+        return 'jsonl'
+    return extension if extension in FORMATS else None
+
+
+def iter_records(fileobj, fmt):
+    """Yield raw record dicts from a binary file object"""
+    if fmt == 'tbx':
+        yield from iter_tbx_records(fileobj)
+        return
+    text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        yield from csv.DictReader(text)
+    elif fmt == 'jsonl':
+        for line in text:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    # Reported as a rejected row rather than aborting the import
+                    yield ValueError(f'invalid JSON: {e}')
+    else:
+        raise ValueError(f'Unsupported import format {fmt!r}')
+
+
+class CategoryResolver:
+    """Cached map from English or Chinese category names to ids"""
+
+    def __init__(self, create_missing=False):
+        self.create_missing = create_missing
+        self.ids = {}
+        for category in Category.query.all():
+            self.ids[category.name_en.strip().lower()] = category.id
+            self.ids[category.name_zh.strip().lower()] = category.id
+
+    def resolve(self, name):
+        """Return the category id for ``name``; raises ``ValueError`` if unknown"""
+        if not name:
+            return None
+        key = name.strip().lower()
+        if key not in self.ids:
+            if not self.create_missing:
+                raise ValueError(f'unknown category {name!r}')
+            category = Category(name_en=name.strip(), name_zh=name.strip())
+            db.session.add(category)
+            db.session.flush()
+            self.ids[key] = category.id
+        return self.ids[key]
+
+
+def clean_record(record, categories):
+    """Validate one raw record and return the values of the columns it contains.
+
+    Fields missing from the record (as opposed to present but empty) are left
+    out, so an upsert from a partial file keeps the existing values.
+    """
+    values = {}
+    for name in IMPORT_FIELDS:
+        if name not in record:
+            continue
+        value = record[name]
+        if name in TEXT_FIELDS and value is not None:
+            if not isinstance(value, str):
+                raise ValueError(f'{name} must be a string')
+            length = Term.__table__.c[name].type.length
+            if length and len(value.strip()) > length:
+                raise ValueError(f'{name} is longer than {length} characters')
+        if isinstance(value, str):
+            value = value.strip() or None
+        values[name] = value
+    if not values.get('chinese_simplified') or not values.get('english_term'):
+        raise ValueError('chinese_simplified and english_term are required')
+
+    if 'who_standard' in values:
+        who_standard = values['who_standard']
+        if isinstance(who_standard, str):
+            who_standard = who_standard.lower() in TRUE_VALUES
+        values['who_standard'] = bool(who_standard)
+
+    if 'reliability_score' in values and values['reliability_score'] is None:
+        # An empty cell keeps the current score (3 for a new term)
+        del values['reliability_score']
+    elif 'reliability_score' in values:
+        score = int(values['reliability_score'])
+        if not 1 <= score <= 5:
+            raise ValueError('reliability_score must be between 1 and 5')
+        values['reliability_score'] = score
+
+    if 'category' in record:
+        values['category_id'] = categories.resolve(record['category'])
+    return values
+
+
+def _with_search_fields(values):
+    values['search_text'] = build_search_text(values)
+    values.update(build_search_keys(values))
+    return values
+
+
+def _write_batch(batch, report, upsert):
+    # Later rows win when the same key appears twice in one batch
+    rows = {}
+    for values in batch:
+        key = (values['chinese_simplified'], values['english_term'])
+        rows[key] = dict(rows.get(key, {}), **values)
+
+    existing = {}
+    if upsert:
+        keys = list(rows)
+        key_columns = tuple_(Term.chinese_simplified, Term.english_term)
+        columns = [getattr(Term, name) for name in ('id',) + SEARCH_TEXT_FIELDS]
+        for row in db.session.query(*columns).filter(key_columns.in_(keys)):
+            existing[(row.chinese_simplified, row.english_term)] = row._asdict()
+
+    now = datetime.utcnow()
+    inserts = []
+    # Updates grouped by the set of columns they write, one executemany per group
+    updates = {}
+    for key, values in rows.items():
+        values['updated_at'] = now
+        if key in existing:
+            current = existing[key]
+            # search_text and the keys depend on columns the file may not contain
+            merged = {name: values.get(name, current[name]) for name in SEARCH_TEXT_FIELDS}
+            _with_search_fields(merged)
+            row = dict(values, id=current['id'], search_text=merged['search_text'])
+            row.update((name, merged[name]) for name in SEARCH_KEY_FIELDS)
+            updates.setdefault(frozenset(row), []).append(row)
+        else:
+            inserts.append(_with_search_fields(dict(INSERT_DEFAULTS, **values, created_at=now)))
+
+    if inserts:
+        db.session.execute(insert(Term), inserts)
+    for group in updates.values():
+        db.session.execute(update(Term), group)
+    # Other workers reset their caches when they see the bulk entry
+    log_term_changes(db.session, [(None, 'bulk')])
+    db.session.commit()
+    report.inserted += len(inserts)
+    report.updated += sum(len(group) for group in updates.values())
+
+
+def import_terms(fileobj, fmt, batch_size=1000, upsert=True, create_categories=False):
+    """Import every record from ``fileobj`` and return an ``ImportReport``"""
+    report = ImportReport()
+    categories = CategoryResolver(create_missing=create_categories)
+    batch = []
+    try:
+        for row_number, record in enumerate(iter_records(fileobj, fmt), start=1):
+            report.read += 1
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                batch.append(clean_record(record, categories))
+            except (AttributeError, TypeError, ValueError) as e:
+                report.rejected.append((row_number, str(e)))
+                continue
+            if len(batch) >= batch_size:
+                _write_batch(batch, report, upsert)
+                batch = []
+        if batch:
+            _write_batch(batch, report, upsert)
+        else:
+            db.session.commit()
+    except (ParseError, UnicodeDecodeError, csv.Error) as e:
+        db.session.rollback()
+        raise MalformedFile(f'malformed {fmt} file after row {report.read}: {e}', report) from e
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        report.elapsed = time.perf_counter() - report.started
+        if report.inserted or report.updated:
+            # Bulk statements bypass the unit of work, so notify explicitly
+            terms_changed(None)
+    return report
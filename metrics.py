@@ -0,0 +1,450 @@
+"""Request, SQL and template instrumentation exposed in Prometheus text format.
+
+``init_metrics(app)`` installs:
+
+* ``before_request``/``after_request`` hooks timing every request and
+  recording its status and response size per endpoint
+* ``before_cursor_execute``/``after_cursor_execute`` listeners on every
+  SQLAlchemy engine counting statements and database time, attributed to
+  the current endpoint; statements slower than ``SLOW_QUERY_MS`` are logged
+* ``before_render_template``/``template_rendered`` signal handlers timing
+  template rendering
+
+and serves everything on ``/metrics``.  Recording an observation is a dict
+lookup, a ``bisect`` and an increment under a lock, cheap enough to leave on
+permanently.
+
+The values live in each process.  With ``METRICS_DIR`` set (gunicorn.conf.py
+does so for its workers) every worker also writes them to ``<pid>.json`` in
+that directory every ``METRICS_WRITE_INTERVAL`` seconds and when it exits,
+and ``/metrics`` answers for all of them, whichever worker the load balancer
+picked: counters and histograms are summed, and gauges are reported per
+live worker, labelled with ``worker`` (its pid).  When a worker exits the
+master folds its file into ``archive.json``, so totals do not go backwards.
+Without ``METRICS_DIR`` a scrape sees the answering process only.
+
+``/metrics`` needs ``Authorization: Bearer $METRICS_TOKEN``; without a token
+configured it only answers requests from the loopback interface.
+
+With ``PROFILER=1`` a background thread samples the stacks of all threads
+every ``PROFILER_INTERVAL_MS`` and aggregates them in folded-stack format,
+served to admins on ``/debug/profile`` (feed it to flamegraph.pl or
+speedscope).
+"""
+import bisect
+import glob
+import hmac
+import ipaddress
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+
+from flask import Response, before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dump(self):
+        with self.lock:
+            return [[list(label_values), value] for label_values, value in self.values.items()]
+
+    @staticmethod
+    def combine(a, b):
+        return a + b
+
+    def samples(self, extra, values=None):
+        if values is None:
+            with self.lock:
+                values = dict(self.values)
+        for label_values, value in sorted(values.items()):
+            yield f'{self.name}{_labels(self.labels, label_values, extra)} {value}'
+
+
+class Gauge:
+    """Current value read from ``func()`` at scrape time"""
+
+    type = 'gauge'
+
+    def __init__(self, name, help, func=lambda: 0):
+        self.name = name
+        self.help = help
+        self.func = func
+
+    def dump(self):
+        return self.func()
+
+    def samples(self, extra, value=None):
+        yield f'{self.name}{_labels((), (), extra)} {self.func() if value is None else value}'
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.values = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                self.values[label_values] = counts = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def dump(self):
+        with self.lock:
+            return [[list(label_values), list(counts)] for label_values, counts in self.values.items()]
+
+    @staticmethod
+    def combine(a, b):
+        return [x + y for x, y in zip(a, b)]
+
+    def samples(self, extra, values=None):
+        if values is None:
+            with self.lock:
+                values = {key: list(counts) for key, counts in self.values.items()}
+        for label_values, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = (('le', bound if bound == '+Inf' else repr(float(bound))),)
+                yield f'{self.name}_bucket{_labels(self.labels, label_values, extra + le)} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labels, label_values, extra)} {counts[-1]}'
+            yield f'{self.name}_count{_labels(self.labels, label_values, extra)} {cumulative}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        """The current values in JSON form, see ``SharedMetrics``"""
+        return {'pid': os.getpid(), 'metrics': {metric.name: metric.dump() for metric in self.metrics}}
+
+    def merge(self, snapshots):
+        """Sum the counters and histograms of ``snapshots``: name -> label values -> value"""
+        totals = {}
+        for metric in self.metrics:
+            if metric.type == 'gauge':
+                continue
+            values = totals[metric.name] = {}
+            for snapshot in snapshots:
+                for label_values, value in snapshot['metrics'].get(metric.name, ()):
+                    key = tuple(label_values)
+                    values[key] = metric.combine(values[key], value) if key in values else value
+        return totals
+
+    def render(self, snapshots=None):
+        """Exposition text for this process, or for ``snapshots`` of several"""
+        totals = None if snapshots is None else self.merge(snapshots)
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            if totals is None:
+                lines.extend(metric.samples((('worker', os.getpid()),)))
+            elif metric.type == 'gauge':
+                for snapshot in snapshots:
+                    if snapshot.get('pid') and metric.name in snapshot['metrics']:
+                        lines.extend(metric.samples((('worker', snapshot['pid']),), snapshot['metrics'][metric.name]))
+            else:
+                lines.extend(metric.samples((), totals[metric.name]))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+REQUESTS = registry.add(Counter(
+    'tcm_http_requests_total', 'Requests handled', ('endpoint', 'method', 'status')))
+REQUEST_SECONDS = registry.add(Histogram(
+    'tcm_http_request_duration_seconds', 'Time to produce the response', ('endpoint',)))
+RESPONSE_BYTES = registry.add(Histogram(
+    'tcm_http_response_size_bytes', 'Size of non-streamed response bodies', ('endpoint',), SIZE_BUCKETS))
+SQL_STATEMENTS = registry.add(Counter(
+    'tcm_db_statements_total', 'SQL statements executed', ('endpoint',)))
+SQL_PER_REQUEST = registry.add(Histogram(
+    'tcm_db_statements_per_request', 'SQL statements executed by one request', ('endpoint',), COUNT_BUCKETS))
+SQL_SECONDS = registry.add(Histogram(
+    'tcm_db_duration_seconds', 'Database time spent by one request', ('endpoint',)))
+SLOW_QUERIES = registry.add(Counter(
+    'tcm_db_slow_queries_total', 'Statements slower than SLOW_QUERY_MS', ('endpoint',)))
+TEMPLATE_SECONDS = registry.add(Histogram(
+    'tcm_template_render_seconds', 'Template rendering time', ('template',)))
+
+
+class SharedMetrics:
+    """Snapshots of every worker's registry in one directory"""
+
+    ARCHIVE = 'archive.json'
+
+    def __init__(self, registry, directory, interval=5.0):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self.thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f'{pid}.json')
+
+    def _read(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path, data):
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(temporary, path)
+
+    def write(self):
+        """Write this process's values to ``<pid>.json``"""
+        self._write(self._path(os.getpid()), self.registry.snapshot())
+
+    def start(self):
+        """Write every ``interval`` seconds on a background thread (call in each worker)"""
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name='metrics-writer', daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.write()
+
+    def clear(self):
+        """Remove the files of an earlier run (call in the master before forking)"""
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            os.remove(path)
+
+    def archive(self, pid):
+        """Fold an exited worker's counters and histograms into the archive (call in the master)"""
+        snapshot = self._read(self._path(pid))
+        archive = self._read(os.path.join(self.directory, self.ARCHIVE)) or {'pids': [], 'metrics': {}}
+        if snapshot is not None:
+            totals = self.registry.merge([archive, snapshot])
+            archive['metrics'] = {name: [[list(key), value] for key, value in values.items()]
+                                  for name, values in totals.items()}
+        archive['pids'].append(pid)
+        # Readers skip the worker's file once the archive lists it
+        self._write(os.path.join(self.directory, self.ARCHIVE), archive)
+        if snapshot is not None:
+            os.remove(self._path(pid))
+
+    def collect(self):
+        """Snapshots of the archive and of every worker, this one's fresh"""
+        self.write()
+        workers = []
+        for path in sorted(glob.glob(os.path.join(self.directory, '*.json'))):
+            if os.path.basename(path)[:-len('.json')].isdigit():
+                snapshot = self._read(path)
+                if snapshot is not None:
+                    workers.append(snapshot)
+        # Read after the worker files: a worker archived in between is in
+        # this archive and skipped below, not missing from both
+        archive = self._read(os.path.join(self.directory, self.ARCHIVE))
+        if archive is None:
+            return workers
+        archived = set(archive['pids'])
+        return [dict(archive, pid=None)] + [snapshot for snapshot in workers if snapshot['pid'] not in archived]
+
+
+shared = None
+
+
+def _endpoint():
+    if has_request_context():
+        return request.endpoint or 'unmatched'
+    return 'none'
+
+
+class Instrumentation:
+    """Hooks recording the metrics above for one app"""
+
+    def __init__(self, app):
+        self.app = app
+        self.slow_query_seconds = app.config['SLOW_QUERY_MS'] / 1000.0 if app.config.get('SLOW_QUERY_MS') else None
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+        event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+        before_render_template.connect(self.before_render, app)
+        template_rendered.connect(self.after_render, app)
+
+    def before_request(self):
+        g._metrics_started = time.perf_counter()
+        g._metrics_statements = 0
+        g._metrics_db_seconds = 0.0
+
+    def after_request(self, response):
+        endpoint = _endpoint()
+        REQUESTS.inc(endpoint, request.method, str(response.status_code))
+        if not response.is_streamed:
+            RESPONSE_BYTES.observe(response.calculate_content_length() or 0, endpoint)
+        return response
+
+    def teardown_request(self, exc=None):
+        started = g.pop('_metrics_started', None)
+        if started is None:
+            return
+        endpoint = _endpoint()
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint)
+        statements = g.pop('_metrics_statements', 0)
+        SQL_PER_REQUEST.observe(statements, endpoint)
+        SQL_SECONDS.observe(g.pop('_metrics_db_seconds', 0.0), endpoint)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_metrics_started', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('_metrics_started')
+        if not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+        endpoint = _endpoint()
+        SQL_STATEMENTS.inc(endpoint)
+        if has_request_context() and '_metrics_started' in g:
+            g._metrics_statements += 1
+            g._metrics_db_seconds += elapsed
+        if self.slow_query_seconds is not None and elapsed >= self.slow_query_seconds:
+            SLOW_QUERIES.inc(endpoint)
+            self.app.logger.warning('Slow query (%.1f ms, %s): %s', elapsed * 1000, endpoint,
+                                    ' '.join(statement.split()))
+
+    def before_render(self, sender, template, context, **extra):
+        if has_request_context():
+            g.setdefault('_metrics_templates', []).append(time.perf_counter())
+
+    def after_render(self, sender, template, context, **extra):
+        if has_request_context():
+            started = g.get('_metrics_templates')
+            if started:
+                TEMPLATE_SECONDS.observe(time.perf_counter() - started.pop(), template.name or 'string')
+
+
+class SamplingProfiler:
+    """Aggregates folded stacks of every thread, sampled on a background thread"""
+
+    def __init__(self, interval=0.01, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = _Tally()
+        self.samples = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            folded = []
+            for thread_id, frame in frames.items():
+                if thread_id == own:
+                    continue
+                names = []
+                while frame is not None and len(names) < self.max_depth:
+                    code = frame.f_code
+                    names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                folded.append(';'.join(reversed(names)))
+            del frames
+            with self.lock:
+                self.samples += 1
+                self.stacks.update(folded)
+
+    def folded(self, reset=False):
+        """Return the profile in folded-stack format, one 'stack count' per line"""
+        with self.lock:
+            stacks = self.stacks
+            if reset:
+                self.stacks = _Tally()
+                self.samples = 0
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+
+profiler = None
+
+
+def _scrape_allowed(app):
+    token = app.config.get('METRICS_TOKEN')
+    if token:
+        header = request.headers.get('Authorization', '')
+        return header.startswith('Bearer ') and hmac.compare_digest(header[7:], token)
+    try:
+        return ipaddress.ip_address(request.remote_addr or '').is_loopback
+    except ValueError:
+        return False
+
+
+def init_metrics(app):
+    """Install the instrumentation and the /metrics endpoint on ``app``"""
+    global profiler, shared
+    Instrumentation(app)
+    if app.config.get('METRICS_DIR'):
+        shared = SharedMetrics(registry, app.config['METRICS_DIR'], app.config.get('METRICS_WRITE_INTERVAL', 5.0))
+
+    @app.route('/metrics')
+    def metrics():
+        if not _scrape_allowed(app):
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        body = registry.render(shared.collect()) if shared is not None else registry.render()
+        return Response(body, mimetype='text/plain; version=0.0.4')
+
+    if app.config.get('PROFILER'):
+        profiler = SamplingProfiler(interval=app.config.get('PROFILER_INTERVAL_MS', 10) / 1000.0)
+        profiler.start()
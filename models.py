@@ -1,7 +1,12 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from sqlalchemy import event
 
-db = SQLAlchemy()
+from db_routing import RoutingSession
+from hanzi import fold
+from pinyin import normalize_query, pinyin_keys
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class Category(db.Model):
     __tablename__ = 'categories'
@@ -10,6 +15,8 @@ class Category(db.Model):
     name_en = db.Column(db.String(100), nullable=False)
     name_zh = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
+    # Part of the ETag of the term pages that show the category, see http_cache.py
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     terms = db.relationship('Term', backref='category', lazy='dynamic')
     
     def __repr__(self):
@@ -17,6 +24,11 @@ class Category(db.Model):
 
 class Term(db.Model):
     __tablename__ = 'terms'
+    __table_args__ = (
+        # Keyset pagination order for /browse, see pagination.py
+        db.Index('ix_terms_browse_order', db.func.coalesce(db.text('pinyin'), ''), 'id'),
+        db.Index('ix_terms_category_browse_order', 'category_id', db.func.coalesce(db.text('pinyin'), ''), 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     
@@ -25,6 +37,14 @@ class Term(db.Model):
     chinese_traditional = db.Column(db.String(200), index=True)
     pinyin = db.Column(db.String(300), index=True)
     
+    # Chinese name folded to Simplified (see hanzi.py), for script-insensitive lookups
+    chinese_folded = db.Column(db.String(200), index=True)
+    
+    # Normalised pinyin search keys, derived from pinyin (see pinyin.py)
+    pinyin_plain = db.Column(db.String(300), index=True)
+    pinyin_numeric = db.Column(db.String(300), index=True)
+    pinyin_initials = db.Column(db.String(100), index=True)
+    
     # English terms
     english_term = db.Column(db.String(300), nullable=False, index=True)
     english_aliases = db.Column(db.Text)  # Comma-separated alternative translations
@@ -55,19 +75,90 @@ class Term(db.Model):
         return f'<Term {self.chinese_simplified} - {self.english_term}>'
     
     def update_search_text(self):
-        """Combine all searchable fields into one text field"""
-        parts = [
-            self.chinese_simplified or '',
-            self.chinese_traditional or '',
-            self.pinyin or '',
-            self.english_term or '',
-            self.english_aliases or '',
-            self.definition_en or '',
-            self.definition_zh or '',
-            self.etymology or '',
-            self.clinical_notes or ''
-        ]
-        self.search_text = ' '.join(parts).lower()
+        """Combine all searchable fields into one text field and refresh the search keys"""
+        values = {name: getattr(self, name) for name in SEARCH_TEXT_FIELDS}
+        self.search_text = build_search_text(values)
+        for name, value in build_search_keys(values).items():
+            setattr(self, name, value)
+
+# Fields concatenated into Term.search_text, in order
+SEARCH_TEXT_FIELDS = (
+    'chinese_simplified',
+    'chinese_traditional',
+    'pinyin',
+    'english_term',
+    'english_aliases',
+    'definition_en',
+    'definition_zh',
+    'etymology',
+    'clinical_notes'
+)
+
+def build_search_text(values):
+    """Build search_text from a mapping of term fields (used for bulk writes)"""
+    text = ' '.join(values.get(name) or '' for name in SEARCH_TEXT_FIELDS)
+    # Tone-free pinyin, spaced and run together, so substring search ignores both
+    toneless = normalize_query(values.get('pinyin'))
+    if toneless:
+        text += ' ' + toneless + ' ' + toneless.replace(' ', '')
+    # Chinese in one script, so Traditional and mixed-script queries match too
+    return fold(text.lower())
+
+def build_search_keys(values):
+    """Indexed lookup keys derived from a mapping of term fields"""
+    keys = pinyin_keys(values.get('pinyin'))
+    keys['chinese_folded'] = fold(values.get('chinese_simplified') or values.get('chinese_traditional')) or None
+    return keys
+
+@event.listens_for(Term, 'before_insert')
+@event.listens_for(Term, 'before_update')
+def _refresh_search_text(mapper, connection, target):
+    # search_text and the keys are derived, so every ORM write of a term recomputes them
+    target.update_search_text()
+
+class TermChange(db.Model):
+    """Append-only log of committed term writes, polled by the other workers (see change_log.py)"""
+    __tablename__ = 'term_changes'
+    # AUTOINCREMENT so SQLite never reuses a sequence number after pruning
+    __table_args__ = {'sqlite_autoincrement': True}
+    
+    id = db.Column(db.Integer, primary_key=True)  # Monotonic sequence number
+    term_id = db.Column(db.Integer)  # NULL when any term may have changed (bulk import)
+    op = db.Column(db.String(10), nullable=False)  # insert, update, delete, bulk
+    origin = db.Column(db.String(100))  # host:pid of the writing process
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class RelatedTerm(db.Model):
+    """Precomputed nearest neighbours of a term, see related.py"""
+    __tablename__ = 'related_terms'
+    
+    term_id = db.Column(db.Integer, db.ForeignKey('terms.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    related_term_id = db.Column(db.Integer, db.ForeignKey('terms.id', ondelete='CASCADE'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    related_term = db.relationship('Term', foreign_keys=[related_term_id])
+
+def add_missing_columns():
+    """Add columns (and their indexes) that were added to models after the table was created"""
+    inspector = db.inspect(db.engine)
+    added = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            db.session.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            added.append(column.name)
+            for index in table.indexes:
+                if column.name in index.columns:
+                    index.create(db.session.connection())
+    db.session.commit()
+    return added
 
 class Suggestion(db.Model):
     __tablename__ = 'suggestions'
@@ -0,0 +1,195 @@
+"""Keyset (cursor) pagination for /browse and /search.
+
+Pages are fetched with ``WHERE (k1, k2) > (:last_k1, :last_k2) ORDER BY k1,
+k2 LIMIT n`` instead of ``OFFSET``, so deep pages cost the same as the first
+one.  Cursors are opaque url-safe tokens holding the sort key of the boundary
+row and the page number.
+
+Plain ``?page=N`` URLs keep working: the cursor at the start of every page
+served is remembered, so walking page numbers in order becomes keyset
+lookups too, and only a jump to an unseen page falls back to ``OFFSET``.
+Totals are cached for ``COUNT_CACHE_TTL`` seconds rather than counted on
+every request.
+"""
+import base64
+import json
+import time
+from decimal import Decimal
+
+from flask_sqlalchemy.pagination import Pagination
+from sqlalchemy import and_, or_
+
+from caching import LRUCache
+from change_events import on_terms_changed
+
+COUNT_CACHE_TTL = 300
+
+# (cache key, page) -> sort key of the last row before that page
+_boundaries = LRUCache(maxsize=10000)
+# cache key -> (total, expires at)
+_counts = LRUCache(maxsize=10000)
+
+
+def encode_cursor(key, page):
+    data = json.dumps([list(key), page], separators=(',', ':'), ensure_ascii=False)
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+# Accepted key element types when a column's Python type is unknown
+_SCALARS = (int, float, str, type(None))
+
+
+def key_types(columns):
+    """Accepted Python types of each cursor key element for ``columns``"""
+    types = []
+    for column in columns:
+        try:
+            python_type = column.type.python_type
+        except (AttributeError, NotImplementedError):
+            python_type = None
+        if python_type is int:
+            types.append((int,))
+        elif python_type in (float, Decimal):
+            types.append((int, float))
+        elif python_type is str:
+            types.append((str,))
+        else:
+            types.append(_SCALARS)
+    return tuple(types)
+
+
+def _valid_key(key, types):
+    return len(key) == len(types) and all(
+        isinstance(value, accepted) and not isinstance(value, bool)
+        for value, accepted in zip(key, types)
+    )
+
+
+def decode_cursor(token, types=None):
+    """Return ``(key, page)`` or None for a missing or malformed token.
+
+    With ``types`` (see ``key_types``) a key of another length or with
+    elements of other types counts as malformed too, so a stale or edited
+    cursor falls back to the first page instead of failing a comparison.
+    """
+    if not token:
+        return None
+    try:
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        key, page = json.loads(data)
+        key, page = tuple(key), int(page)
+    except (ValueError, TypeError):
+        return None
+    if page < 1 or (types is not None and not _valid_key(key, types)):
+        return None
+    return key, page
+
+
+def _after(columns, key):
+    """Lexicographic ``columns > key`` written with portable AND/OR"""
+    clauses = []
+    for i, column in enumerate(columns):
+        equal = [columns[j] == key[j] for j in range(i)]
+        clauses.append(and_(*equal, column > key[i]))
+    return or_(*clauses)
+
+
+def _before(columns, key):
+    clauses = []
+    for i, column in enumerate(columns):
+        equal = [columns[j] == key[j] for j in range(i)]
+        clauses.append(and_(*equal, column < key[i]))
+    return or_(*clauses)
+
+
+def cached_count(cache_key, query):
+    """Row count of ``query``, cached for ``COUNT_CACHE_TTL`` seconds"""
+    cached = _counts.get(cache_key)
+    now = time.monotonic()
+    if cached is not None and cached[1] > now:
+        return cached[0]
+    total = query.order_by(None).count()
+    _counts.set(cache_key, (total, now + COUNT_CACHE_TTL))
+    return total
+
+
+@on_terms_changed
+def clear_cached_counts(term_ids=None):
+    _counts.clear()
+    _boundaries.clear()
+
+
+class KeysetPagination(Pagination):
+    """Page of ``query`` ordered ascending by ``order_by`` columns.
+
+    ``order_by`` expressions are selected alongside each row to build the
+    cursors, so they may be computed (e.g. a relevance rank).  ``cache_key``
+    identifies the filtered result set for the boundary and count caches.
+    """
+
+    def __init__(self, query, order_by, cache_key, page=1, per_page=20,
+                 after=None, before=None, total=None):
+        self.next_cursor = None
+        self.prev_cursor = None
+        self._keyset_query = query
+        self._order_by = tuple(order_by)
+        self._cache_key = cache_key
+        self._total = total
+        types = key_types(self._order_by)
+        self._after = decode_cursor(after, types)
+        self._before = decode_cursor(before, types)
+        if self._after:
+            page = self._after[1]
+        elif self._before:
+            page = self._before[1]
+        super().__init__(page=page, per_page=per_page, error_out=False)
+
+    def _fetch(self, query, reverse=False, offset=0):
+        order = [column.desc() if reverse else column for column in self._order_by]
+        query = query.add_columns(*self._order_by).order_by(*order)
+        rows = query.offset(offset).limit(self.per_page + 1).all()
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+        return rows, more
+
+    def _query_items(self):
+        query = self._keyset_query
+        columns = self._order_by
+        if self._before:
+            rows, more_before = self._fetch(query.filter(_before(columns, self._before[0])), reverse=True)
+            more_after = True
+        else:
+            start = self._after[0] if self._after else _boundaries.get((self._cache_key, self.page))
+            if start is not None:
+                rows, more_after = self._fetch(query.filter(_after(columns, start)))
+            elif self.page == 1:
+                rows, more_after = self._fetch(query)
+            else:
+                # Unseen deep page requested by number: fall back to OFFSET once
+                rows, more_after = self._fetch(query, offset=self._query_offset)
+            more_before = self.page > 1
+
+        if rows:
+            first_key = tuple(rows[0][1:])
+            last_key = tuple(rows[-1][1:])
+            _boundaries.set((self._cache_key, self.page + 1), last_key)
+            if more_after:
+                self.next_cursor = encode_cursor(last_key, self.page + 1)
+            if more_before:
+                self.prev_cursor = encode_cursor(first_key, self.page - 1)
+        return [row[0] for row in rows]
+
+    def _query_count(self):
+        if self._total is not None:
+            return self._total
+        return cached_count(self._cache_key, self._keyset_query)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.page > 1
@@ -0,0 +1,87 @@
+"""Pinyin normalisation helpers.
+
+Terms store tone-marked, space-separated pinyin ('zú sān lǐ').  On write
+three search keys are derived from it and stored in indexed columns:
+
+* ``pinyin_plain``    - tones and spaces removed: 'zusanli'
+* ``pinyin_numeric``  - tone numbers, spaces removed: 'zu2san1li3'
+* ``pinyin_initials`` - first letter of every syllable: 'zsl'
+
+``pinyin_query`` normalises a search query the same way and says which key
+it should be matched against, so lookups become indexed prefix scans.
+"""
+import re
+import unicodedata
+
+_WHITESPACE = re.compile(r'\s+')
+_SYLLABLE_SEPARATORS = re.compile(r"[\s'’\-]+")
+_PLAIN_QUERY = re.compile(r"[a-z'’\s\-]+")
+_NUMERIC_QUERY = re.compile(r"[a-z0-5'’\s\-]+")
+
+# Combining marks of the four tones after NFD decomposition
+_TONE_MARKS = {'̄': '1', '́': '2', '̌': '3', '̀': '4'}
+
+PINYIN_KEY_FIELDS = ('pinyin_plain', 'pinyin_numeric', 'pinyin_initials')
+
+
+def strip_tones(text):
+    """Remove tone marks: 'zú sān lǐ' -> 'zu san li', 'lǜ' -> 'lu'"""
+    decomposed = unicodedata.normalize('NFD', text or '')
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def normalize_query(text):
+    """Lowercase, strip tones and collapse runs of whitespace"""
+    return _WHITESPACE.sub(' ', strip_tones(text).lower()).strip()
+
+
+def _syllables(text):
+    return [s for s in _SYLLABLE_SEPARATORS.split((text or '').lower()) if s]
+
+
+def tone_numbers(text):
+    """Tone marks to trailing numbers: 'zú sān lǐ' -> 'zu2 san1 li3'"""
+    syllables = []
+    for syllable in _syllables(text):
+        decomposed = unicodedata.normalize('NFD', syllable)
+        tone = ''.join(_TONE_MARKS.get(c, '') for c in decomposed)[:1]
+        syllables.append(''.join(c for c in decomposed if not unicodedata.combining(c)) + tone)
+    return ' '.join(syllables)
+
+
+def pinyin_keys(pinyin):
+    """Return the ``PINYIN_KEY_FIELDS`` values for a stored pinyin string"""
+    if not pinyin or not pinyin.strip():
+        return dict.fromkeys(PINYIN_KEY_FIELDS)
+    plain = [strip_tones(s) for s in _syllables(pinyin)]
+    return {
+        'pinyin_plain': ''.join(plain),
+        'pinyin_numeric': tone_numbers(pinyin).replace(' ', ''),
+        'pinyin_initials': ''.join(s[0] for s in plain),
+    }
+
+
+def pinyin_query(query):
+    """Return ``[(key field, prefix), ...]`` to match ``query`` against.
+
+    A query with tone marks or tone numbers is matched against
+    ``pinyin_numeric``; plain letters against ``pinyin_plain`` and, when
+    typed without spaces, ``pinyin_initials``.  Anything that cannot be
+    pinyin (CJK characters, other punctuation) returns an empty list.
+    """
+    query = (query or '').strip().lower().replace('ü', 'u').replace('v', 'u')
+    if not query:
+        return []
+    if any(unicodedata.combining(c) for c in unicodedata.normalize('NFD', query)):
+        query = tone_numbers(query)
+    if _PLAIN_QUERY.fullmatch(query):
+        plain = ''.join(_syllables(query))
+        lookups = [('pinyin_plain', plain)]
+        if len(_syllables(query)) == 1:
+            lookups.append(('pinyin_initials', plain))
+        return lookups
+    if _NUMERIC_QUERY.fullmatch(query):
+        # 5 (or 0) marks the neutral tone, which is stored without a number
+        numeric = re.sub(r'[05]', '', ''.join(_syllables(query)))
+        return [('pinyin_numeric', numeric)] if numeric else []
+    return []
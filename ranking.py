@@ -0,0 +1,109 @@
+"""Relevance tiers for search results.
+
+Every match is put in the first tier it qualifies for:
+
+0. exact headword: the Chinese name (script-folded), the English term or
+   the full pinyin equals the query
+1. headword prefix: the Chinese name, the English term or a pinyin key
+   (plain, tone numbers, initials) starts with the query
+2. alias: an English alias contains the query
+3. other headword match: the Chinese name (Simplified or Traditional),
+   the pinyin or the English term contains the query
+4. anything else: definitions, etymology and clinical notes
+
+The score is ``tier * TIER_POINTS`` minus the configured boosts,
+``RANK_WHO_BOOST`` for WHO-standard terms and ``RANK_RELIABILITY_BOOST``
+per reliability point, both in tiers (0.5 moves a term half a tier up).
+Scores are integers so they compare exactly in keyset cursors; lower is
+better and ties are broken by id.  ``rank_expression`` computes the score in
+SQL for the database backends, ``TermRanker`` in Python for the in-memory
+ones, from the same rules.
+"""
+from functools import lru_cache
+
+from flask import current_app
+from sqlalchemy import case, func, or_
+
+from hanzi import fold
+from models import Term
+from pinyin import pinyin_keys, pinyin_query
+
+TIER_POINTS = 100
+OTHER_TIER = 4
+
+# The keys of a stored pinyin string never change; scoring a broad query
+# would otherwise recompute them for every match
+_term_pinyin_keys = lru_cache(maxsize=65536)(pinyin_keys)
+
+
+def _boost_points(app=None):
+    config = (app or current_app).config
+    return (round(config.get('RANK_WHO_BOOST', 0.5) * TIER_POINTS),
+            round(config.get('RANK_RELIABILITY_BOOST', 0.05) * TIER_POINTS))
+
+
+def _like_prefix(value):
+    return value + '%'
+
+
+def _like_contains(value):
+    return '%' + value + '%'
+
+
+def rank_expression(query):
+    """SQL score of a ``Term`` row for ``query``, see the module docstring"""
+    lowered = query.strip().lower()
+    folded = fold(lowered)
+    keys = pinyin_query(query)
+    english = func.lower(Term.english_term)
+    exact = [Term.chinese_folded == folded, english == lowered]
+    exact += [getattr(Term, name) == key for name, key in keys if name != 'pinyin_initials']
+    prefix = [Term.chinese_folded.like(_like_prefix(folded)), english.like(_like_prefix(lowered))]
+    prefix += [getattr(Term, name).like(_like_prefix(key)) for name, key in keys]
+    other = [Term.chinese_folded.like(_like_contains(folded)), Term.pinyin.ilike(_like_contains(lowered)),
+             english.like(_like_contains(lowered))]
+    tier = case(
+        (or_(*exact), 0),
+        (or_(*prefix), 1),
+        (Term.english_aliases.ilike(_like_contains(lowered)), 2),
+        (or_(*other), 3),
+        else_=OTHER_TIER
+    )
+    who_points, reliability_points = _boost_points()
+    return (tier * TIER_POINTS
+            - case((Term.who_standard.is_(True), who_points), else_=0)
+            - func.coalesce(Term.reliability_score, 0) * reliability_points)
+
+
+class TermRanker:
+    """Python version of ``rank_expression`` for one query"""
+
+    def __init__(self, query, app=None):
+        self.lowered = query.strip().lower()
+        self.folded = fold(self.lowered)
+        self.keys = pinyin_query(query)
+        self.who_points, self.reliability_points = _boost_points(app)
+
+    def tier(self, headwords, aliases):
+        """``headwords``: folded, lowercased (simplified, traditional, pinyin, english)"""
+        simplified, traditional, pinyin, english = headwords
+        chinese = simplified or traditional
+        term_keys = _term_pinyin_keys(pinyin) if self.keys and pinyin else {}
+        if chinese == self.folded or english == self.lowered:
+            return 0
+        if any(term_keys.get(name) == key for name, key in self.keys if name != 'pinyin_initials'):
+            return 0
+        if chinese.startswith(self.folded) or english.startswith(self.lowered):
+            return 1
+        if any((term_keys.get(name) or '').startswith(key) for name, key in self.keys):
+            return 1
+        if self.lowered in aliases:
+            return 2
+        if self.folded in chinese or self.lowered in pinyin or self.lowered in english:
+            return 3
+        return OTHER_TIER
+
+    def score(self, headwords, aliases, who_standard, reliability_score):
+        return (self.tier(headwords, aliases) * TIER_POINTS
+                - (self.who_points if who_standard else 0)
+                - (reliability_score or 0) * self.reliability_points)
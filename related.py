@@ -0,0 +1,261 @@
+"""Offline "related terms" job: TF-IDF nearest neighbours stored in related_terms.
+
+Each term becomes a sparse TF-IDF vector over Chinese character uni/bigrams
+(names and definition_zh) and English words (term, aliases, definition_en).
+The matrix is kept in CSC form (feature -> postings) as plain NumPy arrays;
+the similarities of one term against all others are one gather over the
+postings of its features plus a ``bincount``, and ``argpartition`` picks the
+top k.  Features shared by more than ``MAX_DF`` of all terms carry almost no
+signal and are dropped to keep the gathers short.
+
+``flask build-related`` recomputes everything; ``--incremental`` only
+recomputes terms edited since their neighbours were computed, plus the terms
+whose neighbour lists those edits can change, and drops the rows of deleted
+terms.  ORM deletes of a term drop them at once (SQLite does not enforce
+the ``ON DELETE CASCADE``).
+"""
+import math
+import re
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import delete, event, func, insert, or_, select
+from sqlalchemy.orm import contains_eager, Session
+
+from models import db, RelatedTerm, Term
+from search_index import is_cjk
+
+TOP_K = 5
+MAX_DF = 0.2
+# Added to the cosine similarity of terms in the same category
+CATEGORY_BOOST = 0.05
+# Weight of features from names and aliases relative to definitions
+NAME_WEIGHT = 2.0
+
+_WORD = re.compile(r'[a-z][a-z\-]+')
+_STOPWORDS = frozenset(
+    'the and for with that this from are was were which into its their has have'
+    ' of to in on by as is or an be it at'.split()
+)
+
+
+def term_features(row):
+    """Weighted feature counts for one term mapping"""
+    features = Counter()
+
+    def add_chinese(text, weight):
+        chars = [c for c in (text or '') if is_cjk(c)]
+        for i, char in enumerate(chars):
+            features['z:' + char] += weight
+            if i + 1 < len(chars):
+                features['z:' + char + chars[i + 1]] += weight
+
+    def add_english(text, weight):
+        for word in _WORD.findall((text or '').lower()):
+            if word not in _STOPWORDS:
+                features['e:' + word] += weight
+
+    add_chinese(row['chinese_simplified'], NAME_WEIGHT)
+    add_chinese(row['definition_zh'], 1.0)
+    add_english(row['english_term'], NAME_WEIGHT)
+    add_english(row['english_aliases'], NAME_WEIGHT)
+    add_english(row['definition_en'], 1.0)
+    return features
+
+
+class TermVectors:
+    """L2-normalised TF-IDF vectors of every term in CSR and CSC layout"""
+
+    def __init__(self, rows):
+        self.term_ids = np.array([row['id'] for row in rows], dtype=np.int64)
+        self.categories = np.array([row['category_id'] or -1 for row in rows], dtype=np.int64)
+        self.position = {term_id: i for i, term_id in enumerate(self.term_ids.tolist())}
+
+        counts = [term_features(row) for row in rows]
+        document_frequency = Counter(feature for features in counts for feature in features)
+        n = len(rows)
+        limit = max(2, MAX_DF * n)
+        vocabulary = {}
+        idf = []
+        for feature, df in document_frequency.items():
+            if df <= limit:
+                vocabulary[feature] = len(idf)
+                idf.append(math.log((1 + n) / (1 + df)) + 1.0)
+        idf = np.array(idf)
+
+        indptr = [0]
+        indices = []
+        data = []
+        for features in counts:
+            for feature, count in features.items():
+                column = vocabulary.get(feature)
+                if column is not None:
+                    indices.append(column)
+                    data.append(1.0 + math.log(count))
+            indptr.append(len(indices))
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.indices = np.array(indices, dtype=np.int64)
+        self.data = np.array(data, dtype=np.float64) * idf[self.indices] if indices else np.zeros(0)
+
+        # Normalise every row to unit length
+        lengths = np.diff(self.indptr)
+        rows_of_values = np.repeat(np.arange(n), lengths)
+        norms = np.sqrt(np.bincount(rows_of_values, weights=self.data ** 2, minlength=n))
+        norms[norms == 0] = 1.0
+        self.data /= norms[rows_of_values]
+
+        # Transposed copy: postings of each feature
+        order = np.argsort(self.indices, kind='stable')
+        self.col_rows = rows_of_values[order]
+        self.col_data = self.data[order]
+        self.col_ptr = np.concatenate(([0], np.cumsum(np.bincount(self.indices, minlength=len(idf)))))
+
+    def __len__(self):
+        return len(self.term_ids)
+
+    def similarities(self, i):
+        """Cosine similarity of row ``i`` against every row"""
+        start, end = self.indptr[i], self.indptr[i + 1]
+        columns = self.indices[start:end]
+        weights = self.data[start:end]
+        if not len(columns):
+            return np.zeros(len(self))
+        begins, ends = self.col_ptr[columns], self.col_ptr[columns + 1]
+        lengths = ends - begins
+        # Gather all postings of this row's features in one vectorised step
+        offsets = np.repeat(begins - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        positions = np.arange(lengths.sum()) + offsets
+        products = self.col_data[positions] * np.repeat(weights, lengths)
+        return np.bincount(self.col_rows[positions], weights=products, minlength=len(self))
+
+    def neighbours(self, i, k=TOP_K):
+        """Return ``[(term_id, score), ...]`` for the k most similar terms"""
+        scores = self.similarities(i)
+        scores += (self.categories == self.categories[i]) * CATEGORY_BOOST * (scores > 0)
+        scores[i] = 0.0
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k)[:k]]
+        candidates = candidates[np.lexsort((self.term_ids[candidates], -scores[candidates]))]
+        return [(int(self.term_ids[j]), float(scores[j])) for j in candidates]
+
+
+def load_vectors():
+    columns = [Term.id, Term.category_id, Term.chinese_simplified, Term.definition_zh,
+               Term.english_term, Term.english_aliases, Term.definition_en]
+    rows = [row._asdict() for row in db.session.query(*columns).order_by(Term.id).yield_per(1000)]
+    return TermVectors(rows)
+
+
+def _store(vectors, positions, k, batch_size=1000):
+    now = datetime.utcnow()
+    term_ids = [int(vectors.term_ids[i]) for i in positions]
+    for start in range(0, len(term_ids), batch_size):
+        chunk = term_ids[start:start + batch_size]
+        db.session.execute(delete(RelatedTerm).where(RelatedTerm.term_id.in_(chunk)))
+        rows = []
+        for term_id in chunk:
+            for rank, (related_id, score) in enumerate(vectors.neighbours(vectors.position[term_id], k)):
+                rows.append({'term_id': term_id, 'rank': rank, 'related_term_id': related_id,
+                             'score': score, 'computed_at': now})
+        if rows:
+            db.session.execute(insert(RelatedTerm), rows)
+        db.session.commit()
+    return len(term_ids)
+
+
+def build_related(k=TOP_K):
+    """Recompute the neighbours of every term; returns the number of terms"""
+    vectors = load_vectors()
+    db.session.execute(delete(RelatedTerm))
+    return _store(vectors, range(len(vectors)), k)
+
+
+def _delete_related_rows(session, term_ids):
+    session.execute(delete(RelatedTerm).where(
+        or_(RelatedTerm.term_id.in_(term_ids), RelatedTerm.related_term_id.in_(term_ids))
+    ))
+
+
+@event.listens_for(Session, 'after_flush')
+def _drop_related_of_deleted(session, flush_context):
+    deleted = [obj.id for obj in session.deleted if isinstance(obj, Term)]
+    if deleted:
+        _delete_related_rows(session, deleted)
+
+
+def build_related_incremental(k=TOP_K):
+    """Recompute only what edits since the last run can have changed"""
+    # Rows left behind by terms deleted outside the ORM; the lists that
+    # pointed at them are recomputed below
+    existing = select(Term.id)
+    removed = {
+        term_id for (term_id,) in db.session.query(RelatedTerm.related_term_id)
+        .filter(RelatedTerm.related_term_id.not_in(existing)).distinct()
+    }
+    removed.update(
+        term_id for (term_id,) in db.session.query(RelatedTerm.term_id)
+        .filter(RelatedTerm.term_id.not_in(existing)).distinct()
+    )
+    stale = set()
+    if removed:
+        stale = {term_id for (term_id,) in db.session.query(RelatedTerm.term_id)
+                 .filter(RelatedTerm.related_term_id.in_(removed))} - removed
+        _delete_related_rows(db.session, removed)
+        db.session.commit()
+
+    computed = dict(
+        db.session.query(RelatedTerm.term_id, func.min(RelatedTerm.computed_at)).group_by(RelatedTerm.term_id)
+    )
+    changed = [
+        term_id for term_id, updated_at in db.session.query(Term.id, Term.updated_at)
+        if term_id not in computed or (updated_at and updated_at > computed[term_id])
+    ]
+    if not changed and not stale:
+        return 0
+    vectors = load_vectors()
+    changed = [term_id for term_id in changed if term_id in vectors.position]
+    changed_set = set(changed)
+
+    # Current k-th best score per term (0 while its list is not full)
+    floor = {
+        term_id: lowest if count >= k else 0.0
+        for term_id, lowest, count in db.session.query(
+            RelatedTerm.term_id, func.min(RelatedTerm.score), func.count()
+        ).group_by(RelatedTerm.term_id)
+    }
+    # Terms that currently list a changed term must be recomputed too
+    affected = set(changed) | stale
+    affected.update(
+        term_id for (term_id,) in db.session.query(RelatedTerm.term_id)
+        .filter(RelatedTerm.related_term_id.in_(changed))
+    )
+    # Similarity is symmetric: a changed term may now enter other terms' lists
+    for term_id in changed:
+        scores = vectors.similarities(vectors.position[term_id])
+        for j in np.flatnonzero(scores > 0).tolist():
+            other = int(vectors.term_ids[j])
+            if other not in changed_set and scores[j] >= floor.get(other, 0.0) - CATEGORY_BOOST:
+                affected.add(other)
+
+    positions = [vectors.position[term_id] for term_id in affected if term_id in vectors.position]
+    return _store(vectors, positions, k)
+
+
+def fallback_related_query(term_id, category_id, limit=TOP_K):
+    """Same-category terms shown while the related terms of ``term_id`` are not computed"""
+    return Term.query.filter(Term.category_id == category_id, Term.id != term_id).order_by(Term.id).limit(limit)
+
+
+def related_terms_for(term_id, limit=TOP_K):
+    """Precomputed related terms of ``term_id`` in rank order (one indexed query)"""
+    return [
+        row.related_term for row in RelatedTerm.query
+        # Inner join: a row whose target was deleted behind the ORM's back is skipped
+        .join(RelatedTerm.related_term)
+        .options(contains_eager(RelatedTerm.related_term))
+        .filter(RelatedTerm.term_id == term_id)
+        .order_by(RelatedTerm.rank)
+        .limit(limit)
+    ]
@@ -0,0 +1,389 @@
+"""Pluggable search backends used by the /search and /api/search routes.
+
+``SEARCH_ENGINE`` selects the backend:
+
+* ``database`` - portable ``ilike '%q%'`` scans (the original behaviour)
+* ``ngram``    - the in-memory index from ``search_index.py``
+* ``snapshot`` - the same index compiled into the memory-mapped file of
+  ``snapshot.py``, shared by all workers; results come from the file too
+* ``fts``      - the database's native full-text index: an FTS5 trigram
+  table on SQLite, or GIN pg_trgm/tsvector indexes on PostgreSQL, chosen
+  from the dialect of ``DATABASE_URL``
+
+Every backend also prefix-matches queries against the indexed lookup keys:
+the normalised pinyin keys (``pinyin.py``), so 'zusanli', 'zu2 san1' and
+'zsl' find 足三里, and the script-folded Chinese name (``hanzi.py``), so
+'氣虛', '气虚' and '氣虚' are one indexed lookup.
+
+Every backend returns a ``Pagination`` for ``search()`` and a list of
+``Term`` objects (read-only ``SnapshotTerm`` stand-ins for ``snapshot``) for
+``suggest()``, and ``facets()`` counts every match per category, WHO
+standard, reliability and subcategory (see facets.py).
+
+With ``SEARCH_RANKING`` on, results are ordered by the relevance tiers of
+ranking.py (exact headword, prefix, alias, other headword match, body text,
+adjusted by the WHO and reliability boosts), then by each backend's own
+score, then by id.  The SQL backends compute the score in the query and page
+with keyset cursors (``after``/``before``) over it, so the database does the
+top-k selection; the in-memory backends score their matches in Python and
+select the page with a bounded heap (``RankedPagination``).  With ranking
+off, the in-memory backends slice their id-ordered list.
+"""
+from flask import current_app
+from sqlalchemy import and_, column, func, literal_column, or_, select, table, text, union
+from sqlalchemy.orm import joinedload
+
+from facets import facet_counts
+from hanzi import fold
+from models import db, Term
+from pagination import KeysetPagination
+from pinyin import pinyin_query
+from ranking import rank_expression
+from search_index import get_search_index, is_cjk, load_terms, IdPagination, RankedPagination
+from snapshot import get_snapshot
+
+SUGGEST_COLUMNS = (Term.chinese_folded, Term.pinyin, Term.english_term)
+
+
+def term_query():
+    """Base query for result lists; templates show each term's category"""
+    return Term.query.options(joinedload(Term.category))
+
+
+def _prefix(key, prefix):
+    # A range rather than LIKE 'p%' so any btree index on the key is used
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return and_(key >= prefix, key < upper)
+
+
+def key_filter(query):
+    """Indexed prefix match of ``query`` on the normalised lookup keys, or None.
+
+    Pinyin-looking queries are matched on the pinyin keys, queries containing
+    Chinese on the script-folded name (Traditional, Simplified or mixed).
+    """
+    clauses = [_prefix(getattr(Term, name), prefix) for name, prefix in pinyin_query(query)]
+    folded = fold(query.strip())
+    if folded and any(is_cjk(char) for char in folded):
+        clauses.append(_prefix(Term.chinese_folded, folded))
+    return or_(*clauses) if clauses else None
+
+
+def _key_clauses(query):
+    keys = key_filter(query)
+    return () if keys is None else (keys,)
+
+
+def ranking_enabled():
+    return current_app.config.get('SEARCH_RANKING', True)
+
+
+def _order(query, *columns):
+    """Keyset columns and cache-key tag: the relevance score first when ranking is on"""
+    if ranking_enabled():
+        return (rank_expression(query),) + columns + (Term.id,), 'ranked'
+    return columns + (Term.id,), 'unranked'
+
+
+class DatabaseBackend:
+    """Substring matching with ``ilike``; works everywhere, scans the table"""
+
+    name = 'database'
+
+    def setup(self):
+        pass
+
+    def match_filter(self, query):
+        """WHERE clause selecting the terms that match ``query``"""
+        search_term = f'%{query.lower()}%'
+        # search_text is script-folded, so it also covers both Chinese columns
+        return or_(
+            Term.search_text.ilike(fold(search_term)),
+            Term.pinyin.ilike(search_term),
+            Term.english_term.ilike(search_term),
+            Term.english_aliases.ilike(search_term),
+            *_key_clauses(query)
+        )
+
+    def facets(self, query):
+        """Facet counts of every term matching ``query``, from one grouped query"""
+        columns = (Term.category_id, Term.who_standard, Term.reliability_score, Term.subcategory)
+        rows = db.session.query(*columns, func.count()).filter(self.match_filter(query)).group_by(*columns)
+        return facet_counts(rows)
+
+    def search(self, query, category_id=None, page=1, per_page=20, after=None, before=None):
+        terms_query = term_query().filter(self.match_filter(query))
+
+        if category_id:
+            terms_query = terms_query.filter(Term.category_id == category_id)
+
+        order_by, ranking = _order(query)
+        return KeysetPagination(
+            terms_query, order_by, ('search', 'database', ranking, query.lower(), category_id),
+            page=page, per_page=per_page, after=after, before=before
+        )
+
+    @staticmethod
+    def _key_suggestions(query, limit):
+        # Headword prefixes are usually answered by the indexed keys alone
+        keys = key_filter(query)
+        if keys is None:
+            return []
+        return Term.query.filter(keys).order_by(Term.id).limit(limit).all()
+
+    def suggest(self, query, limit=10):
+        terms = self._key_suggestions(query, limit)
+        if len(terms) < limit:
+            search_term = f'%{fold(query.lower())}%'
+            terms += Term.query.filter(
+                or_(*(col.ilike(search_term) for col in SUGGEST_COLUMNS)),
+                Term.id.notin_([term.id for term in terms])
+            ).limit(limit - len(terms)).all()
+        return terms
+
+
+class NgramBackend:
+    """Answers queries from the process-wide in-memory n-gram index"""
+
+    name = 'ngram'
+
+    def setup(self):
+        pass
+
+    def facets(self, query):
+        return get_search_index().facets(query)
+
+    def search(self, query, category_id=None, page=1, per_page=20, after=None, before=None):
+        if ranking_enabled():
+            return RankedPagination(get_search_index().ranked(query, category_id=category_id),
+                                    page=page, per_page=per_page, after=after, before=before,
+                                    load=lambda term_ids: load_terms(term_ids, term_query()))
+        term_ids = get_search_index().search(query, category_id=category_id)
+        return IdPagination(term_ids, page=page, per_page=per_page, query=term_query(),
+                            after=after, before=before)
+
+    def suggest(self, query, limit=10):
+        return load_terms(get_search_index().search(query, headwords_only=True)[:limit])
+
+
+class SnapshotBackend(DatabaseBackend):
+    """Answers queries and renders results from the compiled snapshot file.
+
+    Falls back to the ``database`` backend while no snapshot has been built
+    with ``flask compile-snapshot``.
+    """
+
+    name = 'snapshot'
+
+    def search(self, query, category_id=None, page=1, per_page=20, after=None, before=None):
+        snapshot = get_snapshot()
+        if snapshot is None:
+            return super().search(query, category_id, page, per_page, after, before)
+        if ranking_enabled():
+            return RankedPagination(snapshot.ranked(query, category_id=category_id),
+                                    page=page, per_page=per_page, after=after, before=before,
+                                    load=snapshot.terms)
+        term_ids = snapshot.search(query, category_id=category_id)
+        return IdPagination(term_ids, page=page, per_page=per_page, after=after, before=before,
+                            load=snapshot.terms)
+
+    def facets(self, query):
+        snapshot = get_snapshot()
+        if snapshot is None:
+            return super().facets(query)
+        return snapshot.facets(query)
+
+    def suggest(self, query, limit=10):
+        snapshot = get_snapshot()
+        if snapshot is None:
+            return super().suggest(query, limit)
+        return snapshot.terms(snapshot.search(query, headwords_only=True)[:limit])
+
+
+class SqliteFtsBackend(DatabaseBackend):
+    """SQLite FTS5 external-content table using the trigram tokenizer.
+
+    The trigram tokenizer gives substring semantics for queries of three or
+    more characters and bm25 ranking.  Shorter queries (e.g. a one or two
+    character Chinese term) cannot be expressed as trigrams and fall back to
+    the ``ilike`` path.
+    """
+
+    name = 'fts'
+    fts_table = 'terms_fts'
+    fts_columns = ('chinese_simplified', 'chinese_traditional', 'pinyin', 'english_term', 'search_text')
+
+    def setup(self):
+        columns = ', '.join(self.fts_columns)
+        new_values = ', '.join(f'new.{name}' for name in self.fts_columns)
+        old_values = ', '.join(f'old.{name}' for name in self.fts_columns)
+        exists = db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {'name': self.fts_table}
+        ).first()
+        statements = [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.fts_table} USING fts5("
+            f"{columns}, content='terms', content_rowid='id', tokenize='trigram')",
+            # Keep the external-content table in sync with terms
+            f"CREATE TRIGGER IF NOT EXISTS {self.fts_table}_ai AFTER INSERT ON terms BEGIN "
+            f"INSERT INTO {self.fts_table}(rowid, {columns}) VALUES (new.id, {new_values}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {self.fts_table}_ad AFTER DELETE ON terms BEGIN "
+            f"INSERT INTO {self.fts_table}({self.fts_table}, rowid, {columns}) "
+            f"VALUES ('delete', old.id, {old_values}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {self.fts_table}_au AFTER UPDATE ON terms BEGIN "
+            f"INSERT INTO {self.fts_table}({self.fts_table}, rowid, {columns}) "
+            f"VALUES ('delete', old.id, {old_values}); "
+            f"INSERT INTO {self.fts_table}(rowid, {columns}) VALUES (new.id, {new_values}); END",
+        ]
+        for statement in statements:
+            db.session.execute(text(statement))
+        if not exists:
+            # Index any rows that were inserted before the table existed
+            db.session.execute(text(f"INSERT INTO {self.fts_table}({self.fts_table}) VALUES ('rebuild')"))
+        db.session.commit()
+
+    @staticmethod
+    def _phrase(query, columns=None):
+        # A quoted phrase is matched as a substring by the trigram tokenizer
+        phrase = '"' + query.replace('"', '""') + '"'
+        if columns:
+            return '{' + ' '.join(columns) + '} : ' + phrase
+        return phrase
+
+    def match_filter(self, query):
+        if len(query) < 3:
+            return super().match_filter(query)
+        fts = table(self.fts_table, column('rowid'))
+        matched = select(fts.c.rowid).where(literal_column(self.fts_table).op('MATCH')(self._phrase(fold(query))))
+        keys = key_filter(query)
+        if keys is not None:
+            matched = union(matched, select(Term.id).where(keys))
+        return Term.id.in_(matched)
+
+    def _match_query(self, match):
+        fts = table(self.fts_table, column('rowid'))
+        return (
+            term_query()
+            .join(fts, fts.c.rowid == Term.id)
+            .filter(literal_column(self.fts_table).op('MATCH')(match))
+        )
+
+    def search(self, query, category_id=None, page=1, per_page=20, after=None, before=None):
+        if len(query) < 3:
+            return super().search(query, category_id, page, per_page, after, before)
+        phrase = self._phrase(fold(query))
+        keys = key_filter(query)
+        if keys is None:
+            terms_query = self._match_query(phrase)
+            rank = func.bm25(literal_column(self.fts_table))
+        else:
+            # Union of the FTS matches and the indexed key matches; terms
+            # found only by their keys rank after the FTS hits
+            fts = table(self.fts_table, column('rowid'))
+            ranked = (
+                select(fts.c.rowid.label('id'), func.bm25(literal_column(self.fts_table)).label('rank'))
+                .where(literal_column(self.fts_table).op('MATCH')(phrase))
+                .subquery()
+            )
+            matched = union(select(ranked.c.id), select(Term.id).where(keys))
+            terms_query = (
+                term_query()
+                .outerjoin(ranked, ranked.c.id == Term.id)
+                .filter(Term.id.in_(matched))
+            )
+            rank = func.coalesce(ranked.c.rank, 0.0)
+        if category_id:
+            terms_query = terms_query.filter(Term.category_id == category_id)
+        # bm25 orders the terms within a relevance tier
+        order_by, ranking = _order(query, rank)
+        return KeysetPagination(
+            terms_query, order_by, ('search', 'fts', ranking, query.lower(), category_id),
+            page=page, per_page=per_page, after=after, before=before
+        )
+
+    def suggest(self, query, limit=10):
+        if len(query) < 3:
+            return super().suggest(query, limit)
+        terms = self._key_suggestions(query, limit)
+        if len(terms) < limit:
+            match = self._phrase(fold(query), self.fts_columns[:-1])
+            terms += (
+                self._match_query(match)
+                .filter(Term.id.notin_([term.id for term in terms]))
+                .order_by(func.bm25(literal_column(self.fts_table)), Term.id)
+                .limit(limit - len(terms))
+                .all()
+            )
+        return terms
+
+
+class PostgresFtsBackend(DatabaseBackend):
+    """PostgreSQL GIN indexes: pg_trgm for substring filters, tsvector for ranking"""
+
+    name = 'fts'
+    trigram_columns = ('search_text', 'chinese_simplified', 'chinese_traditional', 'pinyin', 'english_term')
+
+    def setup(self):
+        db.session.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        for name in self.trigram_columns:
+            db.session.execute(text(
+                f'CREATE INDEX IF NOT EXISTS ix_terms_{name}_trgm '
+                f'ON terms USING gin ({name} gin_trgm_ops)'
+            ))
+        db.session.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_terms_search_tsv '
+            "ON terms USING gin (to_tsvector('simple', coalesce(search_text, '')))"
+        ))
+        db.session.commit()
+
+    def match_filter(self, query):
+        # search_text holds every searchable field, so one trigram-indexed
+        # ilike is equivalent to the OR over individual columns
+        return or_(Term.search_text.ilike(fold(f'%{query.lower()}%')), *_key_clauses(query))
+
+    def search(self, query, category_id=None, page=1, per_page=20, after=None, before=None):
+        terms_query = term_query().filter(self.match_filter(query))
+        if category_id:
+            terms_query = terms_query.filter(Term.category_id == category_id)
+        rank = func.ts_rank(
+            func.to_tsvector('simple', func.coalesce(Term.search_text, '')),
+            func.plainto_tsquery('simple', query.lower())
+        )
+        # Negated so that the keyset runs ascending on (-rank, id); ts_rank
+        # orders the terms within a relevance tier
+        order_by, ranking = _order(query, -rank)
+        return KeysetPagination(
+            terms_query, order_by, ('search', 'fts', ranking, query.lower(), category_id),
+            page=page, per_page=per_page, after=after, before=before
+        )
+
+
+BACKENDS = {
+    'database': DatabaseBackend,
+    'ngram': NgramBackend,
+    'snapshot': SnapshotBackend,
+}
+
+FTS_BACKENDS = {
+    'sqlite': SqliteFtsBackend,
+    'postgresql': PostgresFtsBackend,
+}
+
+
+def get_search_backend(app=None):
+    """Return the backend configured by ``SEARCH_ENGINE`` for ``app``"""
+    app = app or current_app
+    backend = app.extensions.get('search_backend')
+    if backend is None:
+        name = app.config.get('SEARCH_ENGINE', 'database')
+        if name == 'fts':
+            dialect = db.engine.dialect.name
+            if dialect not in FTS_BACKENDS:
+                raise ValueError(f'No full-text search backend for {dialect!r}')
+            backend = FTS_BACKENDS[dialect]()
+        elif name in BACKENDS:
+            backend = BACKENDS[name]()
+        else:
+            raise ValueError(f'Unknown SEARCH_ENGINE {name!r}')
+        app.extensions['search_backend'] = backend
+    return backend
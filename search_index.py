@@ -0,0 +1,412 @@
+"""In-memory n-gram inverted index answering substring queries over terms.
+
+CJK text is indexed as character bigrams and everything else (English,
+pinyin) as character trigrams.  A query is answered by intersecting the
+posting lists of its own n-grams and then verifying the candidates against
+the stored field values, so the results match ``ilike '%query%'`` without
+scanning the ``terms`` table.  Pinyin queries are additionally prefix-matched
+against the normalised keys from ``pinyin.py`` ('zusanli', 'zu2 san1', 'zsl'),
+and Chinese is folded to Simplified (``hanzi.py``) on both sides.
+
+Edits do not rebuild the index: the ids of changed terms (committed here or
+seen in the change log, see change_log.py) are collected, and the next
+search swaps in a copy with only those terms reloaded.  The copy shares
+every posting list except those of the grams the changed terms contain.
+"""
+import bisect
+import heapq
+import threading
+from array import array
+from collections import Counter
+
+from flask_sqlalchemy.pagination import Pagination
+from sqlalchemy import select
+
+from change_events import on_terms_changed
+from facets import facet_counts
+from models import db, Term
+from pagination import decode_cursor, encode_cursor
+from hanzi import fold
+from pinyin import pinyin_keys, pinyin_query, PINYIN_KEY_FIELDS
+from ranking import TermRanker
+
+# Fields used by the autocomplete API
+HEADWORD_FIELDS = ('chinese_simplified', 'chinese_traditional', 'pinyin', 'english_term')
+
+# Additional fields covered by the full /search page
+BODY_FIELDS = ('english_aliases', 'definition_en', 'definition_zh', 'etymology', 'clinical_notes')
+
+ALL_FIELDS = HEADWORD_FIELDS + BODY_FIELDS
+
+# Columns counted by facets.py besides category_id
+FACET_FIELDS = ('who_standard', 'reliability_score', 'subcategory')
+
+# Cursor key types: (id,) for IdPagination, (score, id) for RankedPagination
+ID_KEY = ((int,),)
+SCORE_ID_KEY = ((int,), (int,))
+
+# More changed terms than this rebuild the index instead of patching it
+DELTA_LIMIT = 1000
+
+
+def is_cjk(char):
+    """Return True for CJK ideographs and CJK punctuation"""
+    code = ord(char)
+    return (0x3000 <= code <= 0x9fff or 0xf900 <= code <= 0xfaff
+            or 0x20000 <= code <= 0x2ffff)
+
+
+def gram_size(char):
+    """Bigrams for CJK characters, trigrams for everything else"""
+    return 2 if is_cjk(char) else 3
+
+
+def iter_grams(text, partial=True):
+    """Yield the n-gram starting at each position of ``text``.
+
+    With ``partial`` the truncated grams at the end of the string are
+    included too, so that queries shorter than a gram can be answered by a
+    prefix lookup over the vocabulary.
+    """
+    length = len(text)
+    for i, char in enumerate(text):
+        end = i + gram_size(char)
+        if end > length and not partial:
+            continue
+        yield text[i:end]
+
+
+class _FieldGroup:
+    """Posting lists for one group of fields"""
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.postings = {}
+        self.vocabulary = []
+        self.values = {}
+
+    def add(self, term_id, values):
+        self.values[term_id] = values
+        for value in values:
+            for gram in iter_grams(value):
+                postings = self.postings.get(gram)
+                if postings is None:
+                    self.postings[gram] = postings = set()
+                postings.add(term_id)
+
+    def freeze(self):
+        """Convert posting sets into compact sorted arrays"""
+        self.postings = {gram: array('l', sorted(ids)) for gram, ids in self.postings.items()}
+        self.vocabulary = sorted(self.postings)
+
+    def candidates(self, query):
+        """Return a superset of the ids whose fields contain ``query``"""
+        grams = set(iter_grams(query, partial=False))
+        if not grams:
+            # Query is shorter than one gram: union every gram it prefixes
+            result = set()
+            start = bisect.bisect_left(self.vocabulary, query)
+            for gram in self.vocabulary[start:]:
+                if not gram.startswith(query):
+                    break
+                result.update(self.postings[gram])
+            return result
+
+        lists = sorted((self.postings.get(gram, ()) for gram in grams), key=len)
+        result = set(lists[0])
+        for postings in lists[1:]:
+            if not result:
+                break
+            result.intersection_update(postings)
+        return result
+
+    def search(self, query):
+        return {
+            term_id for term_id in self.candidates(query)
+            if any(query in value for value in self.values[term_id])
+        }
+
+    def replaced(self, term_ids, values):
+        """Frozen copy without ``term_ids``, then with ``values`` ({term id: values}) added"""
+        group = _FieldGroup(self.fields)
+        group.values = {term_id: v for term_id, v in self.values.items() if term_id not in term_ids}
+        group.values.update(values)
+        old = {term_id: {gram for value in self.values.get(term_id, ()) for gram in iter_grams(value)}
+               for term_id in term_ids}
+        new = {term_id: {gram for value in v for gram in iter_grams(value)} for term_id, v in values.items()}
+        # Only the posting lists of grams a term gained or lost change
+        grams = set()
+        for term_id in term_ids:
+            grams.update(old[term_id].symmetric_difference(new.get(term_id, ())))
+        group.postings = dict(self.postings)
+        for gram in grams:
+            postings = array('l', self.postings.get(gram, ()))
+            for term_id in term_ids:
+                was, now = gram in old[term_id], gram in new.get(term_id, ())
+                if was and not now:
+                    del postings[bisect.bisect_left(postings, term_id)]
+                elif now and not was:
+                    bisect.insort(postings, term_id)
+            if postings:
+                group.postings[gram] = postings
+            else:
+                del group.postings[gram]
+        new_vocabulary = any((gram in self.postings) != (gram in group.postings) for gram in grams)
+        group.vocabulary = sorted(group.postings) if new_vocabulary else self.vocabulary
+        return group
+
+
+class SearchIndex:
+    """Substring index over the headword and body fields of every term"""
+
+    def __init__(self):
+        self.headwords = _FieldGroup(HEADWORD_FIELDS)
+        self.body = _FieldGroup(BODY_FIELDS)
+        self.categories = {}
+        # (category_id, who_standard, reliability_score, subcategory) per term, for facets
+        self.facet_values = {}
+        # Sorted (key, term id) pairs per normalised pinyin key, for prefix lookups
+        self.pinyin = {name: [] for name in PINYIN_KEY_FIELDS}
+
+    @classmethod
+    def build(cls, rows):
+        """Build an index from an iterable of ``Term`` objects or row mappings"""
+        index = cls()
+        for row in rows:
+            index.add(row)
+        index.headwords.freeze()
+        index.body.freeze()
+        for keys in index.pinyin.values():
+            keys.sort()
+        return index
+
+    @staticmethod
+    def _rows(term_ids=None):
+        columns = [getattr(Term, name) for name in ('id', 'category_id') + FACET_FIELDS + ALL_FIELDS]
+        if term_ids is None:
+            return (row._asdict() for row in Term.query.with_entities(*columns).yield_per(1000))
+        # Changed terms are read from the primary: a lagging replica (see
+        # db_routing.py) would return the old row and the change would count as applied
+        with db.engine.connect() as connection:
+            statement = select(*columns).where(Term.id.in_(sorted(term_ids)))
+            return [row._asdict() for row in connection.execute(statement)]
+
+    @classmethod
+    def from_database(cls):
+        return cls.build(cls._rows())
+
+    def add(self, row):
+        term_id, headwords, body = self._add_row(row)
+        self.headwords.add(term_id, headwords)
+        self.body.add(term_id, body)
+
+    def _add_row(self, row):
+        # Everything but the posting lists; returns the values to index
+        get = row.get if isinstance(row, dict) else lambda name: getattr(row, name)
+        term_id = get('id')
+        self.categories[term_id] = get('category_id')
+        self.facet_values[term_id] = (get('category_id'),) + tuple(get(name) for name in FACET_FIELDS)
+        for name, key in pinyin_keys(get('pinyin')).items():
+            if key:
+                self.pinyin[name].append((key, term_id))
+        return (term_id, tuple(fold((get(name) or '').lower()) for name in HEADWORD_FIELDS),
+                tuple(fold((get(name) or '').lower()) for name in BODY_FIELDS))
+
+    def updated(self, term_ids, rows):
+        """Copy of this frozen index with the terms of ``term_ids`` replaced by ``rows``.
+
+        Ids without a row are dropped (deleted terms).  The copy shares the
+        unchanged posting lists with this index, which is left as it was
+        for the searches still using it.
+        """
+        index = SearchIndex()
+        index.categories = {k: v for k, v in self.categories.items() if k not in term_ids}
+        index.facet_values = {k: v for k, v in self.facet_values.items() if k not in term_ids}
+        index.pinyin = {name: [entry for entry in keys if entry[1] not in term_ids]
+                        for name, keys in self.pinyin.items()}
+        headwords, body = {}, {}
+        for row in rows:
+            term_id, headwords[term_id], body[term_id] = index._add_row(row)
+        index.headwords = self.headwords.replaced(term_ids, headwords)
+        index.body = self.body.replaced(term_ids, body)
+        for keys in index.pinyin.values():
+            keys.sort()
+        return index
+
+    def __len__(self):
+        return len(self.categories)
+
+    def search(self, query, category_id=None, headwords_only=False):
+        """Return the sorted ids of terms containing ``query``"""
+        folded = fold(query.lower())
+        if not folded:
+            return []
+        matches = self.headwords.search(folded)
+        for name, prefix in pinyin_query(query):
+            keys = self.pinyin[name]
+            start = bisect.bisect_left(keys, (prefix,))
+            end = bisect.bisect_left(keys, (prefix + '\uffff',), start)
+            matches.update(term_id for _, term_id in keys[start:end])
+        if not headwords_only:
+            matches |= self.body.search(folded)
+        if category_id:
+            matches = {term_id for term_id in matches if self.categories[term_id] == category_id}
+        return sorted(matches)
+
+    def ranked(self, query, category_id=None):
+        """``(score, term id)`` of every term containing ``query``, unordered (see ranking.py)"""
+        ranker = TermRanker(query)
+        scored = []
+        for term_id in self.search(query, category_id=category_id):
+            _, who_standard, reliability_score, _ = self.facet_values[term_id]
+            aliases = self.body.values[term_id][0]
+            score = ranker.score(self.headwords.values[term_id], aliases, who_standard, reliability_score)
+            scored.append((score, term_id))
+        return scored
+
+    def facets(self, query):
+        """Facet counts of the terms containing ``query``"""
+        combinations = Counter(self.facet_values[term_id] for term_id in self.search(query))
+        return facet_counts((*values, count) for values, count in combinations.items())
+
+
+def load_terms(term_ids, query=None):
+    """Load ``Term`` objects for ``term_ids`` in one query, keeping their order"""
+    if not term_ids:
+        return []
+    query = query if query is not None else Term.query
+    terms = {t.id: t for t in query.filter(Term.id.in_(term_ids))}
+    return [terms[term_id] for term_id in term_ids if term_id in terms]
+
+
+class IdPagination(Pagination):
+    """Paginate a precomputed list of term ids in ascending id order.
+
+    ``after``/``before`` cursors (see pagination.py) are resolved by binary
+    search, so they stay valid when the list changes between requests.
+    ``load`` turns a page of ids into items, by default with ``load_terms``.
+    """
+
+    def __init__(self, term_ids, page, per_page, query=None, after=None, before=None, load=None):
+        self._term_ids = term_ids
+        self._base_query = query
+        self._load = load or (lambda term_ids: load_terms(term_ids, self._base_query))
+        self._after = decode_cursor(after, ID_KEY)
+        self._before = decode_cursor(before, ID_KEY)
+        self.next_cursor = None
+        self.prev_cursor = None
+        if self._after:
+            page = self._after[1]
+        elif self._before:
+            page = self._before[1]
+        super().__init__(page=page, per_page=per_page, error_out=False)
+
+    def _query_items(self):
+        term_ids = self._term_ids
+        if self._after:
+            start = bisect.bisect_right(term_ids, self._after[0][0])
+        elif self._before:
+            start = max(0, bisect.bisect_left(term_ids, self._before[0][0]) - self.per_page)
+        else:
+            start = self._query_offset
+        page_ids = term_ids[start:start + self.per_page]
+        if page_ids:
+            if start + self.per_page < len(term_ids):
+                self.next_cursor = encode_cursor((page_ids[-1],), self.page + 1)
+            if start > 0:
+                self.prev_cursor = encode_cursor((page_ids[0],), self.page - 1)
+        return self._load(page_ids)
+
+    def _query_count(self):
+        return len(self._term_ids)
+
+
+class RankedPagination(Pagination):
+    """Paginate unordered ``(score, term id)`` pairs by ascending (score, id).
+
+    Only the requested page is selected, with a bounded heap
+    (``heapq.nsmallest``) instead of sorting every match, and only its ids
+    are handed to ``load``.  ``after``/``before`` cursors hold the
+    (score, id) of the boundary row, like the SQL backends' keyset cursors.
+    """
+
+    def __init__(self, scored, page, per_page, after=None, before=None, load=None):
+        self._scored = scored
+        self._load = load or load_terms
+        self._after = decode_cursor(after, SCORE_ID_KEY)
+        self._before = decode_cursor(before, SCORE_ID_KEY)
+        self.next_cursor = None
+        self.prev_cursor = None
+        if self._after:
+            page = self._after[1]
+        elif self._before:
+            page = self._before[1]
+        super().__init__(page=page, per_page=per_page, error_out=False)
+
+    def _query_items(self):
+        # One extra row tells whether there is a next (or previous) page
+        if self._after:
+            boundary = tuple(self._after[0])
+            rows = heapq.nsmallest(self.per_page + 1, (row for row in self._scored if row > boundary))
+            has_next, has_prev = len(rows) > self.per_page, True
+            rows = rows[:self.per_page]
+        elif self._before:
+            boundary = tuple(self._before[0])
+            rows = heapq.nlargest(self.per_page + 1, (row for row in self._scored if row < boundary))
+            has_next, has_prev = True, len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+        else:
+            offset = self._query_offset
+            rows = heapq.nsmallest(offset + self.per_page + 1, self._scored)
+            has_next, has_prev = len(rows) > offset + self.per_page, offset > 0
+            rows = rows[offset:offset + self.per_page]
+        if rows:
+            if has_next:
+                self.next_cursor = encode_cursor(rows[-1], self.page + 1)
+            if has_prev:
+                self.prev_cursor = encode_cursor(rows[0], self.page - 1)
+        return self._load([term_id for _, term_id in rows])
+
+    def _query_count(self):
+        return len(self._scored)
+
+
+_index = None
+_index_lock = threading.Lock()
+# Ids of terms changed since _index was built, applied by the next search
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def get_search_index():
+    """Return the process-wide index, building it on first use and patching in changed terms"""
+    global _index, _pending
+    index = _index
+    if index is None or _pending:
+        with _index_lock:
+            if _index is not None and _pending:
+                with _pending_lock:
+                    term_ids, _pending = _pending, set()
+                index = _index.updated(term_ids, SearchIndex._rows(term_ids))
+                with _pending_lock:
+                    # Unless everything was reset meanwhile
+                    if _index is not None:
+                        _index = index
+            if _index is None:
+                with _pending_lock:
+                    _pending = set()
+                _index = SearchIndex.from_database()
+            index = _index
+    return index
+
+
+@on_terms_changed
+def reset_search_index(term_ids=None):
+    """Queue ``term_ids`` for the next search, or drop the index when there are too many"""
+    global _index, _pending
+    with _pending_lock:
+        if term_ids is None or len(_pending) + len(term_ids) > DELTA_LIMIT:
+            _index = None
+            _pending = set()
+        else:
+            _pending.update(term_ids)
@@ -0,0 +1,51 @@
+"""JSON representations of termbase rows shared by the API endpoints"""
+from sqlalchemy.orm import joinedload, load_only
+
+from models import Term
+
+# Fields of the public term representation, in output order
+TERM_FIELDS = (
+    'id', 'chinese_simplified', 'chinese_traditional', 'pinyin', 'english_term',
+    'english_aliases', 'definition_en', 'definition_zh', 'etymology', 'clinical_notes',
+    'category', 'source', 'who_standard'
+)
+
+
+def parse_fields(value):
+    """Parse a ``fields=`` projection; returns None for "all fields".
+
+    Raises ``ValueError`` naming any unknown field.
+    """
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list) or not all(isinstance(name, str) for name in value):
+        raise ValueError('fields must be a comma-separated string or a list of names')
+    fields = [name.strip() for name in value if name.strip()]
+    unknown = [name for name in fields if name not in TERM_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    # 'id' is always included so results can be matched to requests
+    return tuple(name for name in TERM_FIELDS if name in fields or name == 'id')
+
+
+def term_query_options(fields=None):
+    """Loader options that fetch only the columns needed for ``fields``"""
+    fields = fields or TERM_FIELDS
+    columns = [getattr(Term, name) for name in fields if name != 'category']
+    options = [load_only(*columns)]
+    if 'category' in fields:
+        options.append(joinedload(Term.category))
+    return options
+
+
+def term_to_dict(term, fields=None):
+    """Serialise ``term``, optionally restricted to ``fields``"""
+    result = {}
+    for name in fields or TERM_FIELDS:
+        if name == 'category':
+            result[name] = term.category.name_en if term.category else None
+        else:
+            result[name] = getattr(term, name)
+    return result
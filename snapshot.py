@@ -0,0 +1,388 @@
+"""Compiled, memory-mapped termbase snapshot shared by all workers.
+
+``flask compile-snapshot`` writes every term, its category and the search
+structures of ``search_index.py`` into one binary file.  Workers ``mmap`` it
+read-only, so the pages live once in the OS page cache however many workers
+there are, and ``SEARCH_ENGINE=snapshot`` answers /search and /api/search
+without touching the database or materialising ORM objects.
+
+Layout (little-endian, every section 8-byte aligned)::
+
+    header   magic 'TCMSNAP\\0', format u32, section count u32,
+             version u64 (build time in ms), term count u64
+    table    per section: name (32 bytes), dtype (4 bytes), pad u32,
+             offset u64, item count u64
+    sections
+
+``pool`` holds every string as UTF-8; strings elsewhere are (offset, length)
+u32 pairs into it, a length of 0xffffffff meaning NULL.  Terms are stored in
+id order and referred to by row number: ``fields`` has one pair per
+``TEXT_FIELDS`` entry and row, ``<group>_text`` the lowercased, script-folded
+field values joined with NUL that candidates are verified against, and each
+n-gram group has a sorted vocabulary (``<group>_grams``), CSR offsets
+(``<group>_offsets``) and row postings (``<group>_postings``).  The pinyin
+keys are sorted (``pinyin_plain``, ``pinyin_plain_rows`` ...) for prefix
+ranges.
+
+A new snapshot is written to a temporary file and renamed over the old one.
+Readers notice the new inode within ``SNAPSHOT_CHECK_INTERVAL`` seconds and
+map it; requests still using the old mapping keep it until they finish.
+"""
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+from flask import current_app
+
+from facets import FACETS
+from hanzi import fold
+from models import Category, Term
+from pinyin import pinyin_keys, pinyin_query, PINYIN_KEY_FIELDS
+from ranking import TermRanker
+from search_index import iter_grams, BODY_FIELDS, HEADWORD_FIELDS
+
+MAGIC = b'TCMSNAP\0'
+FORMAT = 1
+NULL = 0xffffffff
+
+TEXT_FIELDS = (
+    'chinese_simplified', 'chinese_traditional', 'pinyin', 'english_term', 'english_aliases',
+    'definition_en', 'definition_zh', 'etymology', 'clinical_notes', 'subcategory', 'source'
+)
+GROUPS = {'head': HEADWORD_FIELDS, 'body': BODY_FIELDS}
+
+_HEADER = struct.Struct('<8sIIQQ')
+_SECTION = struct.Struct('<32s4s4xQQ')
+
+
+class SnapshotError(ValueError):
+    """The file is not a snapshot this code can read"""
+
+
+class _Pool:
+    """Deduplicating string pool being written"""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.refs = {}
+
+    def add(self, value):
+        if value is None:
+            return (0, NULL)
+        ref = self.refs.get(value)
+        if ref is None:
+            encoded = value.encode('utf-8')
+            self.refs[value] = ref = (len(self.data), len(encoded))
+            self.data += encoded
+        return ref
+
+
+def compile_snapshot(path, batch_size=1000):
+    """Write a snapshot of the current termbase to ``path``; returns the term count"""
+    pool = _Pool()
+    ids, category_ids, who_standard, reliability, fields = [], [], [], [], []
+    texts = {group: [] for group in GROUPS}
+    postings = {group: {} for group in GROUPS}
+    keys = {name: [] for name in PINYIN_KEY_FIELDS}
+
+    columns = [getattr(Term, name) for name in ('id', 'category_id', 'who_standard', 'reliability_score')
+               + tuple(dict.fromkeys(TEXT_FIELDS + HEADWORD_FIELDS + BODY_FIELDS))]
+    rows = Term.query.with_entities(*columns).order_by(Term.id).yield_per(batch_size)
+    for number, row in enumerate(rows):
+        ids.append(row.id)
+        category_ids.append(row.category_id if row.category_id is not None else -1)
+        who_standard.append(1 if row.who_standard else 0)
+        reliability.append(row.reliability_score if row.reliability_score is not None else -1)
+        fields.extend(pool.add(getattr(row, name)) for name in TEXT_FIELDS)
+        for group, group_fields in GROUPS.items():
+            values = [fold((getattr(row, name) or '').lower()) for name in group_fields]
+            texts[group].append(pool.add('\0'.join(values)))
+            group_postings = postings[group]
+            for gram in {gram for value in values for gram in iter_grams(value)}:
+                group_postings.setdefault(gram, []).append(number)
+        for name, key in pinyin_keys(row.pinyin).items():
+            if key:
+                keys[name].append((key, number))
+
+    categories = Category.query.order_by(Category.id).all()
+    sections = {
+        'term_ids': np.array(ids, dtype='<i4'),
+        'category_ids': np.array(category_ids, dtype='<i4'),
+        'who_standard': np.array(who_standard, dtype='<i4'),
+        'reliability': np.array(reliability, dtype='<i4'),
+        'fields': np.array(fields, dtype='<u4').reshape(-1),
+        'categories': np.array([category.id for category in categories], dtype='<i4'),
+        'category_names': np.array([pool.add(value) for category in categories
+                                    for value in (category.name_en, category.name_zh)], dtype='<u4').reshape(-1),
+    }
+    for group in GROUPS:
+        vocabulary = sorted(postings[group])
+        offsets = np.zeros(len(vocabulary) + 1, dtype='<u4')
+        offsets[1:] = np.cumsum([len(postings[group][gram]) for gram in vocabulary])
+        flat = [number for gram in vocabulary for number in postings[group][gram]]
+        sections[f'{group}_text'] = np.array(texts[group], dtype='<u4').reshape(-1)
+        sections[f'{group}_grams'] = np.array([pool.add(gram) for gram in vocabulary], dtype='<u4').reshape(-1)
+        sections[f'{group}_offsets'] = offsets
+        sections[f'{group}_postings'] = np.array(flat, dtype='<i4')
+    for name, pairs in keys.items():
+        pairs.sort()
+        sections[name] = np.array([pool.add(key) for key, _ in pairs], dtype='<u4').reshape(-1)
+        sections[f'{name}_rows'] = np.array([number for _, number in pairs], dtype='<i4')
+    sections['pool'] = np.frombuffer(bytes(pool.data), dtype='u1')
+
+    _write(path, sections, len(ids))
+    return len(ids)
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _write(path, sections, term_count):
+    """Write ``sections`` to a temporary file and atomically rename it to ``path``"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    offset = _align(_HEADER.size + _SECTION.size * len(sections))
+    table = []
+    for name, values in sections.items():
+        table.append(_SECTION.pack(name.encode('ascii'), values.dtype.str.encode('ascii'), offset, values.size))
+        offset = _align(offset + values.nbytes)
+
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT, len(sections), int(time.time() * 1000), term_count))
+        f.write(b''.join(table))
+        for values in sections.values():
+            f.write(b'\0' * (_align(f.tell()) - f.tell()))
+            f.write(values.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+class _Strings:
+    """Read-only sequence of the pool strings referenced by a (offset, length) array"""
+
+    def __init__(self, snapshot, refs):
+        self.snapshot = snapshot
+        self.refs = refs
+
+    def __len__(self):
+        return len(self.refs) // 2
+
+    def __getitem__(self, index):
+        return self.snapshot.string(self.refs[2 * index], self.refs[2 * index + 1])
+
+
+class SnapshotCategory:
+    __slots__ = ('id', 'name_en', 'name_zh')
+
+    def __init__(self, id, name_en, name_zh):
+        self.id = id
+        self.name_en = name_en
+        self.name_zh = name_zh
+
+
+class SnapshotTerm:
+    """Read-only stand-in for ``Term`` with the attributes templates and serializers use"""
+
+    __slots__ = ('id', 'category_id', 'category', 'who_standard', 'reliability_score') + TEXT_FIELDS
+
+    def __repr__(self):
+        return f'<SnapshotTerm {self.id}>'
+
+
+class Snapshot:
+    """A memory-mapped snapshot file"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.stat = os.fstat(f.fileno())
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, self.version, self.term_count = _HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != FORMAT:
+            raise SnapshotError(f'{path} is not a format {FORMAT} termbase snapshot')
+        self.path = path
+        self.sections = {}
+        self.offsets = {}
+        for number in range(count):
+            name, dtype, offset, size = _SECTION.unpack_from(self.map, _HEADER.size + number * _SECTION.size)
+            name = name.rstrip(b'\0').decode('ascii')
+            self.offsets[name] = offset
+            self.sections[name] = np.frombuffer(self.map, dtype=dtype.rstrip(b'\0').decode('ascii'), count=size, offset=offset)
+        self.pool_offset = self.offsets['pool']
+        self.term_ids = self.sections['term_ids']
+        self.category_ids = self.sections['category_ids']
+        self.fields = self.sections['fields']
+        self.grams = {group: _Strings(self, self.sections[f'{group}_grams']) for group in GROUPS}
+        self.pinyin = {name: _Strings(self, self.sections[name]) for name in PINYIN_KEY_FIELDS}
+        names = self.sections['category_names']
+        self.categories = {
+            int(category_id): SnapshotCategory(int(category_id), self.string(names[4 * i], names[4 * i + 1]),
+                                               self.string(names[4 * i + 2], names[4 * i + 3]))
+            for i, category_id in enumerate(self.sections['categories'])
+        }
+
+    def __len__(self):
+        return self.term_count
+
+    def string(self, offset, length):
+        if length == NULL:
+            return None
+        start = self.pool_offset + int(offset)
+        return self.map[start:start + int(length)].decode('utf-8')
+
+    def _contains(self, group, row, needle):
+        refs = self.sections[f'{group}_text']
+        start = self.pool_offset + int(refs[2 * row])
+        return self.map.find(needle, start, start + int(refs[2 * row + 1])) != -1
+
+    def _postings(self, group, gram):
+        grams = self.grams[group]
+        index = bisect.bisect_left(grams, gram)
+        if index == len(grams) or grams[index] != gram:
+            return None
+        offsets = self.sections[f'{group}_offsets']
+        return self.sections[f'{group}_postings'][offsets[index]:offsets[index + 1]]
+
+    def _candidates(self, group, query):
+        grams = set(iter_grams(query, partial=False))
+        if not grams:
+            # Shorter than one gram: union the postings of every gram it prefixes
+            vocabulary = self.grams[group]
+            start = bisect.bisect_left(vocabulary, query)
+            end = bisect.bisect_left(vocabulary, query + '\uffff', start)
+            offsets = self.sections[f'{group}_offsets']
+            return np.unique(self.sections[f'{group}_postings'][offsets[start]:offsets[end]])
+        lists = []
+        for gram in grams:
+            postings = self._postings(group, gram)
+            if postings is None:
+                return np.empty(0, dtype='<i4')
+            lists.append(postings)
+        lists.sort(key=len)
+        result = lists[0]
+        for postings in lists[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, postings, assume_unique=True)
+        return result
+
+    def _search_group(self, group, query):
+        needle = query.encode('utf-8')
+        return {int(row) for row in self._candidates(group, query) if self._contains(group, int(row), needle)}
+
+    def _match_rows(self, query, headwords_only=False):
+        folded = fold(query.lower())
+        if not folded:
+            return set()
+        rows = self._search_group('head', folded)
+        for name, prefix in pinyin_query(query):
+            keys = self.pinyin[name]
+            start = bisect.bisect_left(keys, prefix)
+            end = bisect.bisect_left(keys, prefix + '\uffff', start)
+            rows.update(int(row) for row in self.sections[f'{name}_rows'][start:end])
+        if not headwords_only:
+            rows |= self._search_group('body', folded)
+        return rows
+
+    def search(self, query, category_id=None, headwords_only=False):
+        """Return the sorted ids of terms containing ``query``, like ``SearchIndex.search``"""
+        rows = self._match_rows(query, headwords_only)
+        if category_id:
+            rows = {row for row in rows if self.category_ids[row] == category_id}
+        return [int(self.term_ids[row]) for row in sorted(rows)]
+
+    def _text(self, group, row):
+        refs = self.sections[f'{group}_text']
+        return self.string(refs[2 * row], refs[2 * row + 1]).split('\0')
+
+    def ranked(self, query, category_id=None):
+        """``(score, term id)`` of every term containing ``query``, like ``SearchIndex.ranked``"""
+        ranker = TermRanker(query)
+        who_standard, reliability = self.sections['who_standard'], self.sections['reliability']
+        scored = []
+        for row in self._match_rows(query):
+            if category_id and self.category_ids[row] != category_id:
+                continue
+            score = ranker.score(self._text('head', row), self._text('body', row)[0],
+                                 who_standard[row], max(int(reliability[row]), 0))
+            scored.append((int(score), int(self.term_ids[row])))
+        return scored
+
+    def facets(self, query):
+        """Facet counts of the terms containing ``query``, counted over the arrays"""
+        rows = np.fromiter(self._match_rows(query), dtype=np.int64)
+        counts = {name: {} for name in FACETS}
+        category_ids, who_standard, reliability = (
+            self.category_ids[rows], self.sections['who_standard'][rows], self.sections['reliability'][rows])
+        for value, count in zip(*np.unique(category_ids, return_counts=True)):
+            counts['category'][int(value) if value >= 0 else None] = int(count)
+        for value, count in zip(*np.unique(who_standard, return_counts=True)):
+            counts['who_standard'][bool(value)] = int(count)
+        for value, count in zip(*np.unique(reliability, return_counts=True)):
+            counts['reliability_score'][int(value) if value >= 0 else None] = int(count)
+        # Equal strings share one pool offset, so counting offsets counts values
+        refs = self.fields.reshape(-1, len(TEXT_FIELDS), 2)[rows, TEXT_FIELDS.index('subcategory')]
+        subcategories = np.unique(refs, axis=0, return_counts=True) if len(rows) else ((), ())
+        for (offset, length), count in zip(*subcategories):
+            value = self.string(offset, length) or None
+            counts['subcategory'][value] = counts['subcategory'].get(value, 0) + int(count)
+        return counts
+
+    def term(self, term_id):
+        """Return a ``SnapshotTerm`` for ``term_id`` or None"""
+        row = int(np.searchsorted(self.term_ids, term_id))
+        if row == len(self.term_ids) or self.term_ids[row] != term_id:
+            return None
+        term = SnapshotTerm()
+        term.id = int(term_id)
+        term.category_id = int(self.category_ids[row]) if self.category_ids[row] >= 0 else None
+        term.category = self.categories.get(term.category_id)
+        term.who_standard = bool(self.sections['who_standard'][row])
+        score = int(self.sections['reliability'][row])
+        term.reliability_score = score if score >= 0 else None
+        base = row * len(TEXT_FIELDS) * 2
+        for number, name in enumerate(TEXT_FIELDS):
+            setattr(term, name, self.string(self.fields[base + 2 * number], self.fields[base + 2 * number + 1]))
+        return term
+
+    def terms(self, term_ids):
+        """``SnapshotTerm`` objects for ``term_ids`` in order, skipping unknown ids"""
+        return [term for term in map(self.term, term_ids) if term is not None]
+
+
+_snapshot = None
+_checked = 0.0
+_snapshot_lock = threading.Lock()
+_checked_missing = threading.Event()
+
+
+def get_snapshot(app=None):
+    """Return the mapped snapshot, remapping it if the file was replaced; None if missing"""
+    global _snapshot, _checked
+    app = app or current_app
+    now = time.monotonic()
+    snapshot = _snapshot
+    if snapshot is not None and now - _checked < app.config['SNAPSHOT_CHECK_INTERVAL']:
+        return snapshot
+    with _snapshot_lock:
+        _checked = now
+        path = app.config['SNAPSHOT_PATH']
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            if _snapshot is not None or not _checked_missing.is_set():
+                app.logger.warning('No termbase snapshot at %s; run flask compile-snapshot', path)
+                _checked_missing.set()
+            _snapshot = None
+            return None
+        if _snapshot is None or (stat.st_ino, stat.st_mtime_ns) != (_snapshot.stat.st_ino, _snapshot.stat.st_mtime_ns):
+            _snapshot = Snapshot(path)
+            app.logger.info('Mapped termbase snapshot %s (%d terms, version %d)',
+                            path, len(_snapshot), _snapshot.version)
+        return _snapshot
@@ -0,0 +1,155 @@
+"""Typo-tolerant "did you mean" lookups over English terms and aliases.
+
+A SymSpell delete dictionary: every word of every ``english_term`` and
+``english_aliases`` entry is stored under all strings obtained by deleting
+up to ``MAX_DISTANCE`` characters from its first ``PREFIX_LENGTH``
+characters.  A misspelt query word generates its own deletes the same way,
+and every word sharing one of them is a candidate; candidates are verified
+with the optimal string alignment distance.  The number of keys looked up
+per word is bounded by the prefix length, not the vocabulary size, so a
+lookup never scans the termbase.
+
+``correct()`` replaces each unknown query word with its closest known word
+(fewest edits, then most frequent) and returns the corrected query with the
+terms containing all of its words.
+"""
+import re
+from collections import namedtuple
+
+from caching import StaleWhileRebuild
+from change_events import on_terms_changed
+from models import Term
+
+MAX_DISTANCE = 2
+PREFIX_LENGTH = 7
+# Words shorter than this are only corrected by a single edit
+SHORT_WORD = 5
+# Words shorter than this are never corrected
+MIN_WORD = 3
+
+_WORD = re.compile(r'[a-z]+')
+
+Correction = namedtuple('Correction', 'query distance term_ids')
+
+
+def words(text):
+    return _WORD.findall((text or '').lower())
+
+
+def _deletes(word, max_distance):
+    """Every string obtained by deleting up to ``max_distance`` characters"""
+    keys = {word}
+    edge = {word}
+    for _ in range(max_distance):
+        edge = {key[:i] + key[i + 1:] for key in edge for i in range(len(key))}
+        keys |= edge
+    return keys
+
+
+def edit_distance(a, b, max_distance):
+    """Optimal string alignment distance, or ``max_distance + 1`` if larger"""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (previous2 is not None and i > 1 and j > 1
+                    and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return min(previous[-1], max_distance + 1)
+
+
+class SpellingIndex:
+    """Delete dictionary over the words of English terms and aliases"""
+
+    def __init__(self):
+        self.term_ids = {}  # word -> set of term ids
+        self.deletes = {}   # delete key -> list of words
+
+    @classmethod
+    def build(cls, rows):
+        """Build from ``Term`` objects or mappings with id/english_term/english_aliases"""
+        index = cls()
+        for row in rows:
+            get = row.get if isinstance(row, dict) else lambda name: getattr(row, name)
+            for word in words(get('english_term')) + words(get('english_aliases')):
+                index.add(word, get('id'))
+        return index
+
+    @classmethod
+    def from_database(cls):
+        rows = Term.query.with_entities(Term.id, Term.english_term, Term.english_aliases).yield_per(1000)
+        return cls.build(row._asdict() for row in rows)
+
+    def add(self, word, term_id):
+        term_ids = self.term_ids.get(word)
+        if term_ids is None:
+            self.term_ids[word] = term_ids = set()
+            for key in _deletes(word[:PREFIX_LENGTH], MAX_DISTANCE):
+                self.deletes.setdefault(key, []).append(word)
+        term_ids.add(term_id)
+
+    def __len__(self):
+        return len(self.term_ids)
+
+    def lookup(self, word, max_distance=MAX_DISTANCE):
+        """Return ``[(word, distance)]`` within ``max_distance``, best first"""
+        if word in self.term_ids:
+            return [(word, 0)]
+        candidates = set()
+        for key in _deletes(word[:PREFIX_LENGTH], max_distance):
+            candidates.update(self.deletes.get(key, ()))
+        matches = []
+        for candidate in candidates:
+            distance = edit_distance(word, candidate, max_distance)
+            if distance <= max_distance:
+                matches.append((distance, -len(self.term_ids[candidate]), candidate))
+        matches.sort()
+        return [(candidate, distance) for distance, _, candidate in matches]
+
+    def correct(self, query):
+        """Return a ``Correction`` for ``query`` or None if nothing better is known"""
+        query_words = words(query)
+        if not query_words:
+            return None
+        corrected = []
+        total = 0
+        for word in query_words:
+            if word in self.term_ids or len(word) < MIN_WORD:
+                corrected.append(word)
+                continue
+            max_distance = 1 if len(word) < SHORT_WORD else MAX_DISTANCE
+            matches = self.lookup(word, max_distance)
+            if not matches:
+                return None
+            best, distance = matches[0]
+            corrected.append(best)
+            total += distance
+        if total == 0:
+            return None
+        known = [self.term_ids[word] for word in corrected if word in self.term_ids]
+        term_ids = set.intersection(*known) if known else set()
+        if not term_ids:
+            return None
+        return Correction(' '.join(corrected), total, sorted(term_ids))
+
+
+_index = StaleWhileRebuild('spelling index')
+
+
+def get_spelling_index():
+    """Return the process-wide spelling index, building it on first use"""
+    return _index.get(SpellingIndex.from_database)
+
+
+@on_terms_changed
+def reset_spelling_index(term_ids=None):
+    """Rebuild the index in the background; lookups use the old one meanwhile"""
+    _index.invalidate()
@@ -0,0 +1,336 @@
+"""Write-behind queue and rate limiting for /contribute suggestions.
+
+With ``SUGGESTION_QUEUE=1`` a posted suggestion is appended to this worker's
+spool file (``suggestions-<pid>.jsonl`` in ``SUGGESTION_SPOOL_DIR``) and to an
+in-memory list, and the request is answered straight away.  A background
+thread inserts the queued rows, ``SUGGESTION_BATCH_SIZE`` per transaction,
+as soon as a full batch is waiting or the oldest row has waited
+``SUGGESTION_FLUSH_INTERVAL`` seconds, then atomically rewrites the spool
+with whatever is still queued.  The spool therefore always holds exactly the
+rows not yet committed.
+
+Each worker holds an exclusive ``flock`` on ``suggestions-<pid>.lock`` while
+it runs.  A starting queue adopts every spool whose lock nobody holds (left
+behind by a worker that crashed or was killed), so a crash loses nothing.
+Delivery is at-least-once: a crash between a commit and the spool rewrite
+inserts that batch again on recovery.  Spool writes reach the OS on every
+post; ``SUGGESTION_SPOOL_FSYNC=1`` also forces them to disk, which survives
+power loss at the cost of an fsync per post.
+
+Posts are checked with ``validate_suggestion`` before they are queued.  A
+batch the database still refuses (a term deleted meanwhile, a spool written
+by an older version) is retried row by row, and the rows that fail again
+are moved to ``dead-suggestions.jsonl`` with the error instead of blocking
+the queue.
+
+``rate_limiter`` caps posts per client address in every mode when
+``SUGGESTION_RATE_LIMIT`` is set (it is off by default).  Behind a proxy the
+peer address is the proxy's, so ``PROXY_HOPS`` must be configured for the
+limit to apply per client rather than to everyone at once.  Both the limiter
+and the queue are per process, so the effective limit scales with the
+number of workers.
+"""
+import atexit
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+
+from metrics import registry, Counter, Gauge, Histogram
+from models import db, Suggestion, Term
+
+FIELDS = ('term_id', 'suggestion_type', 'content', 'submitter_email', 'submitter_name')
+SUGGESTION_TYPES = ('new_term', 'correction', 'addition')
+DEAD_LETTER = 'dead-suggestions.jsonl'
+
+SUGGESTIONS_WRITTEN = registry.add(Counter(
+    'tcm_suggestions_written_total', 'Queued suggestions committed to the database'))
+SUGGESTIONS_REJECTED = registry.add(Counter(
+    'tcm_suggestions_rejected_total', 'Suggestions refused before reaching the database', ('reason',)))
+FLUSH_SECONDS = registry.add(Histogram(
+    'tcm_suggestion_flush_seconds', 'Time to write one batch of queued suggestions'))
+QUEUE_DEPTH = registry.add(Gauge(
+    'tcm_suggestion_queue_depth', 'Suggestions waiting to be written by this worker'))
+
+
+class QueueFull(Exception):
+    """Raised by ``SuggestionQueue.put`` when the queue is at its maximum size"""
+
+
+class RateLimiter:
+    """Sliding window of at most ``limit`` events per ``window`` seconds per key"""
+
+    def __init__(self, limit=10, window=60, max_keys=10000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self.events = {}
+        self.lock = threading.Lock()
+
+    def allow(self, key, now=None):
+        """Record an event for ``key`` and return False if it is over the limit"""
+        if self.limit <= 0:
+            return True
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            recent = self.events.get(key)
+            if recent is None:
+                if len(self.events) >= self.max_keys:
+                    self._prune(now)
+                self.events[key] = recent = deque()
+            while recent and recent[0] <= now - self.window:
+                recent.popleft()
+            if len(recent) >= self.limit:
+                return False
+            recent.append(now)
+            return True
+
+    def _prune(self, now):
+        expired = [key for key, recent in self.events.items() if not recent or recent[-1] <= now - self.window]
+        for key in expired:
+            del self.events[key]
+
+
+rate_limiter = RateLimiter()
+
+
+def validate_suggestion(values):
+    """Return why ``values`` cannot be stored as a ``Suggestion``, or None"""
+    if not (values.get('content') or '').strip():
+        return 'Please describe your suggestion.'
+    if values.get('suggestion_type') not in SUGGESTION_TYPES:
+        return 'Please choose the type of suggestion.'
+    for field in ('submitter_email', 'submitter_name'):
+        value = values.get(field)
+        if value and len(value) > Suggestion.__table__.c[field].type.length:
+            return 'Your name or email address is too long.'
+    if values.get('term_id') is not None and db.session.get(Term, values['term_id']) is None:
+        return 'There is no term with that ID.'
+    return None
+
+
+def _read_spool(path):
+    """Records in a spool file; a line cut short by a crash is skipped"""
+    records = []
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def _remove_if_present(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _to_row(record):
+    row = {field: record.get(field) for field in FIELDS}
+    row['status'] = 'pending'
+    row['created_at'] = datetime.fromisoformat(record['created_at']) if record.get('created_at') else datetime.utcnow()
+    return row
+
+
+class SuggestionQueue:
+    """Per-process write-behind queue of ``Suggestion`` rows, see the module docstring"""
+
+    def __init__(self, app, spool_dir, batch_size=100, flush_interval=2.0, max_size=10000, fsync=False):
+        self.app = app
+        self.spool_dir = spool_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.fsync = fsync
+        self.records = []
+        self.oldest = None
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pid = os.getpid()
+        self.spool_path = os.path.join(spool_dir, f'suggestions-{self.pid}.jsonl')
+        self.lock_file = None
+        self.spool = None
+        self.thread = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def start(self):
+        """Lock this process's spool, adopt orphaned ones and start the flusher thread"""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.lock_file = open(self.spool_path[:-len('.jsonl')] + '.lock', 'w')
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # A previous process with the same pid may have left rows behind
+        self.records = _read_spool(self.spool_path)
+        for path in sorted(glob.glob(os.path.join(self.spool_dir, 'suggestions-*.jsonl'))):
+            if path != self.spool_path:
+                self.records.extend(self._adopt(path))
+        self._rewrite_spool()
+        if self.records:
+            self.oldest = time.monotonic()
+            self.app.logger.info('Recovered %d queued suggestions', len(self.records))
+        self.thread = threading.Thread(target=self._run, name='suggestion-flusher', daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def _adopt(self, path):
+        """Records of another worker's spool if that worker is gone, else nothing"""
+        lock_path = path[:-len('.jsonl')] + '.lock'
+        with open(lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return []
+            # Another worker adopted it between our glob and the lock (and
+            # the open above recreated its lock file)
+            if not os.path.exists(path):
+                _remove_if_present(lock_path)
+                return []
+            records = _read_spool(path)
+            # Our own spool is rewritten with these records before the orphan goes
+            self._write_spool(self.records + records)
+            _remove_if_present(path)
+            _remove_if_present(lock_path)
+        return records
+
+    def put(self, values):
+        """Queue one suggestion (a mapping with the ``FIELDS``); raises ``QueueFull``"""
+        record = {field: values.get(field) for field in FIELDS}
+        record['created_at'] = datetime.utcnow().isoformat()
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self.lock:
+            if len(self.records) >= self.max_size:
+                raise QueueFull()
+            self.spool.write(line)
+            self.spool.flush()
+            if self.fsync:
+                os.fsync(self.spool.fileno())
+            self.records.append(record)
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+            if len(self.records) >= self.batch_size:
+                self.wakeup.set()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if self.oldest is None:
+                    timeout = self.flush_interval
+                else:
+                    timeout = max(0.0, self.oldest + self.flush_interval - time.monotonic())
+            self.wakeup.wait(timeout)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Writing queued suggestions failed; retrying')
+                time.sleep(self.flush_interval)
+
+    def flush(self):
+        """Write every queued suggestion now; return the number of rows written"""
+        with self.flush_lock:
+            with self.lock:
+                pending = list(self.records)
+            written = done = 0
+            try:
+                with self.app.app_context():
+                    for start in range(0, len(pending), self.batch_size):
+                        batch = pending[start:start + self.batch_size]
+                        started = time.perf_counter()
+                        try:
+                            db.session.execute(insert(Suggestion), [_to_row(record) for record in batch])
+                            db.session.commit()
+                            written += len(batch)
+                        except (DataError, IntegrityError):
+                            db.session.rollback()
+                            written += self._write_each(batch)
+                        FLUSH_SECONDS.observe(time.perf_counter() - started)
+                        done += len(batch)
+            finally:
+                if written:
+                    SUGGESTIONS_WRITTEN.inc(amount=written)
+                if done:
+                    with self.lock:
+                        del self.records[:done]
+                        self.oldest = time.monotonic() if self.records else None
+                        self._rewrite_spool()
+            return written
+
+    def _write_each(self, batch):
+        # One transaction per row, so that only the rows the database refuses are set aside
+        written = 0
+        for record in batch:
+            try:
+                db.session.execute(insert(Suggestion), [_to_row(record)])
+                db.session.commit()
+                written += 1
+            except (DataError, IntegrityError) as e:
+                db.session.rollback()
+                self._dead_letter(record, e)
+        return written
+
+    def _dead_letter(self, record, error):
+        SUGGESTIONS_REJECTED.inc('invalid')
+        self.app.logger.warning('Moved a queued suggestion the database refused to %s: %s', DEAD_LETTER, error.orig)
+        with open(os.path.join(self.spool_dir, DEAD_LETTER), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(dict(record, error=str(error.orig)), ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_spool(self, records):
+        temporary = self.spool_path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.spool_path)
+
+    def _rewrite_spool(self):
+        """Replace the spool with the records still queued; caller holds ``lock``"""
+        if self.spool is not None:
+            self.spool.close()
+        self._write_spool(self.records)
+        self.spool = open(self.spool_path, 'a', encoding='utf-8')
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_suggestion_queue(app):
+    """Return this process's queue, starting it on first use (after any fork)"""
+    global _queue
+    queue = _queue
+    if queue is None or queue.pid != os.getpid():
+        with _queue_lock:
+            if _queue is None or _queue.pid != os.getpid():
+                config = app.config
+                _queue = SuggestionQueue(
+                    app,
+                    config['SUGGESTION_SPOOL_DIR'],
+                    batch_size=config['SUGGESTION_BATCH_SIZE'],
+                    flush_interval=config['SUGGESTION_FLUSH_INTERVAL'],
+                    max_size=config['SUGGESTION_QUEUE_MAX'],
+                    fsync=config['SUGGESTION_SPOOL_FSYNC']
+                )
+                _queue.start()
+            queue = _queue
+    return queue
+
+
+QUEUE_DEPTH.func = lambda: len(_queue) if _queue is not None and _queue.pid == os.getpid() else 0
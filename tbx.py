@@ -0,0 +1,145 @@
+"""TBX (TermBase eXchange) mapping for the termbase.
+
+One ``termEntry`` per term.  The category goes in a ``subjectField``
+descrip on the entry, together with ``subcategory``, ``etymology`` and
+``clinicalNotes`` descrips and ``source``, ``whoStandard`` (true/false) and
+``reliabilityScore`` admins, so an export re-imports without losing
+fields.  Each ``langSet`` holds the terms of one language:
+
+* ``zh-Hans`` (or ``zh``, ``zh-CN``): chinese_simplified, with the pinyin in a
+  ``pronunciation`` termNote and definition_zh in a ``definition`` descrip
+* ``zh-Hant`` (or ``zh-TW``, ``zh-HK``): chinese_traditional
+* ``en``: the first term is english_term, further terms are the aliases,
+  definition_en is the ``definition`` descrip
+"""
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, quoteattr
+
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+
+SIMPLIFIED_LANGS = {'zh', 'zh-hans', 'zh-cn', 'zh-sg'}
+TRADITIONAL_LANGS = {'zh-hant', 'zh-tw', 'zh-hk', 'zh-mo'}
+
+# Entry-level descrip and admin types and the fields they hold
+ENTRY_DESCRIPS = {'subcategory': 'subcategory', 'etymology': 'etymology', 'clinicalNotes': 'clinical_notes'}
+ENTRY_ADMINS = {'source': 'source', 'whoStandard': 'who_standard', 'reliabilityScore': 'reliability_score'}
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _entry_to_record(entry):
+    record = {}
+    english_terms = []
+    for child in entry:
+        name = _local(child.tag)
+        if name == 'descrip':
+            kind = child.get('type')
+            if kind == 'subjectField':
+                record['category'] = (child.text or '').strip()
+            elif kind in ENTRY_DESCRIPS:
+                record[ENTRY_DESCRIPS[kind]] = (child.text or '').strip()
+        elif name == 'admin' and child.get('type') in ENTRY_ADMINS:
+            record[ENTRY_ADMINS[child.get('type')]] = (child.text or '').strip()
+        elif name == 'langSet':
+            lang = (child.get(XML_LANG) or child.get('lang') or '').lower()
+            definition = None
+            terms = []
+            pronunciation = None
+            for node in child.iter():
+                node_name = _local(node.tag)
+                if node_name == 'term':
+                    terms.append((node.text or '').strip())
+                elif node_name == 'termNote' and node.get('type') == 'pronunciation':
+                    pronunciation = (node.text or '').strip()
+                elif node_name == 'descrip' and node.get('type') == 'definition':
+                    definition = (node.text or '').strip()
+            if lang.startswith('en'):
+                english_terms.extend(terms)
+                if definition:
+                    record['definition_en'] = definition
+            elif lang in TRADITIONAL_LANGS:
+                if terms:
+                    record['chinese_traditional'] = terms[0]
+            elif lang in SIMPLIFIED_LANGS:
+                if terms:
+                    record['chinese_simplified'] = terms[0]
+                if pronunciation:
+                    record['pinyin'] = pronunciation
+                if definition:
+                    record['definition_zh'] = definition
+    if english_terms:
+        record['english_term'] = english_terms[0]
+        if len(english_terms) > 1:
+            record['english_aliases'] = ', '.join(english_terms[1:])
+    return record
+
+
+def iter_tbx_records(fileobj):
+    """Stream term records out of a TBX file without building the whole tree"""
+    parents = []
+    for event, element in ElementTree.iterparse(fileobj, events=('start', 'end')):
+        if event == 'start':
+            parents.append(element)
+            continue
+        parents.pop()
+        if _local(element.tag) in ('termEntry', 'conceptEntry'):
+            yield _entry_to_record(element)
+            # Detach parsed entries so memory stays flat
+            if parents:
+                parents[-1].remove(element)
+
+
+TBX_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<martif type="TBX-Basic" xml:lang="en">\n'
+    '<martifHeader><fileDesc><sourceDesc><p>TCM Termbase export</p></sourceDesc></fileDesc></martifHeader>\n'
+    '<text><body>\n'
+)
+
+TBX_FOOTER = '</body></text>\n</martif>\n'
+
+
+def _element(tag, text, **attrs):
+    attributes = ''.join(f' {name}={quoteattr(value)}' for name, value in attrs.items())
+    return f'<{tag}{attributes}>{escape(text)}</{tag}>'
+
+
+def tbx_entry(record):
+    """Serialise one term record as a ``termEntry`` element"""
+    parts = [f'<termEntry id={quoteattr("t" + str(record["id"]))}>']
+    if record.get('category'):
+        parts.append(_element('descrip', record['category'], type='subjectField'))
+    for kind, field in ENTRY_DESCRIPS.items():
+        if record.get(field):
+            parts.append(_element('descrip', record[field], type=kind))
+    if record.get('source'):
+        parts.append(_element('admin', record['source'], type='source'))
+    if record.get('who_standard') is not None:
+        parts.append(_element('admin', 'true' if record['who_standard'] else 'false', type='whoStandard'))
+    if record.get('reliability_score') is not None:
+        parts.append(_element('admin', str(record['reliability_score']), type='reliabilityScore'))
+
+    parts.append('<langSet xml:lang="zh-Hans">')
+    if record.get('definition_zh'):
+        parts.append(_element('descrip', record['definition_zh'], type='definition'))
+    parts.append('<tig>' + _element('term', record['chinese_simplified']))
+    if record.get('pinyin'):
+        parts.append(_element('termNote', record['pinyin'], type='pronunciation'))
+    parts.append('</tig></langSet>')
+
+    if record.get('chinese_traditional'):
+        parts.append('<langSet xml:lang="zh-Hant"><tig>'
+                     + _element('term', record['chinese_traditional'])
+                     + '</tig></langSet>')
+
+    parts.append('<langSet xml:lang="en">')
+    if record.get('definition_en'):
+        parts.append(_element('descrip', record['definition_en'], type='definition'))
+    english_terms = [record['english_term']]
+    english_terms.extend(alias.strip() for alias in (record.get('english_aliases') or '').split(',') if alias.strip())
+    for term in english_terms:
+        parts.append('<tig>' + _element('term', term) + '</tig>')
+    parts.append('</langSet></termEntry>\n')
+    return ''.join(parts)
@@ -0,0 +1,39 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# app.py reads its configuration at import time
+_instance = tempfile.mkdtemp(prefix='tcm-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_instance, 'termbase.db')
+os.environ['SNAPSHOT_PATH'] = os.path.join(_instance, 'termbase.snapshot')
+os.environ['FRAGMENT_CACHE_PATH'] = os.path.join(_instance, 'fragments.sqlite')
+os.environ['SUGGESTION_SPOOL_DIR'] = os.path.join(_instance, 'suggestion-spool')
+os.environ['ASSETS_DIR'] = os.path.join(_instance, 'assets')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app, init_database  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        init_database()
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def search_engine(app, monkeypatch):
+    """Switch SEARCH_ENGINE for one test"""
+    def use(name):
+        monkeypatch.setitem(app.config, 'SEARCH_ENGINE', name)
+        app.extensions.pop('search_backend', None)
+    yield use
+    app.extensions.pop('search_backend', None)
@@ -0,0 +1,40 @@
+import pytest
+
+
+def test_batch_terms_rejects_bad_ids(client):
+    response = client.get('/api/terms?ids=1,abc')
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('body', [
+    [1, 2],
+    'ids',
+    {'ids': '1,2'},
+    {'ids': [1, 'two']},
+    {'ids': [1, None]},
+    {'ids': [1], 'fields': 5},
+    {'ids': [1], 'fields': [5]},
+])
+def test_batch_terms_rejects_malformed_json(client, body):
+    response = client.post('/api/terms', json=body)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_batch_terms_accepts_a_list_of_ids(client):
+    response = client.post('/api/terms', json={'ids': [1, 2], 'fields': ['english_term']})
+    assert response.status_code == 200
+    assert [term['id'] for term in response.get_json()] == [1, 2]
+
+
+@pytest.mark.parametrize('body', [['text'], 'text', 5, {'text': 5}, {'text': ['a']}])
+def test_annotate_rejects_malformed_json(client, body):
+    response = client.post('/api/annotate', json=body)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_annotate_accepts_a_text_object(client):
+    response = client.post('/api/annotate', json={'text': ''})
+    assert response.status_code == 200
+    assert response.get_json()['count'] == 0
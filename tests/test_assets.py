@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+import assets
+from assets import Assets, build_assets
+from warmup import warm_up
+
+
+def test_missing_identity_file_fails_the_load(app, tmp_path):
+    manifest = build_assets(app.root_path, str(tmp_path))
+    os.remove(tmp_path / manifest['index.html'])
+    with pytest.raises(FileNotFoundError):
+        Assets(str(tmp_path))
+
+
+def test_missing_brotli_file_is_optional(app, tmp_path):
+    manifest = build_assets(app.root_path, str(tmp_path))
+    built = manifest['index.html']
+    if os.path.exists(tmp_path / (built + '.br')):
+        os.remove(tmp_path / (built + '.br'))
+    encoding, _ = Assets(str(tmp_path)).variant(built, {'br': 1, 'gzip': 1})
+    assert encoding == 'gzip'
+
+
+def test_warm_up_builds_the_pages_before_fork(app, client, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'ASSETS_DIR', str(tmp_path))
+    monkeypatch.setattr(assets, '_assets', None)
+    warm_up(app)
+    assert os.path.exists(tmp_path / 'manifest.json')
+    response = client.get('/pages/index.html')
+    assert response.status_code == 302
+    assert client.get(response.headers['Location']).status_code == 200
+
+
+def test_pages_of_earlier_builds_are_still_served(app, client, tmp_path, monkeypatch):
+    source = tmp_path / 'source'
+    source.mkdir()
+    for name in assets.PAGES:
+        (source / name).write_text(f'<p>old {name}</p>')
+    old = build_assets(str(source), str(tmp_path / 'assets'))
+    (source / 'index.html').write_text('<p>new index.html</p>')
+    build_assets(str(source), str(tmp_path / 'assets'))
+    monkeypatch.setitem(app.config, 'ASSETS_DIR', str(tmp_path / 'assets'))
+    monkeypatch.setattr(assets, '_assets', None)
+
+    response = client.get(f"/pages/{old['index.html']}", headers={'Accept-Encoding': 'identity'})
+    assert response.status_code == 200
+    assert response.data == b'<p>old index.html</p>'
+    assert client.get('/pages/index.0123456789ab.html').status_code == 404
+    assert client.get('/pages/manifest.json').status_code == 404
@@ -0,0 +1,40 @@
+import threading
+
+import autocomplete
+from caching import StaleWhileRebuild
+from models import db, Term
+
+
+def test_stale_copy_is_served_while_rebuilding(app):
+    cache = StaleWhileRebuild('test structure')
+    release = threading.Event()
+    builds = []
+
+    def build():
+        builds.append(len(builds))
+        if len(builds) > 1:
+            release.wait(5)
+        return len(builds)
+
+    with app.app_context():
+        assert cache.get(build) == 1
+        cache.invalidate()
+        # Answered from the old copy while the rebuild is blocked
+        assert cache.get(build) == 1
+        assert cache.get(build) == 1
+        release.set()
+        cache.thread.join(5)
+        assert cache.get(build) == 2
+        assert builds == [0, 1]
+
+
+def test_autocomplete_picks_up_edits_without_an_inline_rebuild(app):
+    with app.app_context():
+        index = autocomplete.get_autocomplete_index()
+        term = Term.query.order_by(Term.id).first()
+        term.english_term = 'Wombat Heat'
+        db.session.commit()
+        assert autocomplete.get_autocomplete_index() is index
+        autocomplete._index.thread.join(10)
+        results = autocomplete.get_autocomplete_index().lookup('wombat')
+        assert [result['id'] for result in results] == [term.id]
@@ -0,0 +1,69 @@
+from datetime import datetime
+
+from sqlalchemy import insert, update
+
+from change_log import change_poller
+from models import db, build_search_keys, build_search_text, Term, TermChange, SEARCH_TEXT_FIELDS
+from warmup import warm_up
+
+
+def _edit_in_other_worker(term_id, **changes):
+    """Commit an edit and its log row the way another process would, without local notifications"""
+    term = db.session.get(Term, term_id)
+    values = {name: getattr(term, name) for name in SEARCH_TEXT_FIELDS}
+    values.update(changes)
+    changes.update(build_search_keys(values), search_text=build_search_text(values))
+    db.session.rollback()
+    with db.engine.begin() as connection:
+        connection.execute(update(Term).where(Term.id == term_id).values(**changes))
+        connection.execute(insert(TermChange).values(
+            term_id=term_id, op='update', origin='other-host:1', created_at=datetime.utcnow()))
+
+
+def test_edit_between_warmup_and_first_request_reaches_worker(app, client, search_engine, monkeypatch):
+    search_engine('ngram')
+    monkeypatch.setattr(change_poller, 'last_id', None)
+    warm_up(app)
+
+    with app.app_context():
+        term_id = Term.query.order_by(Term.id).first().id
+        _edit_in_other_worker(term_id, english_term='Warmup Race Quokka')
+
+    # The worker's first request after fork
+    monkeypatch.setattr(change_poller, 'checked', 0.0)
+    body = client.get('/search?q=quokka').get_data(as_text=True)
+    assert 'Warmup Race Quokka' in body
+
+
+def test_own_writes_are_not_delivered_again(app, monkeypatch):
+    with app.app_context():
+        change_poller.start()
+        term = Term.query.order_by(Term.id).first()
+        term.english_aliases = (term.english_aliases or '') + ', own write'
+        db.session.commit()
+        assert change_poller.poll() == 0
+
+
+def test_index_deltas_are_read_from_the_primary(app, tmp_path, search_engine, monkeypatch):
+    import sqlalchemy as sa
+    from flask import g
+
+    from db_routing import copy_sqlite_database
+    from search_index import get_search_index
+
+    search_engine('ngram')
+    with app.app_context():
+        get_search_index()
+        replica = sa.create_engine(f'sqlite:///{tmp_path}/replica.db')
+        copy_sqlite_database(db.engine, replica)
+        monkeypatch.setitem(db._app_engines[app], 'replica_0', replica)
+        term = Term.query.order_by(Term.id.desc()).first()
+        term.english_term = 'Replica Lag Numbat'
+        db.session.commit()
+        term_id = term.id
+
+    # The replica has not caught up with the edit yet
+    with app.test_request_context('/search'):
+        g.replica_reads = True
+        index = get_search_index()
+        assert index.search('numbat') == [term_id]
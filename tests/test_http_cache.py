@@ -0,0 +1,78 @@
+from sqlalchemy import delete
+
+from models import db, Category, RelatedTerm, Term
+from related import build_related, fallback_related_query, related_terms_for
+
+
+def _term_with_category(app):
+    with app.app_context():
+        term = Term.query.filter(Term.category_id.isnot(None)).order_by(Term.id).first()
+        return term.id, term.category_id
+
+
+def test_renaming_the_category_changes_the_etag(app, client):
+    term_id, category_id = _term_with_category(app)
+    first = client.get(f'/term/{term_id}')
+    etag = first.headers['ETag']
+    with app.app_context():
+        category = db.session.get(Category, category_id)
+        old_name = category.name_en
+        category.name_en = 'Renamed Category'
+        db.session.commit()
+    try:
+        second = client.get(f'/term/{term_id}', headers={'If-None-Match': etag})
+        assert second.status_code == 200
+        assert second.headers['ETag'] != etag
+        assert b'Renamed Category' in second.data
+    finally:
+        with app.app_context():
+            db.session.get(Category, category_id).name_en = old_name
+            db.session.commit()
+
+
+def test_rebuilding_related_terms_changes_the_etag(app, client):
+    term_id, _ = _term_with_category(app)
+    etag = client.get(f'/term/{term_id}').headers['ETag']
+    with app.app_context():
+        build_related()
+    response = client.get(f'/term/{term_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert client.get(f'/term/{term_id}', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+
+def _rename(app, term_id, name):
+    with app.app_context():
+        term = db.session.get(Term, term_id)
+        old_name, term.english_term = term.english_term, name
+        db.session.commit()
+        return old_name
+
+
+def _renaming_a_listed_term_changes_the_etag(app, client, term_id, related_id):
+    first = client.get(f'/term/{term_id}')
+    old_name = _rename(app, related_id, 'Renamed Related Term')
+    try:
+        response = client.get(f'/term/{term_id}', headers={'If-None-Match': first.headers['ETag']})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != first.headers['ETag']
+        assert b'Renamed Related Term' in response.data
+    finally:
+        _rename(app, related_id, old_name)
+
+
+def test_renaming_a_related_term_changes_the_etag(app, client):
+    term_id, _ = _term_with_category(app)
+    with app.app_context():
+        build_related()
+        related_id = related_terms_for(term_id)[0].id
+    _renaming_a_listed_term_changes_the_etag(app, client, term_id, related_id)
+
+
+def test_renaming_a_same_category_term_changes_the_etag(app, client):
+    term_id, category_id = _term_with_category(app)
+    with app.app_context():
+        db.session.execute(delete(RelatedTerm))
+        db.session.commit()
+        related_id = fallback_related_query(term_id, category_id).first().id
+    _renaming_a_listed_term_changes_the_etag(app, client, term_id, related_id)
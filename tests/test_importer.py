@@ -0,0 +1,80 @@
+import io
+
+from exporter import export_terms
+from importer import import_terms
+from models import db, Term
+
+
+def _import(app, text, fmt='csv'):
+    with app.app_context():
+        return import_terms(io.BytesIO(text.encode('utf-8')), fmt)
+
+
+def _term(app, chinese, english):
+    with app.app_context():
+        term = Term.query.filter_by(chinese_simplified=chinese, english_term=english).one()
+        db.session.expunge(term)
+        return term
+
+
+def test_partial_upsert_keeps_columns_missing_from_the_file(app):
+    _import(app, 'chinese_simplified,english_term,definition_en,english_aliases,who_standard,reliability_score,category\n'
+                 '寒凝,Cold Congealing,Cold that congeals,Congealed Cold,true,5,Fundamental Theories\n')
+    before = _term(app, '寒凝', 'Cold Congealing')
+
+    report = _import(app, 'chinese_simplified,english_term,definition_zh\n寒凝,Cold Congealing,寒邪凝滞\n')
+
+    assert report.updated == 1
+    after = _term(app, '寒凝', 'Cold Congealing')
+    assert after.definition_zh == '寒邪凝滞'
+    assert after.definition_en == 'Cold that congeals'
+    assert after.english_aliases == 'Congealed Cold'
+    assert after.who_standard is True
+    assert after.reliability_score == 5
+    assert after.category_id == before.category_id is not None
+    # search_text still covers the columns the file did not contain
+    assert 'congealed cold' in after.search_text and '寒邪凝滞' in after.search_text
+
+
+def test_new_terms_from_a_partial_file_get_defaults(app):
+    _import(app, '{"chinese_simplified": "湿阻", "english_term": "Dampness Obstruction"}\n', 'jsonl')
+    term = _term(app, '湿阻', 'Dampness Obstruction')
+    assert term.who_standard is False and term.reliability_score == 3 and term.category_id is None
+
+
+def test_tbx_round_trip_keeps_every_field(app):
+    _import(app, 'chinese_simplified,english_term,etymology,clinical_notes,who_standard,reliability_score\n'
+                 '痰饮,Phlegm Fluid,From 金匮要略,Common in cough,true,4\n')
+    with app.app_context():
+        exported = b''.join(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8')
+                            for chunk in export_terms('tbx'))
+        term = Term.query.filter_by(chinese_simplified='痰饮').one()
+        term.etymology, term.clinical_notes, term.who_standard, term.reliability_score = None, None, False, 1
+        db.session.commit()
+
+    with app.app_context():
+        import_terms(io.BytesIO(exported), 'tbx')
+    term = _term(app, '痰饮', 'Phlegm Fluid')
+    assert (term.etymology, term.clinical_notes, term.who_standard, term.reliability_score) == \
+        ('From 金匮要略', 'Common in cough', True, 4)
+
+
+def test_non_string_and_overlong_text_fields_are_rejected(app):
+    report = _import(app, '{"chinese_simplified": 123, "english_term": "Numeric Name"}\n'
+                          '{"chinese_simplified": "长名", "english_term": "' + 'x' * 301 + '"}\n'
+                          '{"chinese_simplified": "气滞", "english_term": "Qi Stagnation Valid", "pinyin": ["qi"]}\n'
+                          '{"chinese_simplified": "气郁", "english_term": "Qi Constraint Valid"}\n', 'jsonl')
+    assert report.inserted == 1
+    assert [reason for _, reason in report.rejected] == [
+        'chinese_simplified must be a string',
+        'english_term is longer than 300 characters',
+        'pinyin must be a string',
+    ]
+
+
+def test_truncated_tbx_file_is_a_bad_request(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'ADMIN_TOKEN', 'import-secret')
+    response = client.post('/admin/import?format=tbx', data=b'<martif><text><body><termEntry',
+                           headers={'Authorization': 'Bearer import-secret'})
+    assert response.status_code == 400
+    assert response.get_json()['error'].startswith('malformed tbx file')
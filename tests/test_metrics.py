@@ -0,0 +1,68 @@
+import json
+import os
+
+import metrics
+from metrics import Counter, Gauge, Histogram, Registry, SharedMetrics
+
+
+def _registry():
+    registry = Registry()
+    requests = registry.add(Counter('requests_total', 'Requests', ('status',)))
+    seconds = registry.add(Histogram('seconds', 'Latency', buckets=(0.1, 1.0)))
+    registry.add(Gauge('depth', 'Queue depth', lambda: 7))
+    return registry, requests, seconds
+
+
+def _other_worker(directory, pid, requests, observations):
+    snapshot = {'pid': pid, 'metrics': {
+        'requests_total': [[['200'], requests]],
+        'seconds': [[[], observations]],
+        'depth': 3,
+    }}
+    with open(os.path.join(directory, f'{pid}.json'), 'w') as f:
+        json.dump(snapshot, f)
+
+
+def test_workers_are_summed_and_exited_workers_archived(tmp_path):
+    registry, requests, seconds = _registry()
+    shared = SharedMetrics(registry, str(tmp_path))
+    requests.inc('200', amount=2)
+    seconds.observe(0.05)
+    _other_worker(tmp_path, 999001, 5, [1, 0, 1, 2.5])
+    _other_worker(tmp_path, 999002, 1, [0, 1, 0, 0.5])
+
+    text = registry.render(shared.collect())
+    assert 'requests_total{status="200"} 8' in text
+    assert 'seconds_bucket{le="+Inf"} 4' in text
+    assert f'depth{{worker="{os.getpid()}"}} 7' in text
+    assert 'depth{worker="999001"} 3' in text
+
+    shared.archive(999001)
+    assert not os.path.exists(tmp_path / '999001.json')
+    text = registry.render(shared.collect())
+    # The exited worker's counts stay, its gauge goes
+    assert 'requests_total{status="200"} 8' in text
+    assert 'seconds_count 4' in text
+    assert 'worker="999001"' not in text
+
+
+def test_metrics_endpoint_reports_every_worker(app, client, tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'shared', SharedMetrics(metrics.registry, str(tmp_path)))
+    with open(tmp_path / '999003.json', 'w') as f:
+        json.dump({'pid': 999003, 'metrics': {'tcm_suggestion_queue_depth': 4}}, f)
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert b'tcm_suggestion_queue_depth{worker="999003"} 4' in response.data
+    assert os.path.exists(tmp_path / f'{os.getpid()}.json')
+
+
+def test_metrics_need_the_token(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 'scrape-secret')
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'}).status_code == 200
+
+
+def test_metrics_without_token_are_loopback_only(app, client):
+    assert client.get('/metrics').status_code == 200
+    assert client.get('/metrics', environ_base={'REMOTE_ADDR': '203.0.113.9'}).status_code == 401
@@ -0,0 +1,44 @@
+import pytest
+from sqlalchemy import func
+
+from models import Term
+from pagination import decode_cursor, encode_cursor, key_types
+
+BAD_CURSORS = [
+    encode_cursor(('not a number',), 2),
+    encode_cursor((1, 2, 3, 4), 2),
+    encode_cursor(([1], {'a': 1}), 2),
+    encode_cursor((True, 5), 2),
+    encode_cursor((1, 5), 0),
+    'bm90IGpzb24',
+]
+
+
+def test_decode_cursor_checks_key_arity_and_types():
+    types = key_types((func.coalesce(Term.pinyin, ''), Term.id))
+    assert decode_cursor(encode_cursor(('qi', 7), 3), types) == (('qi', 7), 3)
+    assert decode_cursor(encode_cursor((7, 'qi'), 3), types) is None
+    assert decode_cursor(encode_cursor(('qi',), 3), types) is None
+    assert decode_cursor(encode_cursor(('qi', None), 3), types) is None
+
+
+def test_computed_columns_accept_any_scalar():
+    types = key_types((func.bm25(Term.id), Term.id))
+    assert decode_cursor(encode_cursor((-1.5, 7), 2), types) == ((-1.5, 7), 2)
+
+
+@pytest.mark.parametrize('cursor', BAD_CURSORS)
+@pytest.mark.parametrize('engine', ['database', 'ngram', 'snapshot'])
+@pytest.mark.parametrize('direction', ['after', 'before'])
+def test_bad_search_cursor_falls_back_to_first_page(client, search_engine, engine, cursor, direction):
+    search_engine(engine)
+    first = client.get('/search?q=qi')
+    response = client.get(f'/search?q=qi&{direction}={cursor}')
+    assert response.status_code == 200
+    assert response.get_data() == first.get_data()
+
+
+@pytest.mark.parametrize('cursor', BAD_CURSORS)
+def test_bad_browse_cursor_falls_back_to_first_page(client, cursor):
+    assert client.get(f'/browse?after={cursor}').status_code == 200
+    assert client.get(f'/api/search/results?q=qi&before={cursor}').status_code == 200
@@ -0,0 +1,44 @@
+from sqlalchemy import delete
+
+from http_cache import response_cache
+from models import db, RelatedTerm, Term
+from related import build_related, build_related_incremental, related_terms_for
+
+
+def _pair(app, suffix):
+    """Two new terms that list each other as related"""
+    with app.app_context():
+        first = Term(chinese_simplified=f'蛟龙{suffix}', english_term=f'Wombat Qi Stagnation {suffix}',
+                     definition_en='wombat qi stagnation of the wombat channel')
+        second = Term(chinese_simplified=f'蛟龙{suffix}二', english_term=f'Wombat Qi Stasis {suffix}',
+                      definition_en='wombat qi stasis of the wombat channel')
+        db.session.add_all([first, second])
+        db.session.commit()
+        build_related()
+        assert second.id in [term.id for term in related_terms_for(first.id)]
+        return first.id, second.id
+
+
+def test_deleting_a_related_term_keeps_the_page(app, client):
+    first_id, second_id = _pair(app, 'orm')
+    with app.app_context():
+        db.session.delete(db.session.get(Term, second_id))
+        db.session.commit()
+        assert RelatedTerm.query.filter(RelatedTerm.related_term_id == second_id).count() == 0
+    response_cache.clear()
+    response = client.get(f'/term/{first_id}')
+    assert response.status_code == 200
+    assert b'Wombat Qi Stasis orm' not in response.data
+
+
+def test_rows_of_terms_deleted_outside_the_orm_are_skipped_and_pruned(app, client):
+    first_id, second_id = _pair(app, 'core')
+    with app.app_context():
+        db.session.execute(delete(Term).where(Term.id == second_id))
+        db.session.commit()
+    response_cache.clear()
+    assert client.get(f'/term/{first_id}').status_code == 200
+    with app.app_context():
+        build_related_incremental()
+        assert RelatedTerm.query.filter(RelatedTerm.related_term_id == second_id).count() == 0
+        assert RelatedTerm.query.filter(RelatedTerm.term_id == first_id).count() > 0
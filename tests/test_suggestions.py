@@ -0,0 +1,77 @@
+import json
+import os
+
+from models import Suggestion
+from suggestion_queue import SuggestionQueue, DEAD_LETTER
+
+
+def _count(app):
+    with app.app_context():
+        return Suggestion.query.count()
+
+
+def test_post_without_content_is_rejected(app, client):
+    before = _count(app)
+    response = client.post('/contribute', data={'suggestion_type': 'correction', 'content': ''})
+    assert response.status_code == 400
+    assert _count(app) == before
+
+
+def test_post_for_unknown_term_is_rejected(app, client):
+    response = client.post('/contribute', data={
+        'suggestion_type': 'correction', 'content': 'Typo', 'term_id': '999999'})
+    assert response.status_code == 400
+
+
+def test_valid_post_is_stored(app, client):
+    before = _count(app)
+    response = client.post('/contribute', data={'suggestion_type': 'new_term', 'content': 'Add 痰湿'})
+    assert response.status_code == 200
+    assert _count(app) == before + 1
+
+
+def test_refused_rows_are_dead_lettered_instead_of_blocking_the_queue(app, tmp_path):
+    queue = SuggestionQueue(app, str(tmp_path), batch_size=10, flush_interval=3600)
+    queue.start()
+    before = _count(app)
+    queue.put({'suggestion_type': 'addition', 'content': 'first'})
+    queue.put({'suggestion_type': 'addition', 'content': None})
+    queue.put({'suggestion_type': 'addition', 'content': 'third'})
+
+    assert queue.flush() == 2
+    assert len(queue) == 0
+    assert _count(app) == before + 2
+    with open(os.path.join(tmp_path, DEAD_LETTER), encoding='utf-8') as f:
+        dead = [json.loads(line) for line in f]
+    assert [record['content'] for record in dead] == [None]
+    assert 'error' in dead[0]
+    # The spool only holds rows still to be written
+    assert os.path.getsize(queue.spool_path) == 0
+
+
+def test_rate_limit_is_per_forwarded_client(app, monkeypatch):
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    from suggestion_queue import rate_limiter
+
+    monkeypatch.setattr(rate_limiter, 'limit', 1)
+    monkeypatch.setattr(rate_limiter, 'events', {})
+    monkeypatch.setattr(app, 'wsgi_app', ProxyFix(app.wsgi_app, x_for=1))
+    client = app.test_client()
+    data = {'suggestion_type': 'addition', 'content': 'More detail'}
+
+    def post(client_address):
+        return client.post('/contribute', data=data, headers={'X-Forwarded-For': client_address},
+                           environ_base={'REMOTE_ADDR': '10.0.0.1'}).status_code
+
+    assert post('203.0.113.1') == 200
+    assert post('203.0.113.2') == 200
+    assert post('203.0.113.1') == 429
+
+
+def test_spool_adopted_by_another_worker_is_skipped(app, tmp_path):
+    queue = SuggestionQueue(app, str(tmp_path), batch_size=10, flush_interval=3600)
+    queue.start()
+    # Globbed before the other worker adopted and removed it
+    orphan = os.path.join(str(tmp_path), 'suggestions-999999.jsonl')
+    assert queue._adopt(orphan) == []
+    assert not os.path.exists(orphan[:-len('.jsonl')] + '.lock')
@@ -0,0 +1,60 @@
+"""Startup warmup run once before gunicorn forks its workers.
+
+With ``preload_app`` (see gunicorn.conf.py) the master process imports the
+app, and ``warm_up`` then checks the database connection, builds the
+in-memory indexes the configuration uses, builds the standalone pages and
+compiles every template.  The
+workers fork with all of that already in memory (shared copy-on-write)
+instead of doing it on their first request.
+"""
+import time
+
+from annotate import get_annotator
+from assets import get_assets
+from autocomplete import get_autocomplete_index
+from change_log import change_poller
+from models import db
+from search_backends import get_search_backend
+from search_index import get_search_index
+from snapshot import get_snapshot
+from spelling import get_spelling_index
+
+
+def warm_up(app):
+    """Prime connections, indexes and templates; returns seconds per step"""
+    timings = {}
+    started = time.perf_counter()
+
+    def step(name, func):
+        begin = time.perf_counter()
+        func()
+        timings[name] = time.perf_counter() - begin
+
+    with app.app_context():
+        step('database', lambda: db.session.execute(db.select(1)))
+        # Before any index is built, so edits committed from here on reach every worker
+        step('change_log', change_poller.start)
+        step('search_backend', lambda: get_search_backend(app))
+        if app.config.get('SEARCH_ENGINE') == 'ngram':
+            step('search_index', get_search_index)
+        if app.config.get('SEARCH_ENGINE') == 'snapshot':
+            # Mapped once here; the workers inherit the mapping
+            step('snapshot', lambda: get_snapshot(app))
+        if app.config.get('AUTOCOMPLETE_INDEX'):
+            step('autocomplete_index', lambda: get_autocomplete_index(top_k=app.config['AUTOCOMPLETE_TOP_K']))
+        if app.config.get('DID_YOU_MEAN'):
+            step('spelling_index', get_spelling_index)
+        if app.config.get('WARMUP_ANNOTATOR'):
+            step('annotator', get_annotator)
+        # Built here rather than in the release phase, whose filesystem is thrown away
+        step('assets', lambda: get_assets(app, build=True))
+        step('templates', lambda: [app.jinja_env.get_template(name) for name in app.jinja_env.list_templates()])
+        db.session.remove()
+        # Connections must not be shared with forked workers
+        for engine in db.engines.values():
+            engine.dispose()
+
+    timings['total'] = time.perf_counter() - started
+    app.config['WARMUP_TIMINGS'] = timings
+    app.logger.info('Warmup finished in %.1f ms', timings['total'] * 1000)
+    return timings